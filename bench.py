@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+# Benchmarks of interpret.py
+# Programs are generated, every run is a separate process measured by os.wait4,
+# results are printed as JSON and can be compared with a stored baseline
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+
+INTERPRET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "interpret.py")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+Workload = namedtuple("Workload", ["source", "input", "instructions"])
+
+
+#######################
+# generated workloads #
+#######################
+
+
+def program_xml(source):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<program language="IPPcode21">']
+    for order, line in enumerate(filter(str.strip, source.splitlines()), 1):
+        opcode, *arguments = line.split()
+        lines.append('  <instruction order="{}" opcode="{}">'.format(order, opcode))
+        for index, argument in enumerate(arguments, 1):
+            arg_type, separator, value = argument.partition("@")
+            if arg_type in ("GF", "LF", "TF"):
+                arg_type, value = "var", argument
+            elif not separator:
+                arg_type, value = "label", argument
+            lines.append('    <arg{0} type="{1}">{2}</arg{0}>'.format(index, arg_type, escape(value)))
+        lines.append('  </instruction>')
+    lines.append('</program>')
+    return "\n".join(lines) + "\n"
+
+
+def arithmetic_workload(n):
+    source = program_xml("""
+        DEFVAR GF@i
+        DEFVAR GF@sum
+        DEFVAR GF@tmp
+        MOVE GF@i int@0
+        MOVE GF@sum int@0
+        LABEL loop
+        ADD GF@sum GF@sum GF@i
+        MUL GF@tmp GF@i int@3
+        IDIV GF@tmp GF@tmp int@2
+        SUB GF@sum GF@sum GF@tmp
+        ADD GF@i GF@i int@1
+        JUMPIFNEQ loop GF@i int@{n}
+        WRITE GF@sum
+    """.format(n=n))
+    return Workload(source, "", 7 + 6 * n)
+
+
+def string_workload(n):
+    source = program_xml("""
+        DEFVAR GF@s
+        DEFVAR GF@i
+        MOVE GF@s string@
+        MOVE GF@i int@0
+        LABEL build
+        CONCAT GF@s GF@s string@ab
+        ADD GF@i GF@i int@1
+        JUMPIFNEQ build GF@i int@{n}
+        LABEL edit
+        SUB GF@i GF@i int@1
+        SETCHAR GF@s GF@i string@x
+        JUMPIFNEQ edit GF@i int@0
+        STRLEN GF@i GF@s
+        WRITE GF@i
+    """.format(n=n))
+    return Workload(source, "", 8 + 6 * n)
+
+
+def read_workload(n):
+    source = program_xml("""
+        DEFVAR GF@line
+        DEFVAR GF@type
+        DEFVAR GF@sum
+        MOVE GF@sum int@0
+        LABEL read
+        READ GF@line type@int
+        TYPE GF@type GF@line
+        JUMPIFEQ done GF@type string@nil
+        ADD GF@sum GF@sum GF@line
+        JUMP read
+        LABEL done
+        WRITE GF@sum
+    """)
+    return Workload(source, "".join("{}\n".format(line) for line in range(n)), 9 + 5 * n)
+
+
+def large_program_workload(n):
+    source = program_xml("""
+        DEFVAR GF@x
+        MOVE GF@x int@0
+        {}
+        WRITE GF@x
+    """.format("ADD GF@x GF@x int@1\n" * n))
+    return Workload(source, "", 3 + n)
+
+
+def stack_workload(depth):
+    source = program_xml("""
+        DEFVAR GF@i
+        DEFVAR GF@sum
+        DEFVAR GF@value
+        MOVE GF@i int@0
+        MOVE GF@sum int@0
+        JUMPIFEQ pop GF@i int@{depth}
+        LABEL push
+        PUSHS GF@i
+        ADD GF@i GF@i int@1
+        JUMPIFNEQ push GF@i int@{depth}
+        LABEL pop
+        JUMPIFEQ done GF@i int@0
+        POPS GF@value
+        ADD GF@sum GF@sum GF@value
+        SUB GF@i GF@i int@1
+        JUMP pop
+        LABEL done
+        WRITE GF@sum
+    """.format(depth=depth))
+    return Workload(source, "", 10 + 8 * depth if depth else 8)
+
+
+def recursion_workload(n):
+    source = program_xml("""
+        DEFVAR GF@result
+        CREATEFRAME
+        DEFVAR TF@n
+        MOVE TF@n int@{n}
+        CALL fib
+        WRITE GF@result
+        JUMP end
+        LABEL fib
+        PUSHFRAME
+        DEFVAR LF@small
+        LT LF@small LF@n int@2
+        JUMPIFEQ base LF@small bool@true
+        DEFVAR LF@left
+        CREATEFRAME
+        DEFVAR TF@n
+        SUB TF@n LF@n int@1
+        CALL fib
+        MOVE LF@left GF@result
+        CREATEFRAME
+        DEFVAR TF@n
+        SUB TF@n LF@n int@2
+        CALL fib
+        ADD GF@result GF@result LF@left
+        POPFRAME
+        RETURN
+        LABEL base
+        MOVE GF@result LF@n
+        POPFRAME
+        RETURN
+        LABEL end
+    """.format(n=n))
+    calls = fib_calls(n)
+    return Workload(source, "", 7 + 17 * (calls - 1) // 2 + 7 * (calls + 1) // 2)
+
+
+def deep_recursion_workload(depth):
+    source = program_xml("""
+        DEFVAR GF@sum
+        MOVE GF@sum int@0
+        CREATEFRAME
+        DEFVAR TF@n
+        MOVE TF@n int@{depth}
+        CALL down
+        WRITE GF@sum
+        JUMP end
+        LABEL down
+        PUSHFRAME
+        ADD GF@sum GF@sum LF@n
+        JUMPIFEQ bottom LF@n int@0
+        CREATEFRAME
+        DEFVAR TF@n
+        SUB TF@n LF@n int@1
+        CALL down
+        POPFRAME
+        RETURN
+        LABEL bottom
+        POPFRAME
+        RETURN
+        LABEL end
+    """.format(depth=depth))
+    return Workload(source, "", 13 + 9 * depth)
+
+
+def fib_calls(n):
+    calls = [1, 1]
+    for _ in range(2, n + 1):
+        calls.append(calls[-1] + calls[-2] + 1)
+    return calls[n]
+
+
+SUITE = {
+    "arithmetic": (arithmetic_workload, 200000),
+    "strings": (string_workload, 50000),
+    "recursion": (recursion_workload, 20),
+    "deep_recursion": (deep_recursion_workload, 10000),
+    "stack": (stack_workload, 100000),
+    "read": (read_workload, 100000),
+    "large_program": (large_program_workload, 100000)
+}
+
+
+###############
+# measurement #
+###############
+
+
+def run_program(source_path, options=(), stderr=subprocess.DEVNULL, input_path=os.devnull):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, INTERPRET, "--source=" + source_path, "--input=" + input_path]
+                               + list(options), stdout=subprocess.DEVNULL, stderr=stderr)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_time": round(wall_time, 4),
+        "peak_rss_kb": usage.ru_maxrss
+    }
+
+
+def frame_statistics(text):
+    statistics = {}
+    for line in text.splitlines():
+        name, separator, count = line.strip().rpartition(": ")
+        if separator and count.isdigit():
+            statistics[name.replace(" ", "_")] = int(count)
+    return statistics
+
+
+def memory_benchmark(depth, options=()):
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for name, workload_depth in (("empty", 0), ("deep", depth)):
+            source_path = os.path.join(directory, name + ".xml")
+            with open(source_path, "w") as source_file:
+                source_file.write(stack_workload(workload_depth).source)
+            results[name] = run_program(source_path, options)
+
+    stack_bytes = (results["deep"]["peak_rss_kb"] - results["empty"]["peak_rss_kb"]) * 1024
+    return {
+        "benchmark": "memory",
+        "stack_depth": depth,
+        "options": list(options),
+        "runs": results,
+        "bytes_per_stack_item": round(stack_bytes / depth, 1) if depth else None
+    }
+
+
+def recursion_benchmark(n, options=()):
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "fib.xml")
+        with open(source_path, "w") as source_file:
+            source_file.write(recursion_workload(n).source)
+        with tempfile.TemporaryFile("w+") as stderr:
+            run = run_program(source_path, list(options) + ["--frame-stats"], stderr)
+            stderr.seek(0)
+            statistics = frame_statistics(stderr.read())
+
+    calls = fib_calls(n)
+    allocations = statistics.get("frames_allocated", 0) + statistics.get("variables_allocated", 0)
+    requests = allocations + statistics.get("frames_reused", 0) + statistics.get("variables_reused", 0)
+    return {
+        "benchmark": "recursion",
+        "fib": n,
+        "calls": calls,
+        "options": list(options),
+        "run": run,
+        "frame_statistics": statistics,
+        "allocations_per_call": round(allocations / calls, 4),
+        "allocations_per_call_without_pool": round(requests / calls, 4)
+    }
+
+
+def suite_benchmark(scale, repeat, options=()):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (generate, size) in SUITE.items():
+            workload = generate(max(1, int(size * scale)))
+            source_path = os.path.join(directory, name + ".xml")
+            input_path = os.path.join(directory, name + ".in")
+            with open(source_path, "w") as source_file:
+                source_file.write(workload.source)
+            with open(input_path, "w") as input_file:
+                input_file.write(workload.input)
+
+            runs = [run_program(source_path, options, input_path=input_path) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run["wall_time"])
+            results[name] = {
+                "size": max(1, int(size * scale)),
+                "instructions": workload.instructions,
+                "exit_code": best["exit_code"],
+                "wall_time": best["wall_time"],
+                "instructions_per_second": round(workload.instructions / best["wall_time"]),
+                "peak_rss_kb": max(run["peak_rss_kb"] for run in runs)
+            }
+    return {"benchmark": "suite", "scale": scale, "repeat": repeat, "options": list(options), "workloads": results}
+
+
+def compare_baseline(result, baseline, tolerance):
+    comparison = {}
+    for name, workload in result["workloads"].items():
+        reference = baseline["workloads"].get(name)
+        if reference == None or reference["size"] != workload["size"]:
+            continue
+        time_ratio = workload["wall_time"] / reference["wall_time"]
+        rss_ratio = workload["peak_rss_kb"] / reference["peak_rss_kb"]
+        exit_code_changed = workload["exit_code"] != reference["exit_code"]
+        comparison[name] = {
+            "time_ratio": round(time_ratio, 3),
+            "rss_ratio": round(rss_ratio, 3),
+            "exit_code_changed": exit_code_changed,
+            "regression": exit_code_changed or time_ratio > 1 + tolerance or rss_ratio > 1 + tolerance
+        }
+    return comparison
+
+
+##################
+# script methods #
+##################
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks of interpret.py, results are printed as JSON")
+    parser.add_argument("--benchmark=", dest="benchmark", choices=["suite", "memory", "recursion"], default="suite")
+    parser.add_argument("--scale=", dest="scale", type=float, default=1.0)
+    parser.add_argument("--repeat=", dest="repeat", type=int, default=3)
+    parser.add_argument("--baseline=", dest="baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true")
+    parser.add_argument("--tolerance=", dest="tolerance", type=float, default=0.1)
+    parser.add_argument("--depth=", dest="depth", type=int, default=1000000)
+    parser.add_argument("--fib=", dest="fib", type=int, default=20)
+    parser.add_argument("--engine=", dest="engine", choices=["threaded", "switch", "transpile"], default="threaded")
+    return parser.parse_args(sys.argv[1:])
+
+
+def main():
+    args = parse_arguments()
+    exit_code = 0
+    if args.benchmark == "recursion":
+        result = recursion_benchmark(args.fib, ["--engine=" + args.engine])
+    elif args.benchmark == "memory":
+        result = memory_benchmark(args.depth, ["--engine=" + args.engine])
+    else:
+        result = suite_benchmark(args.scale, args.repeat, ["--engine=" + args.engine])
+        if args.save_baseline:
+            with open(args.baseline, "w") as baseline_file:
+                json.dump(result, baseline_file, indent=2)
+                baseline_file.write("\n")
+        elif os.path.isfile(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline["options"] == result["options"]:
+                result["baseline"] = compare_baseline(result, baseline, args.tolerance)
+                if any(workload["regression"] for workload in result["baseline"].values()):
+                    exit_code = 1
+    print(json.dumps(result, indent=2))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,11 +9,199 @@ xseipe00
 
 from lxml import etree
 import argparse
+import base64
+import fcntl
+import gc
+import hashlib
+import json
+import marshal
+import math
+import operator
 import re
+import signal
+import socket
 import sys
 import os
-from io import StringIO
-from collections import deque
+import time
+from io import BufferedIOBase, BytesIO, RawIOBase, StringIO
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import islice, repeat
+
+
+ESCAPE_SEQUENCE = re.compile(r"\\(\d{3})")
+VARIABLE_NAME = re.compile("^(LF|GF|TF)@.")
+
+GLOBAL_FRAME = 0
+LOCAL_FRAME = 1
+TEMPORARY_FRAME = 2
+FRAME_NAMES = {"GF": GLOBAL_FRAME, "LF": LOCAL_FRAME, "TF": TEMPORARY_FRAME}
+FRAME_CODES = {frame: name for name, frame in FRAME_NAMES.items()}
+
+BLANK = " \t\r\n"
+POSITIVE_INTEGER = re.compile(r"^\s*\+?[0-9]+\s*$")
+
+INPUT_BUFFER_SIZE = 65536
+DECODED_ARGUMENTS_LIMIT = 65536
+
+CACHE_FORMAT = b"IPPcode21 decoded program 1"
+CACHE_CHUNK_SIZE = 1 << 20
+
+TRANSPILED_BLOCK_LIMIT = 256
+TRANSPILED_CHUNK_SIZE = 4096
+TRANSPILED_COLD_LIMIT = 4096
+FRAME_POOL_LIMIT = 256
+VARIABLE_POOL_LIMIT = 4096
+
+PROFILE_REPORT_LIMIT = 20
+SAMPLE_RATE = 997
+SAMPLE_STACK_LIMIT = 64
+COVERAGE_FORMAT = "IPPcode21 coverage 1"
+BRANCH_INSTRUCTIONS = ("JUMPIFEQ", "JUMPIFNEQ", "JUMPIFEQS", "JUMPIFNEQS")
+HOOK_EVENTS = ("instruction_start", "instruction_end", "frame_push", "frame_pop", "call", "call_return",
+               "variable_write")
+
+SERVE_CACHE_SIZE = 64
+SERVE_BACKLOG = 128
+SERVE_TIME_LIMIT = 24 * 60 * 60
+
+
+Result = namedtuple("Result", ["exit_code", "output", "error_output", "error"])
+
+
+class Interpreter:
+    """
+    Class for running IPPcode21 programs inside another Python program
+
+    Program is a path, XML source as bytes or instructions returned by
+    load_source. It is loaded once and every run() starts with fresh frames
+    and stacks. run() returns Result with the exit code, the output and the
+    error output (None when written to the given streams) and
+    the InterpretError that ended the program, if any. With raise_errors
+    run() raises that InterpretError instead of returning the Result.
+    """
+
+    def __init__(self, program, output=None, error=None, engine="threaded", optimization_level=0,
+                 peephole=False, interleave=False, strict=False, cache_dir=None, dump_code=None,
+                 opt_report=False, frame_stats=False, profile=None, flamegraph=None, sample_rate=SAMPLE_RATE,
+                 hooks=(), coverage=None, name=None, freeze_gc=False, raise_errors=False):
+        if sum(map(bool, (hooks, profile, coverage))) > 1:
+            raise ArgumentError("hooks, profile and coverage use different loops and can't be combined")
+        check_sample_rate(sample_rate)
+        self.program = program
+        self.instructions = None
+        self.output = output
+        self.error = error
+        self.engine = engine
+        self.optimization_level = optimization_level
+        self.peephole = peephole
+        self.interleave = interleave
+        self.strict = strict
+        self.cache_dir = cache_dir
+        self.dump_code = dump_code
+        self.opt_report = opt_report
+        self.frame_stats = frame_stats
+        self.profile = profile
+        self.flamegraph = flamegraph
+        self.sample_rate = sample_rate
+        self.hooks = list(hooks)
+        self.coverage = coverage
+        self.name = name
+        self.freeze_gc = freeze_gc
+        self.raise_errors = raise_errors
+        self.digest = None
+        self.system = None
+
+    def load(self):
+        if self.instructions == None:
+            if isinstance(self.program, (list, tuple)):
+                self.instructions = list(self.program)
+            else:
+                self.instructions = load_source(self.program, self.strict, self.cache_dir, self.freeze_gc)
+        return self.instructions
+
+    def run(self, program_input=None):
+        output = StringIO() if self.output == None else self.output
+        error = StringIO() if self.error == None else self.error
+        # newlines of input given as text are translated like in input read from a file
+        if program_input == None or isinstance(program_input, str):
+            program_input = StringIO(program_input or "", newline=None)
+        elif isinstance(program_input, StringIO):
+            program_input = StringIO(program_input.read(), newline=None)
+
+        system = System()
+        system.engine = self.engine
+        system.dump_code = self.dump_code
+        system.optimization_level = self.optimization_level
+        system.peephole = self.peephole
+        system.freeze_gc = self.freeze_gc
+        system.output = Output(output, interleave=self.interleave, error=error)
+        if self.profile != None:
+            system.profiler = Profiler()
+        if self.flamegraph != None:
+            system.sampler = Sampler(self.sample_rate)
+        system.hooks = list(self.hooks)
+        if self.coverage != None:
+            system.coverage = Coverage()
+        self.system = system
+
+        exit_code = 0
+        exception = None
+        try:
+            system.load_program(self.load())
+            if self.opt_report:
+                print_optimization_report(system.optimization_report, error)
+            system.program.input = InputReader(program_input)
+            system.run_interpret()
+        except ProgramExit as program_exit:
+            exit_code = program_exit.code
+        except InterpretError as interpret_error:
+            print("ERROR:", interpret_error, file=error)
+            exit_code = interpret_error.code
+            exception = interpret_error
+        finally:
+            if self.frame_stats:
+                print_frame_statistics(system.frames, error)
+
+        dumps = []
+        if self.profile != None and system.profiler.counts:
+            system.profiler.report(system.program.instructions, error)
+            dumps.append(("profile", self.profile,
+                          lambda path: system.profiler.dump(system.program.instructions, path)))
+        if self.flamegraph != None and system.sampler.stack != None:
+            dumps.append(("flamegraph", self.flamegraph, system.sampler.dump))
+        if self.coverage != None and system.coverage.executed != None:
+            dumps.append(("coverage", self.coverage, lambda path: update_coverage_file(path, self.coverage_data())))
+        for name, path, dump in dumps:
+            try:
+                dump(path)
+            except OSError:
+                dump_error = FileError("{} {}".format(name, path))
+            except InterpretError as interpret_error:
+                dump_error = type(interpret_error)("{} {}".format(name, path))
+            else:
+                continue
+            print("ERROR:", dump_error, file=error)
+            if exit_code == 0:
+                exit_code = dump_error.code
+                exception = dump_error
+
+        if self.raise_errors and exception != None:
+            raise exception
+        return Result(exit_code,
+                      output.getvalue() if self.output == None else None,
+                      error.getvalue() if self.error == None else None,
+                      exception)
+
+    def coverage_data(self):
+        instructions = self.load()
+        if self.digest == None:
+            self.digest = program_digest(self.program, instructions)
+        name = self.name
+        if name == None:
+            name = self.program if isinstance(self.program, str) else "<program {}>".format(self.digest[:12])
+        return {self.digest: self.system.coverage.program_data(name, instructions, self.system.program.instructions)}
 
 
 class System:
@@ -26,61 +214,198 @@ class System:
         self.datastack = DataStack()
         self.callstack = Stack()
         self.program = Program()
-        self.instruction = Instruction()
+        self.instruction = None
+        self.engine = "threaded"
+        self.dump_code = None
+        self.optimization_level = 0
+        self.peephole = False
+        self.freeze_gc = False
+        self.optimization_report = Counter()
+        self.profiler = None
+        self.sampler = None
+        self.hooks = []
+        self.coverage = None
+        self.output = Output(sys.stdout)
+        self.compiled_operands = {}
+
+    def load_program(self, instructions):
+        self.program.load(instructions)
+        Optimizer(self.program, self.optimization_report).run(self.optimization_level, self.freeze_gc)
+        if self.peephole:
+            self.optimization_report.update(self.program.fuse_instructions())
+        self.frames.set_layout(self.program.global_names, self.program.local_names)
 
     def run_interpret(self):
+        if self.sampler != None:
+            self.sampler.start(self)
+        try:
+            if self.hooks:
+                self.run_hooked()
+            elif self.profiler != None:
+                self.run_profiled()
+            elif self.coverage != None:
+                self.run_covered()
+            elif self.engine == "switch":
+                self.run_switch()
+            elif self.engine == "transpile":
+                self.run_transpiled()
+            else:
+                self.run_threaded()
+        finally:
+            if self.sampler != None:
+                self.sampler.stop()
+            self.output.flush()
+
+    def run_threaded(self):
+        code = compile_program(self)
+        length = len(code)
+        ip = 0
+        while ip < length:
+            ip = code[ip]()
+
+    def run_transpiled(self):
+        blocks = transpile_program(self)
+        length = len(blocks)
+        block = 0
+        while block < length:
+            block = blocks[block]()
+
+    def run_profiled(self):
+        """
+        Separate loop, so the other loops pay nothing for profiling,
+        transpiled blocks have no instruction boundaries and run as threaded code
+        """
+        profiler = self.profiler
+        counts = profiler.counts = [0] * self.program.length
+        times = profiler.times = [0.0] * self.program.length
+        clock = time.perf_counter
+        program = self.program
+        code = compile_program(self) if self.engine != "switch" else None
+        started = clock()
+        try:
+            if code == None:
+                while program.ptr_is_valid():
+                    ip = program.instruction_ptr
+                    counts[ip] += 1
+                    self.instruction = program.instructions[ip]
+                    start = clock()
+                    self.interpret_instruction()
+                    times[ip] += clock() - start
+                    program.instruction_ptr += 1
+            else:
+                length = len(code)
+                ip = 0
+                while ip < length:
+                    counts[ip] += 1
+                    start = clock()
+                    next_ip = code[ip]()
+                    times[ip] += clock() - start
+                    ip = next_ip
+        finally:
+            profiler.elapsed = clock() - started
+
+    def run_hooked(self):
+        """
+        Separate loop calling the registered Hooks, only events some hook
+        overrides are dispatched and the other loops never look at hooks,
+        transpiled blocks run as threaded code like in run_profiled
+        """
+        handlers = {event: [getattr(hook, event) for hook in self.hooks
+                            if getattr(type(hook), event) is not getattr(Hooks, event)]
+                    for event in HOOK_EVENTS}
+        starts, ends = handlers["instruction_start"], handlers["instruction_end"]
+        pushes, pops = handlers["frame_push"], handlers["frame_pop"]
+        calls, returns = handlers["call"], handlers["call_return"]
+        writes = handlers["variable_write"]
+
+        program = self.program
+        instructions = program.instructions
+        frames = self.frames
+        targets = [written_variables(instruction) for instruction in instructions]
+        if self.engine == "switch":
+            def step(ip):
+                program.instruction_ptr = ip
+                self.instruction = instructions[ip]
+                self.interpret_instruction()
+                return program.instruction_ptr + 1
+        else:
+            code = compile_program(self)
+
+            def step(ip):
+                return code[ip]()
+
+        length = len(instructions)
+        ip = 0
+        while ip < length:
+            instruction = instructions[ip]
+            for hook in starts:
+                hook(self, ip, instruction)
+            next_ip = step(ip)
+
+            if writes:
+                for variable in targets[ip]:
+                    data = frames.get_frame(variable.frame)[variable.slot]
+                    data = ProgramData(data.type, data.value)
+                    for hook in writes:
+                        hook(self, variable, data)
+            opcode = instruction.opcode
+            if opcode == "PUSHFRAME" and pushes:
+                view = frame_view(frames, frames.local_frames[-1])
+                for hook in pushes:
+                    hook(self, view)
+            elif opcode == "POPFRAME" and pops:
+                view = frame_view(frames, frames.tmp_frame)
+                for hook in pops:
+                    hook(self, view)
+            elif opcode == "CALL":
+                for hook in calls:
+                    hook(self, ip, instruction.arguments[0].value, next_ip)
+            elif opcode == "RETURN":
+                for hook in returns:
+                    hook(self, ip, next_ip)
+            for hook in ends:
+                hook(self, ip, instruction, next_ip)
+            ip = next_ip
+
+    def run_covered(self):
+        """
+        Threaded and transpile engines run threaded code with one-shot probes,
+        so covered instructions cost nothing, the switch engine marks every step
+        """
+        coverage = self.coverage
+        program = self.program
+        coverage.start(program.length)
+        if self.engine != "switch":
+            code = compile_program(self)
+            coverage.instrument(code, program.instructions)
+            length = len(code)
+            ip = 0
+            while ip < length:
+                ip = code[ip]()
+            return
+
+        executed, fell, jumped = coverage.executed, coverage.fell, coverage.jumped
+        while program.ptr_is_valid():
+            ip = program.instruction_ptr
+            executed[ip] = 1
+            self.instruction = program.instructions[ip]
+            self.interpret_instruction()
+            program.instruction_ptr += 1
+            if program.instruction_ptr == ip + 1:
+                fell[ip] = 1
+            else:
+                jumped[ip] = 1
+
+    def run_switch(self):
         while self.program.ptr_is_valid():
-            instruction = self.program.instructions[self.program.instruction_ptr]
-            
-            self.instruction.load(instruction)
+            self.instruction = self.program.instructions[self.program.instruction_ptr]
             self.interpret_instruction()
 
             self.program.instruction_ptr += 1
 
     def interpret_instruction(self):
-        switcher = {
-            "MOVE": i_move,
-            "CREATEFRAME": i_createframe,
-            "PUSHFRAME": i_pushframe,
-            "POPFRAME": i_popframe,
-            "DEFVAR": i_defvar,
-            "CALL": i_call,
-            "RETURN": i_return,
-            "PUSHS": i_pushs,
-            "POPS": i_pops,
-            "ADD": i_add,
-            "SUB": i_sub,
-            "MUL": i_mul,
-            "IDIV": i_idiv,
-            "LT": i_lt,
-            "GT": i_gt,
-            "EQ": i_eq,
-            "AND": i_and,
-            "OR": i_or,
-            "NOT": i_not,
-            "INT2CHAR": i_int2char,
-            "STRI2INT": i_stri2int,
-            "READ": i_read,
-            "WRITE": i_write,
-            "CONCAT": i_concat,
-            "STRLEN": i_strlen,
-            "GETCHAR": i_getchar,
-            "SETCHAR": i_setchar,
-            "TYPE": i_type,
-            "LABEL": i_label,
-            "JUMP": i_jump,
-            "JUMPIFEQ": i_jumpifeq,
-            "JUMPIFNEQ": i_jumpifneq,
-            "EXIT": i_exit,
-            "DPRINT": i_dprint,
-            "BREAK": i_break
-        }
-            
-        function = switcher.get(self.instruction.opcode.upper())
-        if function:
-            function(self)
-        else:
-            structure_error()
+        function = INSTRUCTIONS[self.instruction.opcode]
+        function(self)
 
 
 class Program:
@@ -92,8 +417,78 @@ class Program:
         self.instructions = []
         self.instruction_ptr = 0
         self.length = 0
-        self.input = ""
-        self.labels = []
+        self.input = None
+        self.labels = {}
+        self.global_names = []
+        self.local_names = []
+
+    def load(self, instructions):
+        self.instructions = list(instructions)
+        self.length = len(self.instructions)
+        self.load_labels()
+        self.resolve_variables()
+
+    def load_labels(self):
+        self.labels = {}
+        for index, instruction in enumerate(self.instructions):
+            if instruction.opcode == "LABEL" and instruction.arguments:
+                name = instruction.arguments[0].value
+                if name in self.labels:
+                    code_semantic_error()
+                self.labels[name] = index
+
+        for instruction in self.instructions:
+            if instruction.opcode in JUMP_INSTRUCTIONS and instruction.arguments:
+                target = instruction.arguments[0]
+                if target.type == "label" and target.value not in self.labels:
+                    code_semantic_error()
+
+    def resolve_variables(self):
+        slots = {GLOBAL_FRAME: {}, LOCAL_FRAME: {}}
+        resolved_arguments = {}
+
+        def resolve(argument):
+            if argument.type != "var":
+                return argument
+            resolved = resolved_arguments.get(argument.value)
+            if resolved == None:
+                frame_name, _, name = argument.value.partition("@")
+                frame = FRAME_NAMES[frame_name]
+                frame_slots = slots[GLOBAL_FRAME if frame == GLOBAL_FRAME else LOCAL_FRAME]
+                slot = frame_slots.setdefault(name, len(frame_slots))
+                resolved = Argument("var", Variable(frame, slot, name))
+                resolved_arguments[argument.value] = resolved
+            return resolved
+
+        instructions = self.instructions
+        for index, instruction in enumerate(instructions):
+            for argument in instruction.arguments:
+                if argument.type == "var":
+                    arguments = tuple(map(resolve, instruction.arguments))
+                    instructions[index] = Instruction(instruction.order, instruction.opcode, arguments)
+                    break
+        self.global_names = list(slots[GLOBAL_FRAME])
+        self.local_names = list(slots[LOCAL_FRAME])
+
+    def fuse_instructions(self):
+        fusions = Counter()
+        fused = []
+        index = 0
+        while index < len(self.instructions):
+            instruction = self.instructions[index]
+            if index + 1 < len(self.instructions):
+                following = self.instructions[index + 1]
+                if (instruction.opcode, following.opcode) in FUSIONS:
+                    instruction = FusedInstruction.fuse(instruction, following)
+                    fusions[instruction.opcode] += 1
+                    index += 1
+            fused.append(instruction)
+            index += 1
+
+        self.instructions = fused
+        self.length = len(fused)
+        self.load_labels()
+        return fusions
 
     def ptr_is_valid(self):
         return 0 <= self.instruction_ptr < self.length
@@ -103,56 +498,110 @@ class Program:
         self.jump_to_label_ptr(label_ptr)
 
     def get_label_ptr(self, name):
-        label_found = False
-        for instruction in self.instructions:
-            if instruction.attrib["opcode"] == "LABEL":
-                arguments = list(instruction)
-                label_name = arguments[0].text
-                if label_name == name:
-                    label_found = True
-                    return self.instructions.index(instruction)
-                    break
-        if label_found == False:
+        try:
+            return self.labels[name]
+        except KeyError:
             code_semantic_error()
 
     def jump_to_label_ptr(self, label_ptr):
         self.instruction_ptr = label_ptr
 
 
-class Instruction:
+class Variable(namedtuple("Variable", ["frame", "slot", "name"])):
     """
-    Class for storing data about actual instruction
+    Class for variable resolved to a frame and a slot in that frame
     """
 
-    def __init__(self):
-        self.opcode = ""
-        self.arguments = []
-
-    def load(self, instruction):
-        self.opcode = instruction.attrib['opcode']
-        self.arguments = []
-        instruction = list(instruction)
-        instruction.sort(key=lambda arg: arg.tag)
-        for argument in instruction:
-            arg = ProgramData()
-            arg.type = argument.attrib["type"]
-            arg.value = argument.text
-            arg.convert_type()
-            self.arguments.append(arg)
+    __slots__ = ()
+
+
+class Argument(namedtuple("Argument", ["type", "value"])):
+    """
+    Class for immutable, already typed argument of decoded instruction
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def decode(arg_type, arg_text):
+        arg = ProgramData(arg_type, arg_text)
+        arg.convert_type()
+        if arg.type == "type":
+            arg.value = sys.intern(arg.value)
+        return Argument(sys.intern(arg.type), arg.value)
+
+
+class Instruction(namedtuple("Instruction", ["order", "opcode", "arguments", "types"], defaults=(None,))):
+    """
+    Class for immutable instruction decoded once at load time, types hold
+    operand types proven by type inference, None where nothing is known
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def decode(instruction, decoded_arguments=None, order=None, arguments=None):
+        opcode = instruction.get('opcode', '').upper()
+        signature = OPERANDS.get(opcode)
+        if signature == None:
+            structure_error()
+
+        if arguments == None:
+            arguments = [argument for argument in instruction if isinstance(argument.tag, str)]
+            arguments.sort(key=operator.attrgetter("tag"))
+        if len(arguments) != len(signature):
+            structure_error()
+
+        if decoded_arguments == None:
+            decoded_arguments = {}
+        instruction_arguments = []
+        for argument, operand in zip(arguments, signature):
+            key = (argument.get("type"), argument.text)
+            arg = decoded_arguments.get(key)
+            if arg == None:
+                arg = decoded_arguments[key] = Argument.decode(*key)
+            if arg.type not in OPERAND_TYPES[operand]:
+                structure_error()
+            instruction_arguments.append(arg)
+
+        if order == None:
+            order = get_order(instruction)
+        return Instruction(order, opcode, tuple(instruction_arguments))
+
+
+class FusedInstruction(namedtuple("FusedInstruction", ["order", "opcode", "arguments", "parts"])):
+    """
+    Class for superinstruction fused from a sequence of decoded instructions,
+    the original parts are kept for engines without a fused implementation
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def fuse(*parts):
+        opcode = "+".join(part.opcode for part in parts)
+        arguments = tuple(arg for part in parts for arg in part.arguments)
+        return FusedInstruction(parts[0].order, opcode, arguments, parts)
 
 
 class ProgramData:
     """
-    Class for structuring data from interpreted program
+    Class for structuring data from interpreted program, type is one of
+    interned type tags, so comparing tags is mostly identity check
     """
 
+    __slots__ = ("type", "value", "buffer")
+
     def __init__(self, data_type=None, data_value=None):
         self.type = data_type
         self.value = data_value
 
+    def __repr__(self):
+        return "{}@{}".format(self.type, self.value)
+
     def convert_escaped_ascii(self):
         if self.value:
-            self.value = re.sub(r"\\(\d{3})", lambda x: chr(int(x.group()[1:])), self.value)
+            self.value = ESCAPE_SEQUENCE.sub(lambda x: chr(int(x.group()[1:])), self.value)
         else: 
             self.value = ""
 
@@ -172,7 +621,7 @@ class ProgramData:
         elif self.type == "string":
             self.convert_escaped_ascii()
         elif self.type == "var":
-            if re.match("^(LF|GF|TF)@.", self.value):
+            if self.value and VARIABLE_NAME.match(self.value):
                 self.convert_escaped_ascii()
             else:
                 structure_error()
@@ -191,80 +640,199 @@ class ProgramData:
             structure_error()
 
 
+class StringBuffer(ProgramData):
+    """
+    Class for string variable changed in place by CONCAT and SETCHAR
+
+    Characters are kept in a list, so appending and setting one character
+    are cheap. Reading or writing value turns the object back to plain
+    ProgramData holding str, GETCHAR and STRLEN use the list directly.
+    """
+
+    __slots__ = ()
+
+    @property
+    def value(self):
+        text = "".join(self.buffer)
+        self.buffer = None
+        self.__class__ = ProgramData
+        self.value = text
+        return text
+
+    @value.setter
+    def value(self, value):
+        self.buffer = None
+        self.__class__ = ProgramData
+        self.value = value
+
+
+def string_buffer(data):
+    if data.__class__ is not StringBuffer:
+        data.buffer = list(data.value)
+        data.__class__ = StringBuffer
+    return data.buffer
+
+
+def string_chars(data):
+    if data.__class__ is StringBuffer:
+        return data.buffer
+    return data.value
+
+
+def append_string(data, text):
+    string_buffer(data).extend(text)
+
+
+def set_char(data, index, char):
+    if data.type != "string":
+        type_error()
+    try:
+        string_buffer(data)[index] = char[0]
+    except IndexError:
+        string_error()
+
+
+class Frame(dict):
+    """
+    Class represents one frame as a dict of variable slots resolved at load time,
+    a slot missing in the frame reads as None until the variable is defined
+    by DEFVAR, so a frame holds only its own variables
+    """
+
+    __slots__ = ()
+
+    def __missing__(self, slot):
+        return None
+
+
 class Frames:
     """
     Class represents frames and work with them
+
+    Slots of local names are shared by the whole program, but a frame
+    stores only the slots defined in it, so its size and the cost of
+    recycling it depend on its own variables, not on all local names.
+    Frames and variables discarded by CREATEFRAME and POPFRAME are recycled
+    instead of allocated again on the next call, a recycled frame is empty,
+    so one pool serves frames of every shape and no pool is kept per call site.
+    The global frame is created once for the whole program, so it stays
+    a list indexed directly by the slots of global names.
     """
 
     def __init__(self):
-        self.global_frame = {}
-        self.__local_frames = deque([])
+        self.global_frame = []
+        self.local_frames = deque([])
         self.tmp_frame = None
+        self.global_names = []
+        self.local_names = []
+        self.frame_pool = []
+        self.data_pool = []
+        self.frames_allocated = 0
+        self.frames_reused = 0
+        self.variables_allocated = 0
+        self.variables_reused = 0
+
+    def set_layout(self, global_names, local_names):
+        self.global_names = global_names
+        self.local_names = local_names
+        self.global_frame[:] = [None] * len(global_names)
+        self.frame_pool.clear()
 
     def get_local_frame(self):
         try:
-            return self.__local_frames[-1]
+            return self.local_frames[-1]
         except IndexError:
             return None
 
     def push_frame(self):
         if self.tmp_frame != None:
-            self.__local_frames.append(self.tmp_frame)
+            self.local_frames.append(self.tmp_frame)
             self.tmp_frame = None
         else:
             frame_error()
 
     def pop_frame(self):
         try:
-            self.tmp_frame = self.__local_frames.pop()
+            frame = self.local_frames.pop()
         except IndexError:
             frame_error()
+        if self.tmp_frame != None:
+            self.release_frame(self.tmp_frame)
+        self.tmp_frame = frame
 
     def create_tf(self):
-        self.tmp_frame = {}
+        if self.tmp_frame != None:
+            self.release_frame(self.tmp_frame)
+        if self.frame_pool:
+            self.frames_reused += 1
+            self.tmp_frame = self.frame_pool.pop()
+        else:
+            self.frames_allocated += 1
+            self.tmp_frame = Frame()
+
+    def release_frame(self, frame):
+        free = VARIABLE_POOL_LIMIT - len(self.data_pool)
+        if free > 0:
+            self.data_pool.extend(islice(frame.values(), free))
+        frame.clear()
+        if len(self.frame_pool) < FRAME_POOL_LIMIT:
+            self.frame_pool.append(frame)
+
+    def new_data(self):
+        if self.data_pool:
+            self.variables_reused += 1
+            data = self.data_pool.pop()
+            data.type = None
+            data.value = None
+            return data
+        self.variables_allocated += 1
+        return ProgramData()
 
-    def parse_var_string(self, var_string):
-        frame, var_name = var_string.split("@")
-        
-        if frame == "GF":
+    def get_frame(self, frame):
+        if frame == GLOBAL_FRAME:
             actual_frame = self.global_frame
-        if frame == "LF":
+        elif frame == LOCAL_FRAME:
             actual_frame = self.get_local_frame()
-        if frame == "TF":
+        else:
             actual_frame = self.tmp_frame
-        
+
         if actual_frame == None:
             frame_error()
-        return actual_frame, var_name
+        return actual_frame
+
+    def frame_content(self, frame, names):
+        if frame == None:
+            return None
+        if isinstance(frame, list):
+            return {names[slot]: data for slot, data in enumerate(frame) if data != None}
+        return {names[slot]: data for slot, data in frame.items()}
 
-    def def_var(self, var_string):
-        actual_frame, var_name = self.parse_var_string(var_string)
+    def def_var(self, variable):
+        actual_frame = self.get_frame(variable.frame)
 
-        if var_name in actual_frame:
+        if actual_frame[variable.slot] != None:
             code_semantic_error()
         else:
-            actual_frame[var_name] = ProgramData()
+            actual_frame[variable.slot] = self.new_data()
 
-    def get_var(self, var_string, return_none=False):
-        actual_frame, var_name = self.parse_var_string(var_string)
+    def get_var(self, variable, return_none=False):
+        var_data = self.get_frame(variable.frame)[variable.slot]
 
-        if var_name in actual_frame:
-            var_data = actual_frame.get(var_name)
-            if var_data.type != None:
-                return var_data
-            elif return_none:
-                return None
-            else:
-                missing_value_error()
-        else:
+        if var_data == None:
             variable_error()
+        elif var_data.type != None:
+            return var_data
+        elif return_none:
+            return None
+        else:
+            missing_value_error()
 
-    def update_var(self, var_string, var_type, var_value):
-        actual_frame, var_name = self.parse_var_string(var_string)
+    def update_var(self, variable, var_type, var_value):
+        var_data = self.get_frame(variable.frame)[variable.slot]
 
-        if var_name in actual_frame:
-            actual_frame[var_name].type = var_type
-            actual_frame[var_name].value = var_value
+        if var_data != None:
+            var_data.type = var_type
+            var_data.value = var_value
         else:
             variable_error()
 
@@ -287,14 +855,199 @@ class Stack:
             missing_value_error()
 
 
-class DataStack(Stack):
+class Output:
+    """
+    Class buffers output of interpreted program and writes it in large chunks
+
+    In interleave mode the buffer is flushed before anything is written
+    to stderr, so DPRINT and BREAK keep their order relative to WRITE.
+    """
+
+    def __init__(self, stream, buffer_size=65536, interleave=False, error=None):
+        self.stream = stream
+        self.error = error
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+        self.interleave = interleave
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+        self.stream.flush()
+
+    def error_stream(self):
+        if self.interleave:
+            self.flush()
+        if self.error == None:
+            return sys.stderr
+        return self.error
+
+
+class InputReader:
+    """
+    Class reads input of interpreted program lazily, one line per READ,
+    "\r\n" and "\r" end a line also in streams that don't translate newlines
+
+    Input given as bytes or a binary stream is decoded as UTF-8.
+    """
+
+    def __init__(self, stream):
+        if isinstance(stream, (bytes, bytearray)):
+            stream = StringIO(stream.decode("utf-8", "replace"), newline=None)
+        self.stream = stream
+        self.binary = isinstance(stream, (BufferedIOBase, RawIOBase))
+
+    def read_line(self):
+        line = self.stream.readline()
+        if not line:
+            return None
+        if self.binary:
+            line = line.decode("utf-8", "replace")
+        if line[-1] == "\n":
+            line = line[:-1]
+        if line[-1:] == "\r":
+            return line[:-1]
+        return line
+
+
+class SourceValidator:
+    """
+    Class checks the rules of SOURCE_SCHEMA in the same pass that streams the source
+
+    Only the first violation is remembered, the rest of the source is still
+    read so that malformed XML is reported as such (exit code 31 before 32).
     """
-    Class represents a stack specially for work with data of class ProgramData
 
+    PROGRAM_ATTRIBUTES = ("language", "name", "description")
+    INSTRUCTION_ATTRIBUTES = ("order", "opcode")
+    ARGUMENT_TAGS = ["arg1", "arg2", "arg3"]
+
+    def __init__(self):
+        self.error = None
+        self.program_checked = False
+
+    def fail(self, message):
+        if self.error == None:
+            self.error = message
+
+    def check_program(self, program):
+        self.program_checked = True
+        if program.tag != "program":
+            self.fail("root element must be 'program'")
+        if program.get("language") == None:
+            self.fail("attribute 'language' of 'program' is required")
+        for name in program.keys():
+            if name not in self.PROGRAM_ATTRIBUTES:
+                self.fail("attribute '{}' is not allowed in 'program'".format(name))
+        if not is_blank(program.text):
+            self.fail("'program' can't contain text")
+
+    def check_siblings(self, siblings):
+        for sibling in siblings:
+            self.check_sibling(sibling)
+
+    def check_sibling(self, sibling):
+        if isinstance(sibling.tag, str) and sibling.tag != "instruction":
+            self.fail("element '{}' is not allowed in 'program'".format(sibling.tag))
+        if sibling.tail and not is_blank(sibling.tail):
+            self.fail("'program' can't contain text")
+
+    def check_instruction(self, instruction):
+        """
+        Returns order and argument elements sorted by tag, so decoding does
+        not read them again, the common shape (attributes order and opcode,
+        blank text, arguments in order) takes the fewest checks
+        """
+        program = instruction.getparent()
+        if program == None or program.getparent() != None:
+            self.fail("'instruction' must be a child of 'program'")
+            return None, None
+        if not self.program_checked:
+            self.check_program(program)
+
+        attributes = instruction.keys()
+        if len(attributes) != 2 or "opcode" not in attributes:
+            for name in attributes:
+                if name not in self.INSTRUCTION_ATTRIBUTES:
+                    self.fail("attribute '{}' is not allowed in 'instruction'".format(name))
+            if "opcode" not in attributes:
+                self.fail("attribute 'opcode' of 'instruction' is required")
+        order = instruction.get("order")
+        if order == None or not POSITIVE_INTEGER.match(order) or int(order) < 1:
+            self.fail("attribute 'order' must be a positive integer")
+            order = None
+        else:
+            order = int(order)
+        text = instruction.text
+        if text and text.strip(BLANK):
+            self.fail("'instruction' can't contain text")
+
+        tags = []
+        arguments = []
+        for argument in instruction:
+            tail = argument.tail
+            if tail and tail.strip(BLANK):
+                self.fail("'instruction' can't contain text")
+            tag = argument.tag
+            if not isinstance(tag, str):
+                continue
+            tags.append(tag)
+            arguments.append(argument)
+            if argument.keys() != ["type"]:
+                self.fail("'{}' must have exactly the attribute 'type'".format(tag))
+            if len(argument):
+                for child in argument:
+                    if isinstance(child.tag, str):
+                        self.fail("'{}' can't contain elements".format(tag))
+        if tags != self.ARGUMENT_TAGS[:len(tags)]:
+            self.check_tags(tags)
+            arguments.sort(key=operator.attrgetter("tag"))
+        return order, arguments
+
+    def check_tags(self, tags):
+        for index, tag in enumerate(tags):
+            if tag not in self.ARGUMENT_TAGS or tag in tags[:index]:
+                self.fail("element '{}' is not allowed in 'instruction'".format(tag))
+        if tags and "arg1" not in tags:
+            self.fail("'instruction' with arguments must contain 'arg1'")
+
+
+def is_blank(text):
+    return not text or not text.strip(BLANK)
+
+
+class DataStack:
+    """
+    Class represents data stack as two parallel lists of types and values,
+    so pushed data need no ProgramData objects, pop returns (type, value)
     """
 
+    def __init__(self):
+        self.types = []
+        self.values = []
+
     def push(self, data_type, data_value):
-        self.stack.append(ProgramData(data_type, data_value))
+        self.types.append(data_type)
+        self.values.append(data_value)
+
+    def pop(self):
+        try:
+            return self.types.pop(), self.values.pop()
+        except IndexError:
+            missing_value_error()
+
+    def clear(self):
+        self.types.clear()
+        self.values.clear()
 
 
 
@@ -372,8 +1125,8 @@ def i_pops(system):
 
     if arg1.type != "var":
         structure_error()
-    data = system.datastack.pop()
-    system.frames.update_var(arg1.value, data.type, data.value)
+    data_type, data_value = system.datastack.pop()
+    system.frames.update_var(arg1.value, data_type, data_value)
 
 
 def i_add(system):
@@ -636,16 +1389,16 @@ def i_read(system):
 
     if arg1.type != "var" or arg2.type != "type":
         structure_error()
+    data = read_data(system, arg2.value)
+    system.frames.update_var(arg1.value, data.type, data.value)
+
+
+def read_data(system, data_type):
     data = ProgramData()
-    data.type = arg2.value
-    if system.program.input != None:
-        try:
-            data.value = system.program.input.popleft()
-        except IndexError:
-            data.type = "nil"
-            data.value = None
-    else:
-        data.value = input()  
+    data.type = data_type
+    data.value = system.program.input.read_line()
+    if data.value == None:
+        data.type = "nil"
 
     if data.type == "int":
         try:
@@ -661,7 +1414,7 @@ def i_read(system):
     elif data.type == "string":
         data.convert_escaped_ascii()
 
-    system.frames.update_var(arg1.value, data.type, data.value)
+    return data
 
 
 def i_write(system):
@@ -671,15 +1424,7 @@ def i_write(system):
         
     if arg1.type == "var":
         arg1 = system.frames.get_var(arg1.value)
-    if arg1.type == "bool":
-        if arg1.value:
-            print("true", end='')
-        else:
-            print("false", end='')
-    elif arg1.type == "nil":
-        print("", end='')
-    else:
-        print(arg1.value, end='')
+    system.output.write(format_data(arg1))
 
 
 def i_concat(system):
@@ -695,9 +1440,12 @@ def i_concat(system):
         arg2 = system.frames.get_var(arg2.value)
     if arg3.type == "var":
         arg3 = system.frames.get_var(arg3.value)
-    if arg2.type == "string" and arg3.type == "string":   
-        result = arg2.value + arg3.value
-        system.frames.update_var(arg1.value, "string", result)
+    if arg2.type == "string" and arg3.type == "string":
+        if system.instruction.arguments[1] == arg1:
+            append_string(arg2, arg3.value)
+        else:
+            result = arg2.value + arg3.value
+            system.frames.update_var(arg1.value, "string", result)
     else:
         type_error()
 
@@ -713,7 +1461,7 @@ def i_strlen(system):
     if arg2.type == "var":
         arg2 = system.frames.get_var(arg2.value)
     if arg2.type == "string":
-        result = len(arg2.value)
+        result = len(string_chars(arg2))
         system.frames.update_var(arg1.value, "int", result)
     else:
         type_error()  
@@ -734,7 +1482,7 @@ def i_getchar(system):
         arg3 = system.frames.get_var(arg3.value)
     if arg2.type == "string" and arg3.type == "int":
         try:
-            result = arg2.value[arg3.value]
+            result = string_chars(arg2)[arg3.value]
         except IndexError:
             string_error()
         system.frames.update_var(arg1.value, "string", result)
@@ -756,16 +1504,7 @@ def i_setchar(system):
     if arg3.type == "var":
         arg3 = system.frames.get_var(arg3.value)
     if arg2.type == "int" and arg3.type == "string":
-        arg1_string = system.frames.get_var(arg1.value).value
-        try:
-            arg1_string = list(arg1_string)
-            arg1_string[arg2.value] = arg3.value[0]
-            arg1_string = "".join(arg1_string)
-        except IndexError:
-            string_error()
-        except TypeError:
-            type_error()
-        system.frames.update_var(arg1.value, "string", arg1_string)
+        set_char(system.frames.get_var(arg1.value), arg2.value, arg3.value)
     else:
         type_error()
 
@@ -795,10 +1534,6 @@ def i_label(system):
  
     if arg1.type != "label":
         structure_error()
-    if not arg1.value in system.program.labels:
-        system.program.labels.append(arg1.value)
-    else:
-        code_semantic_error()
 
 
 def i_jump(system):
@@ -862,7 +1597,7 @@ def i_exit(system):
         arg1 = system.frames.get_var(arg1.value)
     if arg1.type == "int":
         if 0 <= arg1.value <= 49:
-            sys.exit(arg1.value)
+            program_exit(arg1.value)
         else:
             wrong_operand_error()
     else:
@@ -876,137 +1611,2997 @@ def i_dprint(system):
         
     if arg1.type == "var":
         arg1 = system.frames.get_var(arg1.value)
-    if arg1.type == "bool":
-        if arg1.value:
-            print("true", end='', file=sys.stderr)
-        else:
-            print("false", end='', file=sys.stderr)
-    elif arg1.type == "nil":
-        print("", end='', file=sys.stderr)
-    else:
-        print(arg1.value, end='', file=sys.stderr)
+    print(format_data(arg1), end='', file=system.output.error_stream())
 
 
 def i_break(system):
+    frames = system.frames
+    stderr = system.output.error_stream()
     actual_instruction = system.program.instructions[system.program.instruction_ptr]
-    print("\n\nActual instruction number:", actual_instruction.attrib["order"], file=sys.stderr)
-    print("Actual instruciton name:", actual_instruction.attrib["opcode"], file=sys.stderr)
+    print("\n\nActual instruction number:", actual_instruction.order, file=stderr)
+    print("Actual instruciton name:", actual_instruction.opcode, file=stderr)
     print("Actual content in frames:",
-          "\n Global frame:\n", system.frames.global_frame, 
-          "\n\n Local frame:\n", system.frames.get_local_frame(), 
-          "\n\n Temporary frame:\n", system.frames.tmp_frame,
-          "\n", file=sys.stderr)
-
+          "\n Global frame:\n", frames.frame_content(frames.global_frame, frames.global_names),
+          "\n\n Local frame:\n", frames.frame_content(frames.get_local_frame(), frames.local_names),
+          "\n\n Temporary frame:\n", frames.frame_content(frames.tmp_frame, frames.local_names),
+          "\n", file=stderr)
 
 
-##################
-# error handling #
-##################
+def i_clears(system):
+    system.datastack.clear()
 
 
-def code_semantic_error():
-    print("ERROR: semantic error in IPPcode", file=sys.stderr)
-    sys.exit(52)
+def i_adds(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == "int" and right_type == "int":
+        system.datastack.push("int", left + right)
+    else:
+        type_error()
 
 
-def type_error():
-    print("ERROR: wrong type", file=sys.stderr)
-    sys.exit(53)
+def i_subs(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == "int" and right_type == "int":
+        system.datastack.push("int", left - right)
+    else:
+        type_error()
 
 
-def variable_error():
-    print("ERROR: variabe not found", file=sys.stderr)
-    sys.exit(54)
+def i_muls(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == "int" and right_type == "int":
+        system.datastack.push("int", left * right)
+    else:
+        type_error()
 
 
-def frame_error():
-    print("ERROR: frame doesn't exist", file=sys.stderr)
-    sys.exit(55)
+def i_idivs(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == "int" and right_type == "int":
+        try:
+            result = left // right
+        except ZeroDivisionError:
+            wrong_operand_error()
+        system.datastack.push("int", result)
+    else:
+        type_error()
 
 
-def missing_value_error():
-    print("ERROR: value doesn't exist (or stack is empty)", file=sys.stderr)
-    sys.exit(56)
+def i_lts(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type:
+        try:
+            result = left < right
+        except TypeError:
+            type_error()
+        system.datastack.push("bool", result)
+    else:
+        type_error()
 
 
-def wrong_operand_error():
-    print("ERROR: wrong operand (or zero division)", file=sys.stderr)
-    sys.exit(57)    
+def i_gts(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type:
+        try:
+            result = left > right
+        except TypeError:
+            type_error()
+        system.datastack.push("bool", result)
+    else:
+        type_error()
 
 
-def string_error():
-    print("ERROR: invalid operation with string", file=sys.stderr)
-    sys.exit(58)      
+def i_eqs(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type or left_type == "nil" or right_type == "nil":
+        system.datastack.push("bool", left == right)
+    else:
+        type_error()
 
 
-def parse_error():
-    print("ERROR: invalid XML format", file=sys.stderr)
-    sys.exit(31)
+def i_ands(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type == "bool":
+        system.datastack.push("bool", left and right)
+    else:
+        type_error()
 
 
-def structure_error():
-    print("ERROR: invalid XML structure", file=sys.stderr)
-    sys.exit(32)
-    
-    
-def argument_error():
-    print("ERROR: invalid file", file=sys.stderr)
-    sys.exit(10)
+def i_ors(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type == "bool":
+        system.datastack.push("bool", left or right)
+    else:
+        type_error()
 
 
-def file_error():
-    print("ERROR: invalid file", file=sys.stderr)
-    sys.exit(11)
+def i_nots(system):
+    data_type, data_value = system.datastack.pop()
+    if data_type == "bool":
+        system.datastack.push("bool", not data_value)
+    else:
+        type_error()
 
 
+def i_int2chars(system):
+    data_type, data_value = system.datastack.pop()
+    if data_type == "int":
+        try:
+            result = chr(data_value)
+        except ValueError:
+            string_error()
+        system.datastack.push("string", result)
+    else:
+        type_error()
 
-# script methods
 
+def i_stri2ints(system):
+    (string_type, string), (index_type, index) = pop_pair(system)
+    if string_type == "string" and index_type == "int":
+        try:
+            result = ord(string[index])
+        except IndexError:
+            string_error()
+        system.datastack.push("int", result)
+    else:
+        type_error()
 
-def get_order(instruction):
-    return int(instruction.attrib['order'])
 
+def i_jumpifeqs(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type or left_type == "nil" or right_type == "nil":
+        if left == right:
+            system.program.jump_to_label(system.instruction.arguments[0].value)
+    else:
+        type_error()
 
-def parse_arguments():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--source=", dest="source")
-    parser.add_argument("--input=", dest="input")
-    args = parser.parse_args(sys.argv[1:])
 
-    if not (args.source or args.input):
-        argument_error()
+def i_jumpifneqs(system):
+    (left_type, left), (right_type, right) = pop_pair(system)
+    if left_type == right_type or left_type == "nil" or right_type == "nil":
+        if left != right:
+            system.program.jump_to_label(system.instruction.arguments[0].value)
     else:
-        return args
+        type_error()
 
 
-def parse_souce(source_path):
-    parsed_source = []
-    
+def pop_pair(system):
+    right = system.datastack.pop()
+    left = system.datastack.pop()
+    return left, right
+
+
+def i_fused(system):
+    fused = system.instruction
+    for part in fused.parts:
+        system.instruction = part
+        INSTRUCTIONS[part.opcode](system)
+    system.instruction = fused
+
+
+def format_data(data):
+    if data.type == "bool":
+        return "true" if data.value else "false"
+    if data.type == "nil":
+        return ""
     try:
-        if args.source:
-            if os.path.isfile(args.source):
-                parsed_source = etree.parse(args.source)
+        return str(data.value)
+    except ValueError:
+        raise OperandValueError("integer too long to be written")
+
+
+INSTRUCTIONS = {
+    "MOVE": i_move,
+    "CREATEFRAME": i_createframe,
+    "PUSHFRAME": i_pushframe,
+    "POPFRAME": i_popframe,
+    "DEFVAR": i_defvar,
+    "CALL": i_call,
+    "RETURN": i_return,
+    "PUSHS": i_pushs,
+    "POPS": i_pops,
+    "ADD": i_add,
+    "SUB": i_sub,
+    "MUL": i_mul,
+    "IDIV": i_idiv,
+    "LT": i_lt,
+    "GT": i_gt,
+    "EQ": i_eq,
+    "AND": i_and,
+    "OR": i_or,
+    "NOT": i_not,
+    "INT2CHAR": i_int2char,
+    "STRI2INT": i_stri2int,
+    "READ": i_read,
+    "WRITE": i_write,
+    "CONCAT": i_concat,
+    "STRLEN": i_strlen,
+    "GETCHAR": i_getchar,
+    "SETCHAR": i_setchar,
+    "TYPE": i_type,
+    "LABEL": i_label,
+    "JUMP": i_jump,
+    "JUMPIFEQ": i_jumpifeq,
+    "JUMPIFNEQ": i_jumpifneq,
+    "EXIT": i_exit,
+    "DPRINT": i_dprint,
+    "BREAK": i_break,
+    "CLEARS": i_clears,
+    "ADDS": i_adds,
+    "SUBS": i_subs,
+    "MULS": i_muls,
+    "IDIVS": i_idivs,
+    "LTS": i_lts,
+    "GTS": i_gts,
+    "EQS": i_eqs,
+    "ANDS": i_ands,
+    "ORS": i_ors,
+    "NOTS": i_nots,
+    "INT2CHARS": i_int2chars,
+    "STRI2INTS": i_stri2ints,
+    "JUMPIFEQS": i_jumpifeqs,
+    "JUMPIFNEQS": i_jumpifneqs,
+    "ADD+JUMPIFEQ": i_fused,
+    "ADD+JUMPIFNEQ": i_fused,
+    "SUB+JUMPIFEQ": i_fused,
+    "SUB+JUMPIFNEQ": i_fused,
+    "CONCAT+JUMP": i_fused,
+    "PUSHS+POPS": i_fused
+}
+
+JUMP_INSTRUCTIONS = ("CALL", "JUMP", "JUMPIFEQ", "JUMPIFNEQ", "JUMPIFEQS", "JUMPIFNEQS")
+
+BLOCK_ENDS = ("CALL", "RETURN", "JUMP", "JUMPIFEQ", "JUMPIFNEQ", "JUMPIFEQS", "JUMPIFNEQS", "EXIT")
+FALLTHROUGH_ENDS = ("RETURN", "JUMP", "EXIT")
+
+FOLDABLE = {
+    "ADD": (("int", "int"), "int", operator.add),
+    "SUB": (("int", "int"), "int", operator.sub),
+    "MUL": (("int", "int"), "int", operator.mul),
+    "CONCAT": (("string", "string"), "string", operator.add),
+    "STRLEN": (("string",), "int", len)
+}
+
+ALL_TYPES = frozenset(("int", "bool", "string", "nil"))
+NO_TYPES = frozenset()
+
+RESULT_TYPES = {
+    "DEFVAR": NO_TYPES,
+    "POPS": ALL_TYPES,
+    "ADD": frozenset(("int",)),
+    "SUB": frozenset(("int",)),
+    "MUL": frozenset(("int",)),
+    "IDIV": frozenset(("int",)),
+    "STRLEN": frozenset(("int",)),
+    "STRI2INT": frozenset(("int",)),
+    "LT": frozenset(("bool",)),
+    "GT": frozenset(("bool",)),
+    "EQ": frozenset(("bool",)),
+    "AND": frozenset(("bool",)),
+    "OR": frozenset(("bool",)),
+    "NOT": frozenset(("bool",)),
+    "INT2CHAR": frozenset(("string",)),
+    "CONCAT": frozenset(("string",)),
+    "GETCHAR": frozenset(("string",)),
+    "SETCHAR": frozenset(("string",)),
+    "TYPE": frozenset(("string",))
+}
+
+FUSIONS = (
+    ("ADD", "JUMPIFEQ"),
+    ("ADD", "JUMPIFNEQ"),
+    ("SUB", "JUMPIFEQ"),
+    ("SUB", "JUMPIFNEQ"),
+    ("CONCAT", "JUMP"),
+    ("PUSHS", "POPS")
+)
+
+OPERANDS = {
+    "MOVE": ("var", "symb"),
+    "CREATEFRAME": (),
+    "PUSHFRAME": (),
+    "POPFRAME": (),
+    "DEFVAR": ("var",),
+    "CALL": ("label",),
+    "RETURN": (),
+    "PUSHS": ("symb",),
+    "POPS": ("var",),
+    "ADD": ("var", "symb", "symb"),
+    "SUB": ("var", "symb", "symb"),
+    "MUL": ("var", "symb", "symb"),
+    "IDIV": ("var", "symb", "symb"),
+    "LT": ("var", "symb", "symb"),
+    "GT": ("var", "symb", "symb"),
+    "EQ": ("var", "symb", "symb"),
+    "AND": ("var", "symb", "symb"),
+    "OR": ("var", "symb", "symb"),
+    "NOT": ("var", "symb"),
+    "INT2CHAR": ("var", "symb"),
+    "STRI2INT": ("var", "symb", "symb"),
+    "READ": ("var", "type"),
+    "WRITE": ("symb",),
+    "CONCAT": ("var", "symb", "symb"),
+    "STRLEN": ("var", "symb"),
+    "GETCHAR": ("var", "symb", "symb"),
+    "SETCHAR": ("var", "symb", "symb"),
+    "TYPE": ("var", "symb"),
+    "LABEL": ("label",),
+    "JUMP": ("label",),
+    "JUMPIFEQ": ("label", "symb", "symb"),
+    "JUMPIFNEQ": ("label", "symb", "symb"),
+    "EXIT": ("symb",),
+    "DPRINT": ("symb",),
+    "BREAK": (),
+    "CLEARS": (),
+    "ADDS": (),
+    "SUBS": (),
+    "MULS": (),
+    "IDIVS": (),
+    "LTS": (),
+    "GTS": (),
+    "EQS": (),
+    "ANDS": (),
+    "ORS": (),
+    "NOTS": (),
+    "INT2CHARS": (),
+    "STRI2INTS": (),
+    "JUMPIFEQS": ("label",),
+    "JUMPIFNEQS": ("label",)
+}
+
+OPERAND_TYPES = {
+    "var": ("var",),
+    "symb": ("var", "int", "bool", "string", "nil"),
+    "label": ("label",),
+    "type": ("type",)
+}
+
+
+
+#############
+# optimizer #
+#############
+
+
+class BasicBlock:
+    """
+    Class for basic block of control flow graph, instructions start:end
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.successors = []
+        self.predecessors = []
+
+
+class ControlFlowGraph:
+    """
+    Class for control flow graph built from program and its label table
+
+    CALL has edges to the called label and to the following instruction
+    where RETURN continues, RETURN and EXIT have no successors.
+    """
+
+    def __init__(self, program):
+        self.instructions = program.instructions
+        leaders = find_leaders(self.instructions) + [len(self.instructions)]
+        self.blocks = [BasicBlock(start, end) for start, end in zip(leaders, leaders[1:])]
+        self.block_at = {block.start: block for block in self.blocks}
+
+        for index, block in enumerate(self.blocks):
+            last = self.instructions[block.end - 1]
+            opcode = last.opcode.rpartition("+")[2]
+            if opcode in JUMP_INSTRUCTIONS:
+                label = last.arguments[len(last.arguments) - len(OPERANDS[opcode])]
+                self.add_edge(block, self.block_at[program.get_label_ptr(label.value)])
+            if opcode not in FALLTHROUGH_ENDS and index + 1 < len(self.blocks):
+                self.add_edge(block, self.blocks[index + 1])
+
+    def add_edge(self, block, successor):
+        if successor not in block.successors:
+            block.successors.append(successor)
+            successor.predecessors.append(block)
+
+    def add_return_edges(self):
+        return_points = [self.block_at[ip + 1] for ip, instruction in enumerate(self.instructions)
+                         if instruction.opcode == "CALL" and ip + 1 in self.block_at]
+        for block in self.blocks:
+            if self.instructions[block.end - 1].opcode == "RETURN":
+                for return_point in return_points:
+                    self.add_edge(block, return_point)
+
+    def reachable(self):
+        if not self.blocks:
+            return []
+        seen = {self.blocks[0]}
+        pending = [self.blocks[0]]
+        while pending:
+            for successor in pending.pop().successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    pending.append(successor)
+        return [block for block in self.blocks if block in seen]
+
+    def cyclic(self):
+        """
+        Returns set of blocks lying on a cycle, which can run more than once,
+        strongly connected components are found by iterative Tarjan's algorithm
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        cyclic = set()
+        for root in self.blocks:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(root.successors))]
+            while work:
+                block, successors = work[-1]
+                for successor in successors:
+                    if successor not in index:
+                        index[successor] = lowlink[successor] = len(index)
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(successor.successors)))
+                        break
+                    if successor in on_stack:
+                        lowlink[block] = min(lowlink[block], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[block])
+                    if lowlink[block] == index[block]:
+                        component = []
+                        while not component or component[-1] is not block:
+                            component.append(stack.pop())
+                            on_stack.discard(component[-1])
+                        if len(component) > 1 or block in block.successors:
+                            cyclic.update(component)
+        return cyclic
+
+
+class Optimizer:
+    """
+    Class for optimization passes over decoded program
+
+    Level 1 removes unreachable blocks and folds operations on literals,
+    level 2 also propagates constants and copies of global variables inside
+    basic blocks and annotates instructions with inferred operand types.
+    Instructions that would fail at runtime are never folded.
+    """
+
+    def __init__(self, program, report):
+        self.program = program
+        self.report = report
+
+    def run(self, level, freeze_gc=False):
+        if level < 1:
+            return
+        with paused_gc(freeze_gc):
+            self.remove_unreachable()
+            self.fold_constants(propagate=level >= 2)
+            if level >= 2:
+                self.report["instructions with proven types"] += TypeInference(self.program).annotate()
+        self.program.length = len(self.program.instructions)
+        self.program.load_labels()
+
+    def remove_unreachable(self):
+        instructions = self.program.instructions
+        reachable = []
+        for block in ControlFlowGraph(self.program).reachable():
+            reachable.extend(instructions[block.start:block.end])
+        if len(reachable) != len(instructions):
+            self.report["unreachable instructions removed"] += len(instructions) - len(reachable)
+            self.program.instructions = reachable
+            self.program.load_labels()
+
+    def fold_constants(self, propagate):
+        instructions = self.program.instructions
+        for block in ControlFlowGraph(self.program).blocks:
+            known = {}
+            for ip in range(block.start, block.end):
+                instruction = instructions[ip]
+                if propagate:
+                    instruction = self.propagate(instruction, known)
+                instruction = self.fold(instruction)
+                instructions[ip] = instruction
+                if propagate:
+                    self.update_known(instruction, known)
+
+    def propagate(self, instruction, known):
+        if not known:
+            return instruction
+        arguments = list(instruction.arguments)
+        for index, operand in enumerate(OPERANDS[instruction.opcode]):
+            arg = arguments[index]
+            if operand == "symb" and arg.type == "var" and arg.value in known:
+                arguments[index] = known[arg.value]
+                self.report["operands propagated"] += 1
+        if arguments == list(instruction.arguments):
+            return instruction
+        return Instruction(instruction.order, instruction.opcode, tuple(arguments))
+
+    def fold(self, instruction):
+        folding = FOLDABLE.get(instruction.opcode)
+        if folding == None:
+            return instruction
+        types, result_type, operation = folding
+        operands = instruction.arguments[1:]
+        if tuple(arg.type for arg in operands) != types:
+            return instruction
+        result = Argument(result_type, operation(*[arg.value for arg in operands]))
+        self.report["constant operations folded"] += 1
+        return Instruction(instruction.order, "MOVE", (instruction.arguments[0], result))
+
+    def update_known(self, instruction, known):
+        for arg, operand in zip(instruction.arguments, OPERANDS[instruction.opcode]):
+            if operand == "var":
+                variable = arg.value
+                known.pop(variable, None)
+                for copy in [copy for copy, source in known.items() if source == arg]:
+                    del known[copy]
+
+        if instruction.opcode == "MOVE":
+            target, source = instruction.arguments
+            if target.value.frame == GLOBAL_FRAME and target != source:
+                if source.type != "var" or source.value.frame == GLOBAL_FRAME:
+                    known[target.value] = source
+
+
+class TypeInference:
+    """
+    Class for flow-sensitive inference of variable types over control flow graph
+
+    State maps variable to the set of types it can hold once initialized.
+    Missing global variable holds nothing yet, missing local or temporary
+    variable can hold anything, as frame instructions forget both frames.
+    CALL is followed into the called code and RETURN continues after every
+    CALL, so the analysis never needs to know which call is returning.
+    """
+
+    def __init__(self, program):
+        self.instructions = program.instructions
+        self.graph = ControlFlowGraph(program)
+        self.graph.add_return_edges()
+
+    def annotate(self):
+        annotated = 0
+        for block, state in self.infer().items():
+            state = dict(state)
+            for ip in range(block.start, block.end):
+                instruction = self.instructions[ip]
+                types = self.operand_types(instruction, state)
+                if types != None:
+                    self.instructions[ip] = instruction._replace(types=types)
+                    annotated += 1
+                self.transfer(instruction, state)
+        return annotated
+
+    def infer(self):
+        if not self.graph.blocks:
+            return {}
+        entry = self.graph.blocks[0]
+        states = {entry: {}}
+        pending = deque([entry])
+        queued = {entry}
+        while pending:
+            block = pending.popleft()
+            queued.discard(block)
+            state = dict(states[block])
+            for ip in range(block.start, block.end):
+                self.transfer(self.instructions[ip], state)
+
+            for successor in block.successors:
+                old_state = states.get(successor)
+                new_state = state if old_state == None else self.join(old_state, state)
+                if new_state != old_state:
+                    states[successor] = new_state
+                    if successor not in queued:
+                        queued.add(successor)
+                        pending.append(successor)
+        return states
+
+    def join(self, first, second):
+        state = {}
+        for variable in first.keys() | second.keys():
+            if variable.frame == GLOBAL_FRAME:
+                state[variable] = first.get(variable, NO_TYPES) | second.get(variable, NO_TYPES)
+            elif variable in first and variable in second:
+                state[variable] = first[variable] | second[variable]
+        return state
+
+    def lookup(self, state, arg):
+        if arg.type != "var":
+            return frozenset((arg.type,))
+        types = state.get(arg.value)
+        if types == None:
+            return NO_TYPES if arg.value.frame == GLOBAL_FRAME else ALL_TYPES
+        return types
+
+    def transfer(self, instruction, state):
+        opcode = instruction.opcode
+        if opcode in ("CREATEFRAME", "PUSHFRAME", "POPFRAME"):
+            for variable in [variable for variable in state if variable.frame != GLOBAL_FRAME]:
+                del state[variable]
+        elif opcode == "MOVE":
+            state[instruction.arguments[0].value] = self.lookup(state, instruction.arguments[1])
+        elif opcode == "READ":
+            state[instruction.arguments[0].value] = frozenset((instruction.arguments[1].value, "nil"))
+        elif opcode in RESULT_TYPES:
+            state[instruction.arguments[0].value] = RESULT_TYPES[opcode]
+
+    def operand_types(self, instruction, state):
+        types = []
+        proven = False
+        for arg, operand in zip(instruction.arguments, OPERANDS[instruction.opcode]):
+            arg_types = self.lookup(state, arg) if operand == "symb" else NO_TYPES
+            if len(arg_types) == 1:
+                types.extend(arg_types)
+                proven = proven or arg.type == "var"
             else:
-                sys.exit()
-        else:
-            parsed_source = etree.parse(sys.stdin)
-    except SystemExit:
-        file_error()
-    except:
-        parse_error()
+                types.append(None)
+        return tuple(types) if proven else None
 
-    return parsed_source
 
+def proven_types(instruction, *types):
+    return instruction.types != None and instruction.types[1:] == types
 
-def validate_source(parsed_source):
-    schema = StringIO('''\
-    <xs:schema attributeFormDefault="unqualified" elementFormDefault="qualified" xmlns:xs="http://www.w3.org/2001/XMLSchema">
-    <xs:element name="program">
-        <xs:complexType>
-        <xs:sequence minOccurs="0">
-            <xs:element maxOccurs="unbounded" name="instruction">
-            <xs:complexType>
-                <xs:all minOccurs="0" maxOccurs="1">
+
+def proven_comparable(instruction, allow_nil):
+    if instruction.types == None or None in instruction.types[1:]:
+        return False
+    left, right = instruction.types[1:]
+    if allow_nil:
+        return left == right or "nil" in (left, right)
+    return left == right != "nil"
+
+
+def find_leaders(instructions, block_limit=None):
+    leaders = {0}
+    block_start = 0
+    for ip, instruction in enumerate(instructions):
+        if instruction.opcode == "LABEL" or (block_limit != None and ip - block_start >= block_limit):
+            leaders.add(ip)
+        if ip in leaders:
+            block_start = ip
+        if instruction.opcode.rpartition("+")[2] in BLOCK_ENDS:
+            leaders.add(ip + 1)
+    return sorted(leader for leader in leaders if leader < len(instructions))
+
+
+def ends_control_flow(instruction):
+    return instruction.opcode.rpartition("+")[2] in ("CALL",) + FALLTHROUGH_ENDS
+
+
+###########################
+# threaded code execution #
+###########################
+
+
+def compile_program(system):
+    system.compiled_operands = {}
+    code = []
+    with paused_gc(system.freeze_gc):
+        for ip, instruction in enumerate(system.program.instructions):
+            compile_instruction = COMPILERS[instruction.opcode]
+            code.append(compile_instruction(system, instruction, ip))
+    system.compiled_operands = {}
+    return code
+
+
+def compile_operand(system, compile_access, arg):
+    key = (compile_access, arg)
+    access = system.compiled_operands.get(key)
+    if access is None:
+        access = system.compiled_operands[key] = compile_access(system, arg)
+    return access
+
+
+def compile_frame(system, variable):
+    frames = system.frames
+    if variable.frame == GLOBAL_FRAME:
+        global_frame = frames.global_frame
+        return lambda: global_frame
+    if variable.frame == LOCAL_FRAME:
+        local_frames = frames.local_frames
+
+        def get_local_frame():
+            try:
+                return local_frames[-1]
+            except IndexError:
+                frame_error()
+        return get_local_frame
+
+    def get_tmp_frame():
+        frame = frames.tmp_frame
+        if frame is None:
+            frame_error()
+        return frame
+    return get_tmp_frame
+
+
+def compile_read(system, arg):
+    return compile_operand(system, compile_reader, arg)
+
+
+def compile_write(system, arg):
+    return compile_operand(system, compile_writer, arg)
+
+
+def compile_reader(system, arg):
+    if arg.type != "var":
+        return repeat(ProgramData(arg.type, arg.value)).__next__
+
+    slot = arg.value.slot
+    if arg.value.frame == GLOBAL_FRAME:
+        global_frame = system.frames.global_frame
+
+        def read():
+            data = global_frame[slot]
+            if data is None:
+                variable_error()
+            if data.type is None:
+                missing_value_error()
+            return data
+        return read
+
+    get_frame = compile_frame(system, arg.value)
+
+    def read():
+        data = get_frame()[slot]
+        if data is None:
+            variable_error()
+        if data.type is None:
+            missing_value_error()
+        return data
+    return read
+
+
+def compile_writer(system, arg):
+    slot = arg.value.slot
+    if arg.value.frame == GLOBAL_FRAME:
+        global_frame = system.frames.global_frame
+
+        def write(data_type, data_value):
+            data = global_frame[slot]
+            if data is None:
+                variable_error()
+            data.type = data_type
+            data.value = data_value
+        return write
+
+    get_frame = compile_frame(system, arg.value)
+
+    def write(data_type, data_value):
+        data = get_frame()[slot]
+        if data is None:
+            variable_error()
+        data.type = data_type
+        data.value = data_value
+    return write
+
+
+def compile_label_ptr(system, arg):
+    return system.program.get_label_ptr(arg.value)
+
+
+def c_move(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read = compile_read(system, instruction.arguments[1])
+    next_ip = ip + 1
+
+    def run():
+        data = read()
+        write(data.type, data.value)
+        return next_ip
+    return run
+
+
+def c_createframe(system, instruction, ip):
+    create_tf = system.frames.create_tf
+    next_ip = ip + 1
+
+    def run():
+        create_tf()
+        return next_ip
+    return run
+
+
+def c_pushframe(system, instruction, ip):
+    push_frame = system.frames.push_frame
+    next_ip = ip + 1
+
+    def run():
+        push_frame()
+        return next_ip
+    return run
+
+
+def c_popframe(system, instruction, ip):
+    pop_frame = system.frames.pop_frame
+    next_ip = ip + 1
+
+    def run():
+        pop_frame()
+        return next_ip
+    return run
+
+
+def c_defvar(system, instruction, ip):
+    variable = instruction.arguments[0].value
+    get_frame = compile_frame(system, variable)
+    new_data = system.frames.new_data
+    slot = variable.slot
+    next_ip = ip + 1
+
+    def run():
+        frame = get_frame()
+        if frame[slot] is not None:
+            code_semantic_error()
+        frame[slot] = new_data()
+        return next_ip
+    return run
+
+
+def c_call(system, instruction, ip):
+    push = system.callstack.push
+    target_ip = compile_label_ptr(system, instruction.arguments[0]) + 1
+
+    def run():
+        push(ip)
+        return target_ip
+    return run
+
+
+def c_return(system, instruction, ip):
+    pop = system.callstack.pop
+
+    def run():
+        return pop() + 1
+    return run
+
+
+def c_pushs(system, instruction, ip):
+    push = system.datastack.push
+    read = compile_read(system, instruction.arguments[0])
+    next_ip = ip + 1
+
+    def run():
+        data = read()
+        push(data.type, data.value)
+        return next_ip
+    return run
+
+
+def c_pops(system, instruction, ip):
+    pop = system.datastack.pop
+    write = compile_write(system, instruction.arguments[0])
+    next_ip = ip + 1
+
+    def run():
+        write(*pop())
+        return next_ip
+    return run
+
+
+def c_arithmetic(operation):
+    def compile_instruction(system, instruction, ip):
+        write = compile_write(system, instruction.arguments[0])
+        read_left = compile_read(system, instruction.arguments[1])
+        read_right = compile_read(system, instruction.arguments[2])
+        next_ip = ip + 1
+
+        if proven_types(instruction, "int", "int"):
+            def run():
+                left = read_left()
+                right = read_right()
+                write("int", operation(left.value, right.value))
+                return next_ip
+            return run
+
+        def run():
+            left = read_left()
+            right = read_right()
+            if left.type == "int" and right.type == "int":
+                write("int", operation(left.value, right.value))
+            else:
+                type_error()
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def integer_division(left, right):
+    try:
+        return left // right
+    except ZeroDivisionError:
+        wrong_operand_error()
+
+
+def c_relational(operation):
+    def compile_instruction(system, instruction, ip):
+        write = compile_write(system, instruction.arguments[0])
+        read_left = compile_read(system, instruction.arguments[1])
+        read_right = compile_read(system, instruction.arguments[2])
+        next_ip = ip + 1
+
+        if proven_comparable(instruction, allow_nil=False):
+            def run():
+                left = read_left()
+                right = read_right()
+                write("bool", operation(left.value, right.value))
+                return next_ip
+            return run
+
+        def run():
+            left = read_left()
+            right = read_right()
+            if left.type == right.type:
+                try:
+                    result = operation(left.value, right.value)
+                except TypeError:
+                    type_error()
+                write("bool", result)
+            else:
+                type_error()
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def c_eq(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read_left = compile_read(system, instruction.arguments[1])
+    read_right = compile_read(system, instruction.arguments[2])
+    next_ip = ip + 1
+
+    if proven_comparable(instruction, allow_nil=True):
+        def run():
+            left = read_left()
+            right = read_right()
+            write("bool", left.value == right.value)
+            return next_ip
+        return run
+
+    def run():
+        left = read_left()
+        right = read_right()
+        if left.type == right.type or left.type == "nil" or right.type == "nil":
+            write("bool", left.value == right.value)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_logical(operation):
+    def compile_instruction(system, instruction, ip):
+        write = compile_write(system, instruction.arguments[0])
+        read_left = compile_read(system, instruction.arguments[1])
+        read_right = compile_read(system, instruction.arguments[2])
+        next_ip = ip + 1
+
+        if proven_types(instruction, "bool", "bool"):
+            def run():
+                left = read_left()
+                right = read_right()
+                write("bool", operation(left.value, right.value))
+                return next_ip
+            return run
+
+        def run():
+            left = read_left()
+            right = read_right()
+            if left.type == right.type == "bool":
+                write("bool", operation(left.value, right.value))
+            else:
+                type_error()
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def c_not(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read = compile_read(system, instruction.arguments[1])
+    next_ip = ip + 1
+
+    if proven_types(instruction, "bool"):
+        def run():
+            write("bool", not read().value)
+            return next_ip
+        return run
+
+    def run():
+        data = read()
+        if data.type == "bool":
+            write("bool", not data.value)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_int2char(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read = compile_read(system, instruction.arguments[1])
+    next_ip = ip + 1
+
+    def run():
+        data = read()
+        if data.type == "int":
+            try:
+                result = chr(data.value)
+            except ValueError:
+                string_error()
+            write("string", result)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_stri2int(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read_string = compile_read(system, instruction.arguments[1])
+    read_index = compile_read(system, instruction.arguments[2])
+    next_ip = ip + 1
+
+    def run():
+        string = read_string()
+        index = read_index()
+        if string.type == "string" and index.type == "int":
+            try:
+                result = ord(string.value[index.value])
+            except IndexError:
+                string_error()
+            write("int", result)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_read(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    data_type = instruction.arguments[1].value
+    next_ip = ip + 1
+
+    def run():
+        data = read_data(system, data_type)
+        write(data.type, data.value)
+        return next_ip
+    return run
+
+
+def c_write(system, instruction, ip):
+    write = system.output.write
+    arg = instruction.arguments[0]
+    next_ip = ip + 1
+
+    if arg.type != "var":
+        text = format_data(arg)
+
+        def run():
+            write(text)
+            return next_ip
+        return run
+
+    read = compile_read(system, arg)
+
+    def run():
+        write(format_data(read()))
+        return next_ip
+    return run
+
+
+def c_concat(system, instruction, ip):
+    if instruction.arguments[1] == instruction.arguments[0]:
+        return c_append(system, instruction, ip)
+
+    write = compile_write(system, instruction.arguments[0])
+    read_left = compile_read(system, instruction.arguments[1])
+    read_right = compile_read(system, instruction.arguments[2])
+    next_ip = ip + 1
+
+    if proven_types(instruction, "string", "string"):
+        def run():
+            left = read_left()
+            right = read_right()
+            write("string", left.value + right.value)
+            return next_ip
+        return run
+
+    def run():
+        left = read_left()
+        right = read_right()
+        if left.type == "string" and right.type == "string":
+            write("string", left.value + right.value)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_append(system, instruction, ip):
+    read_left = compile_read(system, instruction.arguments[1])
+    read_right = compile_read(system, instruction.arguments[2])
+    next_ip = ip + 1
+
+    def run():
+        left = read_left()
+        right = read_right()
+        if left.type == "string" and right.type == "string":
+            append_string(left, right.value)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_strlen(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read = compile_read(system, instruction.arguments[1])
+    next_ip = ip + 1
+
+    if proven_types(instruction, "string"):
+        def run():
+            write("int", len(string_chars(read())))
+            return next_ip
+        return run
+
+    def run():
+        data = read()
+        if data.type == "string":
+            write("int", len(string_chars(data)))
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_getchar(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    read_string = compile_read(system, instruction.arguments[1])
+    read_index = compile_read(system, instruction.arguments[2])
+    next_ip = ip + 1
+
+    if proven_types(instruction, "string", "int"):
+        def run():
+            string = read_string()
+            index = read_index()
+            try:
+                result = string_chars(string)[index.value]
+            except IndexError:
+                string_error()
+            write("string", result)
+            return next_ip
+        return run
+
+    def run():
+        string = read_string()
+        index = read_index()
+        if string.type == "string" and index.type == "int":
+            try:
+                result = string_chars(string)[index.value]
+            except IndexError:
+                string_error()
+            write("string", result)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_setchar(system, instruction, ip):
+    read_target = compile_read(system, instruction.arguments[0])
+    read_index = compile_read(system, instruction.arguments[1])
+    read_char = compile_read(system, instruction.arguments[2])
+    next_ip = ip + 1
+
+    def run():
+        index = read_index()
+        char = read_char()
+        if index.type == "int" and char.type == "string":
+            set_char(read_target(), index.value, char.value)
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_type(system, instruction, ip):
+    write = compile_write(system, instruction.arguments[0])
+    arg = instruction.arguments[1]
+    next_ip = ip + 1
+
+    if arg.type != "var":
+        constant_type = arg.type
+
+        def run():
+            write("string", constant_type)
+            return next_ip
+        return run
+
+    get_var = system.frames.get_var
+    var_string = arg.value
+
+    def run():
+        data = get_var(var_string, return_none=True)
+        write("string", "" if data == None else data.type)
+        return next_ip
+    return run
+
+
+def c_label(system, instruction, ip):
+    next_ip = ip + 1
+    return lambda: next_ip
+
+
+def c_jump(system, instruction, ip):
+    target_ip = compile_label_ptr(system, instruction.arguments[0]) + 1
+    return lambda: target_ip
+
+
+def c_conditional_jump(jump_if_equal):
+    def compile_instruction(system, instruction, ip):
+        target_ip = compile_label_ptr(system, instruction.arguments[0]) + 1
+        read_left = compile_read(system, instruction.arguments[1])
+        read_right = compile_read(system, instruction.arguments[2])
+        next_ip = ip + 1
+
+        if proven_comparable(instruction, allow_nil=True):
+            def run():
+                if (read_left().value == read_right().value) == jump_if_equal:
+                    return target_ip
+                return next_ip
+            return run
+
+        def run():
+            left = read_left()
+            right = read_right()
+            if left.type == right.type or left.type == "nil" or right.type == "nil":
+                if (left.value == right.value) == jump_if_equal:
+                    return target_ip
+                return next_ip
+            type_error()
+        return run
+    return compile_instruction
+
+
+def c_clears(system, instruction, ip):
+    clear = system.datastack.clear
+    next_ip = ip + 1
+
+    def run():
+        clear()
+        return next_ip
+    return run
+
+
+def c_stack_arithmetic(operation):
+    def compile_instruction(system, instruction, ip):
+        types = system.datastack.types
+        values = system.datastack.values
+        next_ip = ip + 1
+
+        def run():
+            if len(types) < 2:
+                missing_value_error()
+            if types[-1] == "int" and types[-2] == "int":
+                types.pop()
+                right = values.pop()
+                values[-1] = operation(values[-1], right)
+            else:
+                type_error()
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def c_stack_relational(operation):
+    def compile_instruction(system, instruction, ip):
+        types = system.datastack.types
+        values = system.datastack.values
+        next_ip = ip + 1
+
+        def run():
+            if len(types) < 2:
+                missing_value_error()
+            if types[-1] == types[-2]:
+                types.pop()
+                right = values.pop()
+                try:
+                    values[-1] = operation(values[-1], right)
+                except TypeError:
+                    type_error()
+                types[-1] = "bool"
+            else:
+                type_error()
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def c_eqs(system, instruction, ip):
+    types = system.datastack.types
+    values = system.datastack.values
+    next_ip = ip + 1
+
+    def run():
+        if len(types) < 2:
+            missing_value_error()
+        right_type = types.pop()
+        left_type = types[-1]
+        if left_type == right_type or left_type == "nil" or right_type == "nil":
+            right = values.pop()
+            values[-1] = values[-1] == right
+            types[-1] = "bool"
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_stack_logical(operation):
+    def compile_instruction(system, instruction, ip):
+        types = system.datastack.types
+        values = system.datastack.values
+        next_ip = ip + 1
+
+        def run():
+            if len(types) < 2:
+                missing_value_error()
+            if types[-1] == types[-2] == "bool":
+                types.pop()
+                right = values.pop()
+                values[-1] = operation(values[-1], right)
+            else:
+                type_error()
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def c_nots(system, instruction, ip):
+    types = system.datastack.types
+    values = system.datastack.values
+    next_ip = ip + 1
+
+    def run():
+        if not types:
+            missing_value_error()
+        if types[-1] == "bool":
+            values[-1] = not values[-1]
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_int2chars(system, instruction, ip):
+    types = system.datastack.types
+    values = system.datastack.values
+    next_ip = ip + 1
+
+    def run():
+        if not types:
+            missing_value_error()
+        if types[-1] == "int":
+            try:
+                values[-1] = chr(values[-1])
+            except ValueError:
+                string_error()
+            types[-1] = "string"
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_stri2ints(system, instruction, ip):
+    types = system.datastack.types
+    values = system.datastack.values
+    next_ip = ip + 1
+
+    def run():
+        if len(types) < 2:
+            missing_value_error()
+        if types[-2] == "string" and types[-1] == "int":
+            types.pop()
+            index = values.pop()
+            try:
+                values[-1] = ord(values[-1][index])
+            except IndexError:
+                string_error()
+            types[-1] = "int"
+        else:
+            type_error()
+        return next_ip
+    return run
+
+
+def c_stack_jump(jump_if_equal):
+    def compile_instruction(system, instruction, ip):
+        types = system.datastack.types
+        values = system.datastack.values
+        target_ip = compile_label_ptr(system, instruction.arguments[0]) + 1
+        next_ip = ip + 1
+
+        def run():
+            if len(types) < 2:
+                missing_value_error()
+            right_type = types.pop()
+            left_type = types.pop()
+            if left_type == right_type or left_type == "nil" or right_type == "nil":
+                right = values.pop()
+                if (values.pop() == right) == jump_if_equal:
+                    return target_ip
+                return next_ip
+            type_error()
+        return run
+    return compile_instruction
+
+
+def c_fused(system, instruction, ip):
+    first, second = [COMPILERS[part.opcode](system, part, ip) for part in instruction.parts]
+
+    def run():
+        first()
+        return second()
+    return run
+
+
+def c_arithmetic_jump(operation, jump_if_equal):
+    def compile_instruction(system, instruction, ip):
+        arithmetic, jump = instruction.parts
+        target = arithmetic.arguments[0]
+        limit = jump.arguments[2]
+        if jump.arguments[1] != target or limit.type != "int":
+            return c_fused(system, instruction, ip)
+
+        write = compile_write(system, target)
+        read_left = compile_read(system, arithmetic.arguments[1])
+        read_right = compile_read(system, arithmetic.arguments[2])
+        target_ip = compile_label_ptr(system, jump.arguments[0]) + 1
+        limit = limit.value
+        next_ip = ip + 1
+
+        if proven_types(arithmetic, "int", "int"):
+            def run():
+                result = operation(read_left().value, read_right().value)
+                write("int", result)
+                if (result == limit) == jump_if_equal:
+                    return target_ip
+                return next_ip
+            return run
+
+        def run():
+            left = read_left()
+            right = read_right()
+            if left.type == "int" and right.type == "int":
+                result = operation(left.value, right.value)
+                write("int", result)
+            else:
+                type_error()
+            if (result == limit) == jump_if_equal:
+                return target_ip
+            return next_ip
+        return run
+    return compile_instruction
+
+
+def c_pushs_pops(system, instruction, ip):
+    pushs, pops = instruction.parts
+    return c_move(system, Instruction(pushs.order, "MOVE", pops.arguments + pushs.arguments), ip)
+
+
+def c_exit(system, instruction, ip):
+    read = compile_read(system, instruction.arguments[0])
+
+    def run():
+        data = read()
+        if data.type == "int":
+            if 0 <= data.value <= 49:
+                program_exit(data.value)
+            else:
+                wrong_operand_error()
+        else:
+            type_error()
+    return run
+
+
+def c_dprint(system, instruction, ip):
+    error_stream = system.output.error_stream
+    read = compile_read(system, instruction.arguments[0])
+    next_ip = ip + 1
+
+    def run():
+        print(format_data(read()), end='', file=error_stream())
+        return next_ip
+    return run
+
+
+def c_break(system, instruction, ip):
+    next_ip = ip + 1
+
+    def run():
+        system.program.instruction_ptr = ip
+        i_break(system)
+        return next_ip
+    return run
+
+
+COMPILERS = {
+    "MOVE": c_move,
+    "CREATEFRAME": c_createframe,
+    "PUSHFRAME": c_pushframe,
+    "POPFRAME": c_popframe,
+    "DEFVAR": c_defvar,
+    "CALL": c_call,
+    "RETURN": c_return,
+    "PUSHS": c_pushs,
+    "POPS": c_pops,
+    "ADD": c_arithmetic(operator.add),
+    "SUB": c_arithmetic(operator.sub),
+    "MUL": c_arithmetic(operator.mul),
+    "IDIV": c_arithmetic(integer_division),
+    "LT": c_relational(operator.lt),
+    "GT": c_relational(operator.gt),
+    "EQ": c_eq,
+    "AND": c_logical(lambda left, right: left and right),
+    "OR": c_logical(lambda left, right: left or right),
+    "NOT": c_not,
+    "INT2CHAR": c_int2char,
+    "STRI2INT": c_stri2int,
+    "READ": c_read,
+    "WRITE": c_write,
+    "CONCAT": c_concat,
+    "STRLEN": c_strlen,
+    "GETCHAR": c_getchar,
+    "SETCHAR": c_setchar,
+    "TYPE": c_type,
+    "LABEL": c_label,
+    "JUMP": c_jump,
+    "JUMPIFEQ": c_conditional_jump(True),
+    "JUMPIFNEQ": c_conditional_jump(False),
+    "EXIT": c_exit,
+    "DPRINT": c_dprint,
+    "BREAK": c_break,
+    "CLEARS": c_clears,
+    "ADDS": c_stack_arithmetic(operator.add),
+    "SUBS": c_stack_arithmetic(operator.sub),
+    "MULS": c_stack_arithmetic(operator.mul),
+    "IDIVS": c_stack_arithmetic(integer_division),
+    "LTS": c_stack_relational(operator.lt),
+    "GTS": c_stack_relational(operator.gt),
+    "EQS": c_eqs,
+    "ANDS": c_stack_logical(lambda left, right: left and right),
+    "ORS": c_stack_logical(lambda left, right: left or right),
+    "NOTS": c_nots,
+    "INT2CHARS": c_int2chars,
+    "STRI2INTS": c_stri2ints,
+    "JUMPIFEQS": c_stack_jump(True),
+    "JUMPIFNEQS": c_stack_jump(False),
+    "ADD+JUMPIFEQ": c_arithmetic_jump(operator.add, True),
+    "ADD+JUMPIFNEQ": c_arithmetic_jump(operator.add, False),
+    "SUB+JUMPIFEQ": c_arithmetic_jump(operator.sub, True),
+    "SUB+JUMPIFNEQ": c_arithmetic_jump(operator.sub, False),
+    "CONCAT+JUMP": c_fused,
+    "PUSHS+POPS": c_pushs_pops
+}
+
+
+
+##############
+# transpiler #
+##############
+
+
+class Operand(namedtuple("Operand", ["type", "value", "static_type", "data"])):
+    """
+    Class for Python expressions of operand type and value in generated code,
+    static_type is known for constants and operands with proven type, data
+    names ProgramData of variable operand
+    """
+
+    __slots__ = ()
+
+
+class Transpiler:
+    """
+    Class translates loaded program into Python source
+
+    Every basic block becomes one function with straight-line code that
+    returns index of the next block, RETURN maps popped instruction pointer
+    to its block through RETURN_BLOCKS. Long blocks are split and source is
+    compiled in chunks, so huge programs do not build one huge syntax tree.
+    Compiling source costs more than running code once, so when a program
+    has more than TRANSPILED_COLD_LIMIT instructions outside of cycles,
+    blocks outside of cycles run as threaded code instead.
+    """
+
+    def __init__(self, system):
+        self.system = system
+        self.instructions = system.program.instructions
+        self.lines = []
+        self.proven = {}
+        leaders = find_leaders(self.instructions, TRANSPILED_BLOCK_LIMIT)
+        self.blocks = {leader: block for block, leader in enumerate(leaders)}
+        self.resume = dict(self.blocks)
+        for leader, block in self.blocks.items():
+            if self.instructions[leader].opcode == "LABEL":
+                self.resume.setdefault(leader + 1, block)
+        self.cold = self.cold_leaders(leaders)
+
+    def cold_leaders(self, leaders):
+        graph = ControlFlowGraph(self.system.program)
+        graph.add_return_edges()
+        hot = graph.cyclic()
+        if sum(block.end - block.start for block in graph.blocks if block not in hot) <= TRANSPILED_COLD_LIMIT:
+            return set()
+        cold = set()
+        is_cold = False
+        for leader in leaders:
+            if leader in graph.block_at:
+                is_cold = graph.block_at[leader] not in hot
+            if is_cold:
+                cold.add(leader)
+        return cold
+
+    def block_of(self, ip):
+        return self.blocks.get(ip, len(self.blocks))
+
+    def label_block(self, arg):
+        return self.block_of(self.system.program.get_label_ptr(arg.value))
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def comment(self, instruction):
+        """
+        Constants and names are escaped like in a Python string literal,
+        so nothing in them can end the comment line
+        """
+        return "# {}: {}".format(instruction.order, ascii(format_instruction(instruction))[1:-1])
+
+    def transpile(self):
+        leaders = sorted(self.blocks) + [len(self.instructions)]
+        chunk_start = 0
+        self.lines = []
+        for block, leader in enumerate(leaders[:-1]):
+            end = leaders[block + 1]
+            if leader in self.cold:
+                self.lines.append("block_{} = threaded_block({}, {})".format(block, leader, end))
+            else:
+                self.transpile_block(block, leader, end)
+            self.lines.append("")
+            self.lines.append("")
+
+            if end - chunk_start >= TRANSPILED_CHUNK_SIZE or block + 2 == len(leaders):
+                yield "\n".join(self.lines) + "\n"
+                chunk_start = end
+                self.lines = []
+
+    def transpile_block(self, block, leader, end):
+        self.lines.append("def block_{}():".format(block))
+        for ip in range(leader, end):
+            instruction = self.instructions[ip]
+            for part in getattr(instruction, "parts", (instruction,)):
+                self.proven = {arg: arg_type for arg, arg_type in zip(part.arguments, part.types or ())
+                               if arg_type != None}
+                self.emit(self.comment(part))
+                getattr(self, "t_" + part.opcode.lower())(part.arguments, ip)
+        if not ends_control_flow(self.instructions[end - 1]):
+            self.emit("return {}".format(block + 1))
+
+    def return_blocks(self):
+        return [self.block_of(ip + 1) for ip in range(len(self.instructions))]
+
+    def threaded_block(self, start, end):
+        """
+        Runs threaded code of instructions start:end and maps instruction
+        pointer returned by the last of them to the next block
+        """
+        system = self.system
+        code = [COMPILERS[instruction.opcode](system, instruction, ip)
+                for ip, instruction in enumerate(self.instructions[start:end], start)]
+        body = code[:-1]
+        last = code[-1]
+        resume = self.resume
+        end_block = len(self.blocks)
+
+        def run():
+            for run_instruction in body:
+                run_instruction()
+            return resume.get(last(), end_block)
+        return run
+
+    def namespace(self):
+        system = self.system
+        frames = system.frames
+        return {
+            "G": frames.global_frame,
+            "LF": compile_frame(system, Variable(LOCAL_FRAME, 0, "")),
+            "TF": compile_frame(system, Variable(TEMPORARY_FRAME, 0, "")),
+            "frames": frames,
+            "system": system,
+            "threaded_block": self.threaded_block,
+            "ProgramData": ProgramData,
+            "new_data": frames.new_data,
+            "push_call": system.callstack.push,
+            "pop_call": system.callstack.pop,
+            "push_data": system.datastack.push,
+            "pop_data": system.datastack.pop,
+            "T": system.datastack.types,
+            "V": system.datastack.values,
+            "write_output": system.output.write,
+            "error_stream": system.output.error_stream,
+            "format_data": format_data,
+            "read_data": read_data,
+            "i_break": i_break,
+            "program_exit": program_exit,
+            "undefined_value": undefined_value,
+            "checked_chr": checked_chr,
+            "checked_ord": checked_ord,
+            "checked_getchar": checked_getchar,
+            "string_chars": string_chars,
+            "append_string": append_string,
+            "set_char": set_char,
+            "code_semantic_error": code_semantic_error,
+            "missing_value_error": missing_value_error,
+            "type_error": type_error,
+            "variable_error": variable_error,
+            "wrong_operand_error": wrong_operand_error
+        }
+
+    # operands
+
+    def frame(self, variable):
+        if variable.frame == GLOBAL_FRAME:
+            return "G"
+        if variable.frame == LOCAL_FRAME:
+            return "LF()"
+        return "TF()"
+
+    def read(self, arg, name):
+        if arg.type != "var":
+            return Operand(repr(arg.type), repr(arg.value), arg.type, None)
+        self.emit("{} = {}[{}]".format(name, self.frame(arg.value), arg.value.slot))
+        self.emit("if {0} is None or {0}.type is None: undefined_value({0})".format(name))
+        return Operand(name + ".type", name + ".value", self.proven.get(arg), name)
+
+    def write(self, arg, data_type, data_value):
+        self.emit("t = {}[{}]".format(self.frame(arg.value), arg.value.slot))
+        self.emit("if t is None: variable_error()")
+        self.emit("t.type = {}".format(data_type))
+        self.emit("t.value = {}".format(data_value))
+
+    def chars(self, operand):
+        if operand.data == None:
+            return operand.value
+        return "string_chars({})".format(operand.data)
+
+    def check(self, *conditions):
+        tests = []
+        for operand, types in conditions:
+            if operand.static_type != None:
+                if operand.static_type not in types:
+                    self.emit("type_error()")
+                    return
+            elif len(types) == 1:
+                tests.append("{} != {!r}".format(operand.type, types[0]))
+            else:
+                tests.append("{} not in {!r}".format(operand.type, types))
+        if tests:
+            self.emit("if {}: type_error()".format(" or ".join(tests)))
+
+    def check_same_type(self, left, right, allow_nil):
+        if left.static_type != None and right.static_type != None:
+            same = left.static_type == right.static_type
+            if allow_nil:
+                same = same or "nil" in (left.static_type, right.static_type)
+            elif left.static_type == "nil":
+                same = False
+            if not same:
+                self.emit("type_error()")
+            return
+        if left.static_type != None or right.static_type != None:
+            static, dynamic = (left, right) if left.static_type != None else (right, left)
+            if allow_nil and static.static_type == "nil":
+                return
+            if allow_nil:
+                self.emit("if {0} != {1} and {0} != 'nil': type_error()".format(dynamic.type, static.type))
+            elif static.static_type == "nil":
+                self.emit("type_error()")
+            else:
+                self.emit("if {} != {}: type_error()".format(dynamic.type, static.type))
+            return
+        if allow_nil:
+            self.emit("if {0} != {1} and {0} != 'nil' and {1} != 'nil': type_error()".format(left.type, right.type))
+        else:
+            self.emit("if {0} != {1} or {0} == 'nil': type_error()".format(left.type, right.type))
+
+    # instructions
+
+    def t_move(self, arguments, ip):
+        source = self.read(arguments[1], "x")
+        self.emit("r = {}".format(source.value))
+        self.write(arguments[0], source.type, "r")
+
+    def t_createframe(self, arguments, ip):
+        self.emit("frames.create_tf()")
+
+    def t_pushframe(self, arguments, ip):
+        self.emit("frames.push_frame()")
+
+    def t_popframe(self, arguments, ip):
+        self.emit("frames.pop_frame()")
+
+    def t_defvar(self, arguments, ip):
+        variable = arguments[0].value
+        self.emit("f = {}".format(self.frame(variable)))
+        self.emit("if f[{}] is not None: code_semantic_error()".format(variable.slot))
+        self.emit("f[{}] = new_data()".format(variable.slot))
+
+    def t_call(self, arguments, ip):
+        self.emit("push_call({})".format(ip))
+        self.emit("return {}".format(self.label_block(arguments[0])))
+
+    def t_return(self, arguments, ip):
+        self.emit("return RETURN_BLOCKS[pop_call()]")
+
+    def t_pushs(self, arguments, ip):
+        data = self.read(arguments[0], "x")
+        self.emit("push_data({}, {})".format(data.type, data.value))
+
+    def t_pops(self, arguments, ip):
+        self.emit("d_type, d_value = pop_data()")
+        self.write(arguments[0], "d_type", "d_value")
+
+    def arithmetic(self, arguments, operator_symbol):
+        left = self.read(arguments[1], "x")
+        right = self.read(arguments[2], "y")
+        self.check((left, ("int",)), (right, ("int",)))
+        if operator_symbol == "//":
+            self.emit("if {} == 0: wrong_operand_error()".format(right.value))
+        self.emit("r = {} {} {}".format(left.value, operator_symbol, right.value))
+        self.write(arguments[0], "'int'", "r")
+
+    def t_add(self, arguments, ip):
+        self.arithmetic(arguments, "+")
+
+    def t_sub(self, arguments, ip):
+        self.arithmetic(arguments, "-")
+
+    def t_mul(self, arguments, ip):
+        self.arithmetic(arguments, "*")
+
+    def t_idiv(self, arguments, ip):
+        self.arithmetic(arguments, "//")
+
+    def relational(self, arguments, operator_symbol):
+        left = self.read(arguments[1], "x")
+        right = self.read(arguments[2], "y")
+        self.check_same_type(left, right, allow_nil=False)
+        self.emit("r = {} {} {}".format(left.value, operator_symbol, right.value))
+        self.write(arguments[0], "'bool'", "r")
+
+    def t_lt(self, arguments, ip):
+        self.relational(arguments, "<")
+
+    def t_gt(self, arguments, ip):
+        self.relational(arguments, ">")
+
+    def t_eq(self, arguments, ip):
+        left = self.read(arguments[1], "x")
+        right = self.read(arguments[2], "y")
+        self.check_same_type(left, right, allow_nil=True)
+        self.emit("r = {} == {}".format(left.value, right.value))
+        self.write(arguments[0], "'bool'", "r")
+
+    def logical(self, arguments, operator_word):
+        left = self.read(arguments[1], "x")
+        right = self.read(arguments[2], "y")
+        self.check((left, ("bool",)), (right, ("bool",)))
+        self.emit("r = {} {} {}".format(left.value, operator_word, right.value))
+        self.write(arguments[0], "'bool'", "r")
+
+    def t_and(self, arguments, ip):
+        self.logical(arguments, "and")
+
+    def t_or(self, arguments, ip):
+        self.logical(arguments, "or")
+
+    def t_not(self, arguments, ip):
+        data = self.read(arguments[1], "x")
+        self.check((data, ("bool",)))
+        self.emit("r = not {}".format(data.value))
+        self.write(arguments[0], "'bool'", "r")
+
+    def t_int2char(self, arguments, ip):
+        data = self.read(arguments[1], "x")
+        self.check((data, ("int",)))
+        self.emit("r = checked_chr({})".format(data.value))
+        self.write(arguments[0], "'string'", "r")
+
+    def t_stri2int(self, arguments, ip):
+        string = self.read(arguments[1], "x")
+        index = self.read(arguments[2], "y")
+        self.check((string, ("string",)), (index, ("int",)))
+        self.emit("r = checked_ord({}, {})".format(string.value, index.value))
+        self.write(arguments[0], "'int'", "r")
+
+    def t_read(self, arguments, ip):
+        self.emit("d = read_data(system, {!r})".format(arguments[1].value))
+        self.write(arguments[0], "d.type", "d.value")
+
+    def t_write(self, arguments, ip):
+        if arguments[0].type != "var":
+            self.emit("write_output({!r})".format(format_data(arguments[0])))
+            return
+        self.read(arguments[0], "x")
+        self.emit("write_output(format_data(x))")
+
+    def t_concat(self, arguments, ip):
+        left = self.read(arguments[1], "x")
+        right = self.read(arguments[2], "y")
+        self.check((left, ("string",)), (right, ("string",)))
+        if arguments[1] == arguments[0]:
+            self.emit("append_string(x, {})".format(right.value))
+            return
+        self.emit("r = {} + {}".format(left.value, right.value))
+        self.write(arguments[0], "'string'", "r")
+
+    def t_strlen(self, arguments, ip):
+        data = self.read(arguments[1], "x")
+        self.check((data, ("string",)))
+        self.emit("r = len({})".format(self.chars(data)))
+        self.write(arguments[0], "'int'", "r")
+
+    def t_getchar(self, arguments, ip):
+        string = self.read(arguments[1], "x")
+        index = self.read(arguments[2], "y")
+        self.check((string, ("string",)), (index, ("int",)))
+        self.emit("r = checked_getchar({}, {})".format(self.chars(string), index.value))
+        self.write(arguments[0], "'string'", "r")
+
+    def t_setchar(self, arguments, ip):
+        index = self.read(arguments[1], "x")
+        char = self.read(arguments[2], "y")
+        self.check((index, ("int",)), (char, ("string",)))
+        self.read(arguments[0], "z")
+        self.emit("set_char(z, {}, {})".format(index.value, char.value))
+
+    def t_type(self, arguments, ip):
+        arg = arguments[1]
+        if arg.type != "var":
+            self.emit("r = {!r}".format(arg.type))
+        else:
+            self.emit("x = {}[{}]".format(self.frame(arg.value), arg.value.slot))
+            self.emit("if x is None: variable_error()")
+            self.emit("r = '' if x.type is None else x.type")
+        self.write(arguments[0], "'string'", "r")
+
+    def t_label(self, arguments, ip):
+        pass
+
+    def t_jump(self, arguments, ip):
+        self.emit("return {}".format(self.label_block(arguments[0])))
+
+    def conditional_jump(self, arguments, ip, operator_symbol):
+        left = self.read(arguments[1], "x")
+        right = self.read(arguments[2], "y")
+        self.check_same_type(left, right, allow_nil=True)
+        self.emit("if {} {} {}: return {}".format(left.value, operator_symbol, right.value,
+                                                  self.label_block(arguments[0])))
+
+    def t_jumpifeq(self, arguments, ip):
+        self.conditional_jump(arguments, ip, "==")
+
+    def t_jumpifneq(self, arguments, ip):
+        self.conditional_jump(arguments, ip, "!=")
+
+    def t_exit(self, arguments, ip):
+        data = self.read(arguments[0], "x")
+        self.check((data, ("int",)))
+        self.emit("if not 0 <= {} <= 49: wrong_operand_error()".format(data.value))
+        self.emit("program_exit({})".format(data.value))
+
+    def t_dprint(self, arguments, ip):
+        if arguments[0].type != "var":
+            self.emit("print({!r}, end='', file=error_stream())".format(format_data(arguments[0])))
+            return
+        self.read(arguments[0], "x")
+        self.emit("print(format_data(x), end='', file=error_stream())")
+
+    def t_break(self, arguments, ip):
+        self.emit("system.program.instruction_ptr = {}".format(ip))
+        self.emit("i_break(system)")
+
+    # stack instructions, T and V are types and values of data stack
+
+    def pop_operands(self, condition):
+        self.emit("if len(T) < 2: missing_value_error()")
+        self.emit("if {}: type_error()".format(condition))
+        self.emit("del T[-1]")
+        self.emit("r = V.pop()")
+
+    def t_clears(self, arguments, ip):
+        self.emit("T.clear()")
+        self.emit("V.clear()")
+
+    def stack_arithmetic(self, operator_symbol):
+        self.pop_operands("T[-1] != 'int' or T[-2] != 'int'")
+        if operator_symbol == "//":
+            self.emit("if r == 0: wrong_operand_error()")
+        self.emit("V[-1] = V[-1] {} r".format(operator_symbol))
+
+    def t_adds(self, arguments, ip):
+        self.stack_arithmetic("+")
+
+    def t_subs(self, arguments, ip):
+        self.stack_arithmetic("-")
+
+    def t_muls(self, arguments, ip):
+        self.stack_arithmetic("*")
+
+    def t_idivs(self, arguments, ip):
+        self.stack_arithmetic("//")
+
+    def stack_relational(self, operator_symbol):
+        self.pop_operands("T[-1] != T[-2] or T[-1] == 'nil'")
+        self.emit("V[-1] = V[-1] {} r".format(operator_symbol))
+        self.emit("T[-1] = 'bool'")
+
+    def t_lts(self, arguments, ip):
+        self.stack_relational("<")
+
+    def t_gts(self, arguments, ip):
+        self.stack_relational(">")
+
+    def t_eqs(self, arguments, ip):
+        self.pop_operands("T[-1] != T[-2] and T[-1] != 'nil' and T[-2] != 'nil'")
+        self.emit("V[-1] = V[-1] == r")
+        self.emit("T[-1] = 'bool'")
+
+    def t_ands(self, arguments, ip):
+        self.pop_operands("T[-1] != 'bool' or T[-2] != 'bool'")
+        self.emit("V[-1] = V[-1] and r")
+
+    def t_ors(self, arguments, ip):
+        self.pop_operands("T[-1] != 'bool' or T[-2] != 'bool'")
+        self.emit("V[-1] = V[-1] or r")
+
+    def t_nots(self, arguments, ip):
+        self.emit("if not T: missing_value_error()")
+        self.emit("if T[-1] != 'bool': type_error()")
+        self.emit("V[-1] = not V[-1]")
+
+    def t_int2chars(self, arguments, ip):
+        self.emit("if not T: missing_value_error()")
+        self.emit("if T[-1] != 'int': type_error()")
+        self.emit("V[-1] = checked_chr(V[-1])")
+        self.emit("T[-1] = 'string'")
+
+    def t_stri2ints(self, arguments, ip):
+        self.pop_operands("T[-2] != 'string' or T[-1] != 'int'")
+        self.emit("V[-1] = checked_ord(V[-1], r)")
+        self.emit("T[-1] = 'int'")
+
+    def stack_jump(self, arguments, operator_symbol):
+        self.pop_operands("T[-1] != T[-2] and T[-1] != 'nil' and T[-2] != 'nil'")
+        self.emit("del T[-1]")
+        self.emit("if V.pop() {} r: return {}".format(operator_symbol, self.label_block(arguments[0])))
+
+    def t_jumpifeqs(self, arguments, ip):
+        self.stack_jump(arguments, "==")
+
+    def t_jumpifneqs(self, arguments, ip):
+        self.stack_jump(arguments, "!=")
+
+
+def transpile_program(system):
+    transpiler = Transpiler(system)
+    namespace = transpiler.namespace()
+    namespace["RETURN_BLOCKS"] = transpiler.return_blocks()
+    dump_file = None
+    try:
+        if system.dump_code != None:
+            dump_file = open(system.dump_code, "w")
+            dump_file.write("# generated from IPPcode21, one function per basic block\n\n")
+
+        with paused_gc(system.freeze_gc):
+            for source in transpiler.transpile():
+                if dump_file != None:
+                    dump_file.write(source)
+                exec(compile(source, "<IPPcode21>", "exec"), namespace)
+        system.compiled_operands = {}
+
+        blocks = [namespace["block_{}".format(block)] for block in range(len(transpiler.blocks))]
+        if dump_file != None:
+            dump_file.write("RETURN_BLOCKS = {!r}\n".format(namespace["RETURN_BLOCKS"]))
+            dump_file.write("BLOCKS = [{}]\n".format(", ".join(block.__name__ for block in blocks)))
+    except OSError:
+        file_error()
+    finally:
+        if dump_file != None:
+            dump_file.close()
+    return blocks
+
+
+def format_instruction(instruction):
+    arguments = []
+    for arg in instruction.arguments:
+        if arg.type == "var":
+            arguments.append("{}@{}".format(FRAME_CODES[arg.value.frame], arg.value.name))
+        elif arg.type in ("label", "type"):
+            arguments.append(str(arg.value))
+        else:
+            arguments.append("{}@{}".format(arg.type, format_data(arg)).replace("\n", "\\n"))
+    return " ".join([instruction.opcode] + arguments)
+
+
+def undefined_value(data):
+    if data is None:
+        variable_error()
+    missing_value_error()
+
+
+def checked_chr(value):
+    try:
+        return chr(value)
+    except ValueError:
+        string_error()
+
+
+def checked_ord(string, index):
+    try:
+        return ord(string[index])
+    except IndexError:
+        string_error()
+
+
+def checked_getchar(string, index):
+    try:
+        return string[index]
+    except IndexError:
+        string_error()
+
+
+
+############
+# profiler #
+############
+
+
+class Profiler:
+    """
+    Class for execution count and time of every instruction, collected by
+    System.run_profiled and summed per opcode, per order and per label region
+
+    Label region of an instruction is the last LABEL before it in the program.
+    """
+
+    def __init__(self):
+        self.counts = []
+        self.times = []
+        self.elapsed = 0.0
+
+    def summary(self, instructions):
+        opcodes = {}
+        labels = {}
+        orders = []
+        region = None
+        for instruction, count, spent in zip(instructions, self.counts, self.times):
+            if instruction.opcode == "LABEL":
+                region = instruction.arguments[0].value
+            if not count:
+                continue
+            for totals, name in ((opcodes, instruction.opcode), (labels, region)):
+                total = totals.setdefault(name, [0, 0.0])
+                total[0] += count
+                total[1] += spent
+            orders.append({"order": instruction.order, "opcode": instruction.opcode, "label": region,
+                           "count": count, "time": spent})
+
+        def sorted_totals(totals, key):
+            return sorted(({key: name, "count": count, "time": spent} for name, (count, spent) in totals.items()),
+                          key=lambda total: total["time"], reverse=True)
+
+        return {
+            "elapsed": self.elapsed,
+            "instructions": sum(self.counts),
+            "opcodes": sorted_totals(opcodes, "opcode"),
+            "labels": sorted_totals(labels, "label"),
+            "orders": sorted(orders, key=lambda total: total["time"], reverse=True)
+        }
+
+    def report(self, instructions, stream, limit=PROFILE_REPORT_LIMIT):
+        summary = self.summary(instructions)
+        measured = sum(self.times) or 1.0
+        print("Profile: {} instructions in {:.3f} s".format(summary["instructions"], summary["elapsed"]),
+              file=stream)
+        for title, key in (("opcode", "opcode"), ("order", "order"), ("label region", "label")):
+            print("  {:<24} {:>12} {:>12} {:>7}".format(title, "count", "time [ms]", "time %"), file=stream)
+            for total in summary[key + "s"][:limit]:
+                name = total[key] if key != "label" or total[key] != None else "(program start)"
+                if key == "order":
+                    name = "{} {}".format(name, total["opcode"])
+                print("  {:<24} {:>12} {:>12.3f} {:>7.1f}".format(str(name)[:24], total["count"],
+                                                                  total["time"] * 1000,
+                                                                  total["time"] * 100 / measured),
+                      file=stream)
+
+    def dump(self, instructions, path):
+        with open(path, "w") as profile_file:
+            json.dump(self.summary(instructions), profile_file, indent=2)
+
+
+class Sampler:
+    """
+    Class samples the IPPcode21 call chain on SIGPROF, the call stack holds
+    indices of CALL instructions, so the chain of their target labels is only
+    built when samples are written and the program runs with no extra work
+    between samples
+
+    Samples are written in the collapsed stack format of flamegraph tools,
+    one "<program>;label;label count" line per chain. A sample keeps the depth
+    and only SAMPLE_STACK_LIMIT innermost calls, so deep recursion costs no
+    more per sample, outer calls of a deeper chain are written as "...".
+    Signal handler can be set only in the main thread.
+    """
+
+    def __init__(self, rate=SAMPLE_RATE):
+        check_sample_rate(rate)
+        self.rate = rate
+        self.samples = Counter()
+        self.stack = None
+        self.targets = {}
+        self.previous_handler = None
+
+    def start(self, system):
+        try:
+            self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        except ValueError:
+            raise ArgumentError("sampling works only in the main thread")
+        self.stack = system.callstack.stack
+        self.targets = {index: instruction.arguments[0].value
+                        for index, instruction in enumerate(system.program.instructions)
+                        if instruction.opcode == "CALL"}
+        signal.setitimer(signal.ITIMER_PROF, 1 / self.rate, 1 / self.rate)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+
+    def sample(self, signum, frame):
+        stack = self.stack
+        self.samples[len(stack), tuple(islice(reversed(stack), SAMPLE_STACK_LIMIT))] += 1
+
+    def collapsed(self):
+        chains = Counter()
+        for (depth, calls), count in self.samples.items():
+            chain = ["<program>"] + ["..."] * (depth > len(calls))
+            chains[";".join(chain + [self.targets.get(ip, "?") for ip in reversed(calls)])] += count
+        return chains
+
+    def dump(self, path):
+        with open(path, "w") as samples_file:
+            for chain, count in sorted(self.collapsed().items()):
+                samples_file.write("{} {}\n".format(chain, count))
+
+
+def check_sample_rate(rate):
+    if not (rate > 0 and math.isfinite(rate)):
+        raise ArgumentError("sample rate must be a positive number")
+
+
+#########
+# hooks #
+#########
+
+
+class Hooks:
+    """
+    Base class for instrumentation hooks, a tool overrides the events it needs
+
+    Hooks are called by System.run_hooked with the system and ip, the index
+    of the instruction in program.instructions. Events after an instruction
+    are not called when the instruction ends the program. Frame events get
+    a copy of the frame as {name: ProgramData} and variable_write a copy of
+    the written data, changing them has no effect.
+    """
+
+    def instruction_start(self, system, ip, instruction):
+        pass
+
+    def instruction_end(self, system, ip, instruction, next_ip):
+        pass
+
+    def frame_push(self, system, frame):
+        pass
+
+    def frame_pop(self, system, frame):
+        pass
+
+    def call(self, system, ip, label, next_ip):
+        pass
+
+    def call_return(self, system, ip, next_ip):
+        pass
+
+    def variable_write(self, system, variable, data):
+        pass
+
+
+class Tracer(Hooks):
+    """
+    Class prints every executed instruction to stderr, indented by call depth
+    """
+
+    def instruction_start(self, system, ip, instruction):
+        print("{}{}: {}".format("  " * len(system.callstack.stack), instruction.order,
+                                format_instruction(instruction)), file=system.output.error_stream())
+
+
+def frame_view(frames, frame):
+    return {name: ProgramData(data.type, data.value)
+            for name, data in frames.frame_content(frame, frames.local_names).items()}
+
+
+def written_variables(instruction):
+    parts = instruction.parts if isinstance(instruction, FusedInstruction) else (instruction,)
+    return tuple(part.arguments[0].value for part in parts
+                 if part.opcode != "DEFVAR" and OPERANDS[part.opcode][:1] == ("var",))
+
+
+############
+# coverage #
+############
+
+
+class Coverage:
+    """
+    Class for coverage of one run, collected by System.run_covered over indices
+    of the loaded program and mapped back to the decoded program at the end
+
+    Coverage of a program is stored as bitmaps over positions of its decoded
+    instructions: executed instructions, conditional jumps and their taken and
+    not taken edges. Bitmaps of the same program from many runs merge by OR.
+    """
+
+    BITMAPS = ("executed", "branches", "taken", "not_taken")
+
+    def __init__(self):
+        self.executed = None
+        self.fell = None
+        self.jumped = None
+
+    def start(self, length):
+        self.executed = bytearray(length)
+        self.fell = bytearray(length)
+        self.jumped = bytearray(length)
+
+    def instrument(self, code, instructions):
+        """
+        Probe puts the original closure back once it has seen all there is to see,
+        after the first run of an instruction, or after both edges of a conditional jump
+        """
+        executed = self.executed
+        original = list(code)
+
+        def probe(ip):
+            executed[ip] = 1
+            run = code[ip] = original[ip]
+            return run()
+
+        code[:] = [partial(probe, ip) for ip in range(len(code))]
+        for ip, instruction in enumerate(instructions):
+            if instruction.opcode.rpartition("+")[2] in BRANCH_INSTRUCTIONS:
+                code[ip] = self.branch_probe(code, ip, original[ip])
+
+    def branch_probe(self, code, ip, run):
+        executed, fell, jumped = self.executed, self.fell, self.jumped
+
+        def wait_fall():
+            next_ip = run()
+            if next_ip == ip + 1:
+                fell[ip] = 1
+                code[ip] = run
+            return next_ip
+
+        def wait_jump():
+            next_ip = run()
+            if next_ip != ip + 1:
+                jumped[ip] = 1
+                code[ip] = run
+            return next_ip
+
+        def branch_probe():
+            executed[ip] = 1
+            next_ip = run()
+            if next_ip == ip + 1:
+                fell[ip] = 1
+                code[ip] = wait_jump
+            else:
+                jumped[ip] = 1
+                code[ip] = wait_fall
+            return next_ip
+        return branch_probe
+
+    def program_data(self, name, decoded, instructions):
+        positions = {instruction.order: position for position, instruction in enumerate(decoded)}
+        bitmaps = {name: bytearray(len(decoded)) for name in self.BITMAPS}
+        for position, instruction in enumerate(decoded):
+            if instruction.opcode in BRANCH_INSTRUCTIONS:
+                bitmaps["branches"][position] = 1
+
+        for ip, instruction in enumerate(instructions):
+            if not self.executed[ip]:
+                continue
+            fell, jumped = self.fell[ip], self.jumped[ip]
+            parts = instruction.parts if isinstance(instruction, FusedInstruction) else (instruction,)
+            for part in parts:
+                position = positions[part.order]
+                bitmaps["executed"][position] = 1
+                if part.opcode in BRANCH_INSTRUCTIONS:
+                    bitmaps["taken"][position] |= jumped
+                    bitmaps["not_taken"][position] |= fell
+        # jumps continue after the label, so a label counts as executed when its next instruction was
+        executed = bitmaps["executed"]
+        for position in range(len(decoded) - 1, 0, -1):
+            if decoded[position - 1].opcode == "LABEL" and executed[position]:
+                executed[position - 1] = 1
+
+        data = {"name": name, "orders": order_ranges([instruction.order for instruction in decoded])}
+        data.update((name, encode_bitmap(bitmap)) for name, bitmap in bitmaps.items())
+        return data
+
+
+def program_digest(program, instructions):
+    """
+    Runs of the same source share coverage, hashing the source is much cheaper
+    than hashing decoded instructions of a large program
+    """
+    if isinstance(program, str):
+        with open(program, "rb") as source_file:
+            program = source_file.read()
+    elif not isinstance(program, (bytes, bytearray)):
+        program = repr([tuple(instruction[:3]) for instruction in instructions]).encode("utf-8", "surrogatepass")
+    return hashlib.sha256(program).hexdigest()
+
+
+def order_ranges(orders):
+    ranges = []
+    for order in orders:
+        if ranges and ranges[-1][1] + 1 == order:
+            ranges[-1][1] = order
+        else:
+            ranges.append([order, order])
+    return ranges
+
+
+def range_orders(ranges):
+    return [order for start, end in ranges for order in range(start, end + 1)]
+
+
+def encode_bitmap(flags):
+    packed = bytearray((len(flags) + 7) // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            packed[index >> 3] |= 1 << (index & 7)
+    return base64.b64encode(packed).decode("ascii")
+
+
+def decode_bitmap(text, length):
+    packed = base64.b64decode(text)
+    return [bool(packed[index >> 3] & (1 << (index & 7))) for index in range(length)]
+
+
+def merge_coverage(programs, other_programs):
+    for digest, data in other_programs.items():
+        merged = programs.get(digest)
+        if merged == None:
+            programs[digest] = dict(data)
+            continue
+        for name in Coverage.BITMAPS:
+            left, right = base64.b64decode(merged[name]), base64.b64decode(data[name])
+            bits = int.from_bytes(left, "little") | int.from_bytes(right, "little")
+            merged[name] = base64.b64encode(bits.to_bytes(len(left), "little")).decode("ascii")
+    return programs
+
+
+def read_coverage(coverage_file):
+    try:
+        coverage = json.load(coverage_file)
+        if coverage["format"] != COVERAGE_FORMAT:
+            raise ValueError
+        return coverage["programs"]
+    except (ValueError, KeyError, TypeError):
+        file_error()
+
+
+def update_coverage_file(path, programs):
+    """
+    Runs in parallel may share one file, it is locked while being merged
+    """
+    with open(path, "a+") as coverage_file:
+        fcntl.flock(coverage_file, fcntl.LOCK_EX)
+        coverage_file.seek(0)
+        if coverage_file.read(1):
+            coverage_file.seek(0)
+            programs = merge_coverage(read_coverage(coverage_file), programs)
+        coverage_file.seek(0)
+        coverage_file.truncate()
+        json.dump({"format": COVERAGE_FORMAT, "programs": programs}, coverage_file)
+
+
+def merge_coverage_files(output_path, paths):
+    programs = {}
+    for path in paths:
+        try:
+            with open(path) as coverage_file:
+                merge_coverage(programs, read_coverage(coverage_file))
+        except OSError:
+            file_error()
+    try:
+        with open(output_path, "w") as coverage_file:
+            json.dump({"format": COVERAGE_FORMAT, "programs": programs}, coverage_file)
+    except OSError:
+        file_error()
+    print_coverage_report(programs, sys.stdout)
+
+
+def print_coverage_report(programs, stream):
+    totals = [0, 0, 0, 0]
+    for data in sorted(programs.values(), key=lambda data: data["name"]):
+        orders = range_orders(data["orders"])
+        executed, branches, taken, not_taken = (decode_bitmap(data[name], len(orders)) for name in Coverage.BITMAPS)
+        edges = sum(taken[index] + not_taken[index] for index in range(len(orders)) if branches[index])
+        counts = [sum(executed), len(orders), edges, 2 * sum(branches)]
+        totals = [total + count for total, count in zip(totals, counts)]
+
+        print("{}: instructions {}/{} ({}), branch edges {}/{} ({})".format(
+            data["name"], counts[0], counts[1], percent(counts[0], counts[1]),
+            counts[2], counts[3], percent(counts[2], counts[3])), file=stream)
+        missed = order_ranges([order for order, flag in zip(orders, executed) if not flag])
+        if missed:
+            print("  not executed:", ", ".join(format_range(order_range) for order_range in missed), file=stream)
+        partial_branches = ["{} ({})".format(order, missing_edges(taken[index], not_taken[index]))
+                            for index, order in enumerate(orders)
+                            if branches[index] and executed[index] and not (taken[index] and not_taken[index])]
+        if partial_branches:
+            print("  branches missing an edge:", ", ".join(partial_branches), file=stream)
+
+    print("total: instructions {}/{} ({}), branch edges {}/{} ({})".format(
+        totals[0], totals[1], percent(totals[0], totals[1]), totals[2], totals[3], percent(totals[2], totals[3])),
+        file=stream)
+
+
+def missing_edges(taken, not_taken):
+    return " and ".join(edge for edge, seen in (("jump", taken), ("fallthrough", not_taken)) if not seen)
+
+
+def percent(part, whole):
+    return "{:.1f} %".format(part * 100 / whole) if whole else "-"
+
+
+def format_range(order_range):
+    start, end = order_range
+    return str(start) if start == end else "{}-{}".format(start, end)
+
+
+##################
+# error handling #
+##################
+
+
+class InterpretError(Exception):
+    """
+    Class for errors ending interpretation, code is the exit code of interpret
+    """
+
+    code = 99
+    message = "internal error"
+
+    def __init__(self, detail=None):
+        self.detail = detail
+        if detail == None:
+            super().__init__(self.message)
+        else:
+            super().__init__("{} ({})".format(self.message, detail))
+
+
+class ArgumentError(InterpretError):
+    code = 10
+    message = "invalid arguments"
+
+
+class FileError(InterpretError):
+    code = 11
+    message = "invalid file"
+
+
+class XMLFormatError(InterpretError):
+    code = 31
+    message = "invalid XML format"
+
+
+class XMLStructureError(InterpretError):
+    code = 32
+    message = "invalid XML structure"
+
+
+class SemanticError(InterpretError):
+    code = 52
+    message = "semantic error in IPPcode"
+
+
+class OperandTypeError(InterpretError):
+    code = 53
+    message = "wrong type"
+
+
+class VariableError(InterpretError):
+    code = 54
+    message = "variabe not found"
+
+
+class FrameError(InterpretError):
+    code = 55
+    message = "frame doesn't exist"
+
+
+class MissingValueError(InterpretError):
+    code = 56
+    message = "value doesn't exist (or stack is empty)"
+
+
+class OperandValueError(InterpretError):
+    code = 57
+    message = "wrong operand (or zero division)"
+
+
+class StringError(InterpretError):
+    code = 58
+    message = "invalid operation with string"
+
+
+class LimitError(InterpretError):
+    code = 60
+    message = "resource limit exceeded"
+
+
+class InternalError(InterpretError):
+    message = "internal error"
+
+
+class ProgramExit(Exception):
+    """
+    Class for EXIT instruction ending the program with its own exit code
+    """
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def code_semantic_error():
+    raise SemanticError()
+
+
+def type_error():
+    raise OperandTypeError()
+
+
+def variable_error():
+    raise VariableError()
+
+
+def frame_error():
+    raise FrameError()
+
+
+def missing_value_error():
+    raise MissingValueError()
+
+
+def wrong_operand_error():
+    raise OperandValueError()
+
+
+def string_error():
+    raise StringError()
+
+
+def parse_error():
+    raise XMLFormatError()
+
+
+def structure_error(detail=None):
+    raise XMLStructureError(detail)
+
+
+def argument_error():
+    raise ArgumentError()
+
+
+def file_error():
+    raise FileError()
+
+
+def program_exit(code):
+    raise ProgramExit(code)
+
+
+
+##############
+# serve mode #
+##############
+
+
+class ProgramCache:
+    """
+    Class keeps decoded programs of serve mode, the least recently used is dropped first
+    """
+
+    def __init__(self, size=SERVE_CACHE_SIZE):
+        self.size = size
+        self.programs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        instructions = self.programs.get(key)
+        if instructions != None:
+            self.hits += 1
+            self.programs.move_to_end(key)
+            return instructions
+
+        self.misses += 1
+        instructions = load()
+        self.programs[key] = instructions
+        if len(self.programs) > self.size:
+            self.programs.popitem(last=False)
+        return instructions
+
+
+class LimitedOutput(StringIO):
+    """
+    Class captures output of serve mode job, the first write over the limit
+    ends the program and everything written after it is dropped
+    """
+
+    def __init__(self, limit=None):
+        super().__init__()
+        self.limit = limit
+        self.written = 0
+
+    def write(self, text):
+        if self.limit == None:
+            return super().write(text)
+        if self.written + len(text) <= self.limit:
+            self.written += len(text)
+            return super().write(text)
+        if self.written < self.limit:
+            super().write(text[:self.limit - self.written])
+            self.written = self.limit
+            raise LimitError("output limit {} characters".format(self.limit))
+        return len(text)
+
+
+class Server:
+    """
+    Class runs jobs of serve mode, one JSON object per line in both directions
+
+    Job is {"id", "source" (path) or "program" (XML text), "input", "engine",
+    "optimization_level", "peephole", "strict", "limits": {"time" (seconds, at most
+    a day), "output" (characters of stdout)}}, only the program is required. Response is {"id", "exit_code", "stdout",
+    "stderr", "error", "time"}, error is the name of InterpretError or null.
+
+    Time limit interrupts the job by SIGALRM wherever it runs, so the state
+    shared by jobs may be left half updated. The server then drops its
+    program cache and enables garbage collector again, a socket worker
+    closes its connection after the response and is replaced.
+    """
+
+    JOB_OPTIONS = ("engine", "optimization_level", "peephole", "strict")
+
+    def __init__(self, options, cache_size=SERVE_CACHE_SIZE):
+        self.options = options
+        self.cache = ProgramCache(cache_size)
+        self.interrupted = False
+
+    def interrupt(self, signum, frame):
+        self.interrupted = True
+        raise LimitError("time limit")
+
+    def recover(self):
+        self.cache = ProgramCache(self.cache.size)
+        gc.enable()
+
+    def run_job(self, line):
+        start = time.perf_counter()
+        job = {}
+        output = LimitedOutput()
+        error = LimitedOutput()
+        try:
+            try:
+                job = self.parse_job(line)
+                self.check_job(job)
+                limits = job.get("limits") or {}
+                output.limit = limits.get("output")
+                if limits.get("time"):
+                    signal.setitimer(signal.ITIMER_REAL, limits["time"])
+                result = self.create_interpreter(job, output, error).run(job.get("input"))
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except InterpretError as interpret_error:
+            print("ERROR:", interpret_error, file=error)
+            result = Result(interpret_error.code, None, None, interpret_error)
+        except Exception as exception:
+            # a failing job must not take the server and the other clients down
+            interpret_error = InternalError("{}: {}".format(type(exception).__name__, exception))
+            print("ERROR:", interpret_error, file=error)
+            result = Result(interpret_error.code, None, None, interpret_error)
+
+        return {
+            "id": job.get("id"),
+            "exit_code": result.exit_code,
+            "stdout": output.getvalue(),
+            "stderr": error.getvalue(),
+            "error": type(result.error).__name__ if result.error != None else None,
+            "time": round(time.perf_counter() - start, 6)
+        }
+
+    def parse_job(self, line):
+        try:
+            job = json.loads(line)
+        except ValueError as error:
+            raise ArgumentError("job is not valid JSON: {}".format(error))
+        if not isinstance(job, dict):
+            raise ArgumentError("job must be an object")
+        return job
+
+    def check_job(self, job):
+        if ("source" in job) == ("program" in job):
+            raise ArgumentError("job must contain either 'source' or 'program'")
+        if not isinstance(job.get("program", ""), str) or not isinstance(job.get("input", ""), str):
+            raise ArgumentError("'program' and 'input' must be strings")
+        if not isinstance(job.get("limits") or {}, dict):
+            raise ArgumentError("'limits' must be an object")
+        limits = job.get("limits") or {}
+        for value in limits.values():
+            if value != None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                                  or not math.isfinite(value) or value <= 0):
+                raise ArgumentError("limits must be positive numbers")
+        if not isinstance(limits.get("output", 1), int):
+            raise ArgumentError("output limit must be an integer")
+        if (limits.get("time") or 0) > SERVE_TIME_LIMIT:
+            raise ArgumentError("time limit must be at most {} seconds".format(SERVE_TIME_LIMIT))
+        if job.get("engine", "threaded") not in ("threaded", "switch", "transpile"):
+            raise ArgumentError("unknown engine")
+        if job.get("optimization_level", 0) not in (0, 1, 2):
+            raise ArgumentError("optimization level must be 0, 1 or 2")
+
+    def create_interpreter(self, job, output, error):
+        options = dict(self.options)
+        options.update((name, job[name]) for name in self.JOB_OPTIONS if name in job)
+        strict = options.pop("strict")
+
+        if "source" in job:
+            path = job["source"]
+            try:
+                status = os.stat(path)
+            except (OSError, TypeError, ValueError):
+                file_error()
+            key = (path, status.st_mtime_ns, status.st_size, strict)
+            program = path
+        else:
+            program = job["program"].encode("utf-8")
+            key = (hashlib.sha256(program).digest(), strict)
+
+        instructions = self.cache.get(key, lambda: load_source(program, strict))
+        return Interpreter(instructions, output, error, **options)
+
+    def serve_stream(self, reader, writer, recycle=False):
+        for line in reader:
+            if line.strip():
+                writer.write(json.dumps(self.run_job(line)) + "\n")
+                writer.flush()
+                if self.interrupted:
+                    self.recover()
+                    if recycle:
+                        return
+                    self.interrupted = False
+
+    def serve_connections(self, listener):
+        while not self.interrupted:
+            connection, _ = listener.accept()
+            with connection, connection.makefile("r", encoding="utf-8") as reader, \
+                    connection.makefile("w", encoding="utf-8") as writer:
+                try:
+                    self.serve_stream(reader, writer, recycle=True)
+                except (OSError, UnicodeDecodeError):
+                    pass
+
+
+def serve(args):
+    server = Server({"engine": args.engine, "optimization_level": args.optimization_level,
+                     "peephole": args.peephole, "strict": args.strict}, args.serve_cache)
+    signal.signal(signal.SIGALRM, server.interrupt)
+    if args.socket == None:
+        server.serve_stream(sys.stdin, sys.stdout)
+        return 0
+
+    try:
+        os.unlink(args.socket)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        file_error()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.bind(args.socket)
+    except OSError:
+        file_error()
+    listener.listen(SERVE_BACKLOG)
+    try:
+        serve_workers(server, listener, args.workers or os.cpu_count() or 1)
+    finally:
+        os.unlink(args.socket)
+    return 0
+
+
+def serve_workers(server, listener, workers):
+    """
+    Workers are forked after lxml, the schema and the interpreter itself are
+    loaded, they share that memory and the kernel hands connections to the
+    first idle one. A worker that dies is replaced.
+    """
+    get_schema()
+    gc.freeze()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    children = set()
+    try:
+        while True:
+            while len(children) < workers:
+                pid = os.fork()
+                if pid == 0:
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.SIG_DFL)
+                    try:
+                        server.serve_connections(listener)
+                    finally:
+                        os._exit(1)
+                children.add(pid)
+            pid, _ = os.wait()
+            children.discard(pid)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+
+# script methods
+
+
+SOURCE_SCHEMA = '''\
+    <xs:schema attributeFormDefault="unqualified" elementFormDefault="qualified" xmlns:xs="http://www.w3.org/2001/XMLSchema">
+    <xs:element name="program">
+        <xs:complexType>
+        <xs:sequence minOccurs="0">
+            <xs:element maxOccurs="unbounded" name="instruction">
+            <xs:complexType>
+                <xs:all minOccurs="0" maxOccurs="1">
                 <xs:element name="arg1">
                     <xs:complexType>
                     <xs:simpleContent>
@@ -1050,42 +4645,293 @@ def validate_source(parsed_source):
         </xs:unique>
     </xs:element>
     </xs:schema>
-    ''')
-    parsed_schema = etree.parse(schema)
-    xmlschema = etree.XMLSchema(parsed_schema)
-    if not xmlschema.validate(parsed_source):
-        print(xmlschema.error_log.last_error, file=sys.stderr)
+'''
+
+
+def get_order(instruction):
+    try:
+        return int(instruction.attrib['order'])
+    except (KeyError, ValueError):
         structure_error()
 
 
-def get_input(input_path):
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source=", dest="source")
+    parser.add_argument("--input=", dest="input")
+    parser.add_argument("--engine=", dest="engine", choices=["threaded", "switch", "transpile"],
+                        default="threaded")
+    parser.add_argument("--dump-code=", dest="dump_code")
+    parser.add_argument("-O", dest="optimization_level", type=int, choices=[0, 1, 2], default=0)
+    parser.add_argument("--peephole", dest="peephole", action="store_true")
+    parser.add_argument("--opt-report", dest="opt_report", action="store_true")
+    parser.add_argument("--frame-stats", dest="frame_stats", action="store_true")
+    parser.add_argument("--profile=", dest="profile")
+    parser.add_argument("--flamegraph=", dest="flamegraph")
+    parser.add_argument("--sample-rate=", dest="sample_rate", type=float, default=SAMPLE_RATE)
+    parser.add_argument("--trace", dest="trace", action="store_true")
+    parser.add_argument("--coverage=", dest="coverage")
+    parser.add_argument("--merge-coverage=", dest="merge_coverage")
+    parser.add_argument("coverage_files", nargs="*")
+    parser.add_argument("--interleave", dest="interleave", action="store_true")
+    parser.add_argument("--strict", dest="strict", action="store_true")
+    parser.add_argument("--cache-dir=", dest="cache_dir")
+    parser.add_argument("--serve", dest="serve", action="store_true")
+    parser.add_argument("--socket=", dest="socket")
+    parser.add_argument("--workers=", dest="workers", type=int)
+    parser.add_argument("--serve-cache=", dest="serve_cache", type=int, default=SERVE_CACHE_SIZE)
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.coverage_files and not args.merge_coverage:
+        argument_error()
+    check_sample_rate(args.sample_rate)
+    if not (args.source or args.input or args.serve or args.merge_coverage):
+        argument_error()
+    else:
+        return args
+
+
+def load_source(source, strict=False, cache_dir=None, freeze_gc=False):
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    elif not os.path.isfile(source):
+        file_error()
+
+    if cache_dir == None:
+        return parse_source(source, strict, freeze_gc)
+
+    cache_path = get_cache_path(cache_dir, source, strict)
+    instructions = read_cache(cache_path, freeze_gc)
+    if instructions == None:
+        instructions = parse_source(source, strict, freeze_gc)
+        write_cache(cache_path, instructions)
+    return instructions
+
+
+def parse_source(source, strict=False, freeze_gc=False):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        with paused_gc(freeze_gc):
+            if strict:
+                return stream_instructions(source, schema=get_schema())
+            return stream_instructions(source, validator=SourceValidator())
+    except etree.XMLSyntaxError as error:
+        last_error = error.error_log.last_error
+        if last_error == None or last_error.domain != etree.ErrorDomains.SCHEMASV or not is_well_formed(source):
+            parse_error()
+        structure_error(last_error.message)
+    except OSError:
+        file_error()
+
 
-    if args.input:
+def stream_instructions(source, schema=None, validator=None):
+    """
+    Errors of instructions are raised only after the whole document is parsed,
+    a document that is not well-formed fails with 31 wherever the error is
+    """
+    instructions = []
+    decoded_arguments = {}
+    last_order = 0
+    ordered = True
+    instruction_error = None
+
+    order = arguments = None
+    context = etree.iterparse(source, events=("end",), tag="instruction", schema=schema, huge_tree=True)
+    for _, element in context:
+        if validator != None:
+            order, arguments = validator.check_instruction(element)
+        if instruction_error != None or (validator != None and validator.error != None):
+            free_element(element, validator)
+            continue
+        if len(decoded_arguments) > DECODED_ARGUMENTS_LIMIT:
+            decoded_arguments.clear()
+        try:
+            instruction = Instruction.decode(element, decoded_arguments, order, arguments)
+            if instruction.order == last_order:
+                structure_error()
+        except InterpretError as error:
+            instruction_error = error
+            free_element(element, validator)
+            continue
+        if instruction.order < last_order:
+            ordered = False
+        last_order = instruction.order
+        instructions.append(instruction)
+        free_element(element, validator)
+
+    if instruction_error != None:
+        raise instruction_error
+    if validator != None:
+        if not validator.program_checked:
+            validator.check_program(context.root)
+        validator.check_siblings(context.root)
+        if validator.error != None:
+            structure_error(validator.error)
+
+    if not ordered:
+        instructions.sort(key=operator.attrgetter("order"))
+        for previous, instruction in zip(instructions, instructions[1:]):
+            if previous.order == instruction.order:
+                structure_error()
+    return instructions
+
+
+@contextmanager
+def paused_gc(freeze=False):
+    """
+    Loading creates millions of long-lived objects and no reference cycles,
+    so the cyclic garbage collector would only rescan them over and over
+
+    Freezing moves everything alive to the permanent generation for good, that
+    only suits a process running one program, like the command line interpreter
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+        if freeze:
+            gc.freeze()
+
+
+def free_element(element, validator=None):
+    element.clear(keep_tail=True)
+    previous = element.getprevious()
+    if previous is not None:
+        parent = element.getparent()
+        while previous is not None:
+            if validator != None:
+                validator.check_sibling(previous)
+            del parent[0]
+            previous = element.getprevious()
+
+
+def is_well_formed(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        for _, element in etree.iterparse(source, events=("end",), tag="instruction", huge_tree=True):
+            free_element(element)
+    except etree.XMLSyntaxError:
+        return False
+    return True
+
+
+def get_cache_path(cache_dir, source, strict=False):
+    source_hash = hashlib.sha256(CACHE_FORMAT)
+    if strict:
+        source_hash.update(b"strict")
+    if hasattr(source, "getvalue"):
+        source_hash.update(source.getvalue())
+    else:
         try:
-            f = open(args.input, "r")
-            program_input = deque(f.read().splitlines())
-            f.close()
+            with open(source, "rb") as source_file:
+                for chunk in iter(lambda: source_file.read(CACHE_CHUNK_SIZE), b""):
+                    source_hash.update(chunk)
         except OSError:
             file_error()
-    else:
-        program_input = None
+    return os.path.join(cache_dir, source_hash.hexdigest() + ".ippc")
+
+
+def read_cache(cache_path, freeze_gc=False):
+    try:
+        with open(cache_path, "rb") as cache_file:
+            header, cached_instructions = marshal.load(cache_file)
+        if header != CACHE_FORMAT:
+            return None
+
+        arguments = {}
+        instructions = []
+        with paused_gc(freeze_gc):
+            for order, opcode, instruction_arguments in cached_instructions:
+                if opcode not in OPERANDS:
+                    return None
+                instruction_arguments = tuple(arguments.setdefault(argument, Argument(*argument))
+                                              for argument in instruction_arguments)
+                instructions.append(Instruction(order, opcode, instruction_arguments))
+        return instructions
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def write_cache(cache_path, instructions):
+    cached_instructions = tuple((instruction.order, instruction.opcode, tuple(map(tuple, instruction.arguments)))
+                                for instruction in instructions)
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as cache_file:
+            marshal.dump((CACHE_FORMAT, cached_instructions), cache_file)
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def print_optimization_report(report, stream):
+    print("Optimization report:", file=stream)
+    for name, count in sorted(report.items()):
+        print("  {}: {}".format(name, count), file=stream)
+    if not report:
+        print("  nothing applied", file=stream)
 
-    return program_input
 
+def print_frame_statistics(frames, stream):
+    print("Frame statistics:", file=stream)
+    print("  frames allocated: {}".format(frames.frames_allocated), file=stream)
+    print("  frames reused: {}".format(frames.frames_reused), file=stream)
+    print("  variables allocated: {}".format(frames.variables_allocated), file=stream)
+    print("  variables reused: {}".format(frames.variables_reused), file=stream)
 
-# script
 
-args = parse_arguments()
-parsed_source = parse_souce(args.source)
-program_input = get_input(args.input)
+@lru_cache(maxsize=None)
+def get_schema():
+    return etree.XMLSchema(etree.parse(StringIO(SOURCE_SCHEMA)))
 
-validate_source(parsed_source)
-unsorted_program = parsed_source.getroot()
-program = sorted(unsorted_program, key=get_order)
 
+def get_input(input_path):
+    if input_path:
+        try:
+            return open(input_path, "r", buffering=INPUT_BUFFER_SIZE)
+        except OSError:
+            file_error()
+    return open(sys.stdin.fileno(), "r", buffering=INPUT_BUFFER_SIZE, closefd=False)
 
-system = System()
-system.program.instructions = list(program)
-system.program.length = len(program)
-system.program.input = program_input
-system.run_interpret()
+
+def main():
+    try:
+        args = parse_arguments()
+        if args.serve:
+            return serve(args)
+        if args.merge_coverage:
+            merge_coverage_files(args.merge_coverage, args.coverage_files)
+            return 0
+        if args.source:
+            program = args.source
+        else:
+            program = sys.stdin.buffer.read()
+
+        interpreter = Interpreter(program, sys.stdout, sys.stderr, engine=args.engine,
+                                  optimization_level=args.optimization_level, peephole=args.peephole,
+                                  interleave=args.interleave, strict=args.strict, cache_dir=args.cache_dir,
+                                  dump_code=args.dump_code, opt_report=args.opt_report,
+                                  frame_stats=args.frame_stats, profile=args.profile, flamegraph=args.flamegraph,
+                                  sample_rate=args.sample_rate, hooks=[Tracer()] if args.trace else (),
+                                  coverage=args.coverage, freeze_gc=True)
+        interpreter.load()
+        program_input = get_input(args.input)
+    except InterpretError as error:
+        print("ERROR:", error, file=sys.stderr)
+        return error.code
+
+    with program_input:
+        return interpreter.run(program_input).exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -89,7 +89,8 @@ foreach ($words as $word) {
         elseif (preg_match("/^(MOVE|CREATEFRAME|PUSHFRAME|POPFRAME|DEFVAR|CALL|RETURN|(
         ){0}PUSHS|POPS|ADD|SUB|MUL|IDIV|LT|GT|EQ|AND|OR|NOT|INT2CHAR|STRI2INT|READ|(
         ){0}WRITE|CONCAT|STRLEN|GETCHAR|SETCHAR|TYPE|LABEL|JUMP|JUMPIFEQ|JUMPIFNEQ|(
-        ){0}EXIT|DPRINT|BREAK)$/i", $word)) {  // (\n){0} in regex ignores new line 
+        ){0}EXIT|DPRINT|BREAK|CLEARS|ADDS|SUBS|MULS|IDIVS|LTS|GTS|EQS|ANDS|ORS|NOTS|(
+        ){0}INT2CHARS|STRI2INTS|JUMPIFEQS|JUMPIFNEQS)$/i", $word)) {  // (\n){0} in regex ignores new line 
             $token = array("inst", strtoupper($word), $word);
             array_push($tokens, $token);
         }
@@ -220,7 +221,7 @@ function inst(array &$tokens_struct, &$xml) : bool {
         get_next_token($tokens_struct);
         return var1($tokens_struct, $xml);
     }
-    elseif (in_array(strtolower($tokens_struct["act"][1]), array("call", "label", "jump"))) {
+    elseif (in_array(strtolower($tokens_struct["act"][1]), array("call", "label", "jump", "jumpifeqs", "jumpifneqs"))) {
         get_next_token($tokens_struct);
         return label1($tokens_struct, $xml);
     }
@@ -228,7 +229,9 @@ function inst(array &$tokens_struct, &$xml) : bool {
         get_next_token($tokens_struct);
         return symb1($tokens_struct, $xml);
     }
-    elseif (in_array(strtolower($tokens_struct["act"][1]), array("createframe", "pushframe", "popframe", "return", "break"))) {
+    elseif (in_array(strtolower($tokens_struct["act"][1]), array("createframe", "pushframe", "popframe", "return", "break",
+                                        "clears", "adds", "subs", "muls", "idivs", "lts", "gts", "eqs", "ands", "ors",
+                                        "nots", "int2chars", "stri2ints"))) {
         get_next_token($tokens_struct);
         return empty1($tokens_struct, $xml);
     }
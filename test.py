@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Parallel conformance tests of parse.php and interpret.py
+# Tests are .src files with optional .in, .out and .rc files (wistests layout),
+# the report with timings of every test is printed as JSON
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from lxml import etree
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SUITE_DIRECTORIES = {"both": "both", "int-only": "int", "parse-only": "parse"}
+TASKS_PER_WORKER = 200
+
+
+#############
+# discovery #
+#############
+
+
+def find_tests(directory, recursive=False, only=None, suite=None):
+    """
+    Suite of a test is given by the nearest directory named after a suite,
+    only keeps tests of one suite, tests outside suite directories belong to it
+    """
+    suite = SUITE_DIRECTORIES.get(os.path.basename(os.path.normpath(directory)), suite)
+    tests = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if entry.is_dir():
+            if recursive or entry.name in SUITE_DIRECTORIES:
+                tests.extend(find_tests(entry.path, recursive, only, suite))
+        elif entry.name.endswith(".src"):
+            test_suite = suite or only or "both"
+            if only in (None, test_suite):
+                tests.append(make_test(entry.path, test_suite))
+    return tests
+
+
+def make_test(source_path, suite):
+    path = source_path[:-len(".src")]
+    return {
+        "name": os.path.relpath(path),
+        "suite": suite,
+        "source": source_path,
+        "input": read_file(path + ".in", b""),
+        "output": read_file(path + ".out", b""),
+        "exit_code": int(read_file(path + ".rc", b"0").strip() or 0)
+    }
+
+
+def read_file(path, default):
+    try:
+        with open(path, "rb") as test_file:
+            return test_file.read()
+    except FileNotFoundError:
+        return default
+
+
+###########
+# workers #
+###########
+
+
+options = None
+interpret = None
+
+
+def init_worker(worker_options):
+    global options, interpret
+    options = worker_options
+    if not options["subprocess"]:
+        spec = importlib.util.spec_from_file_location("interpret", options["int_script"])
+        interpret = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(interpret)
+        signal.signal(signal.SIGALRM, raise_timeout)
+
+
+def raise_timeout(signum, frame):
+    raise interpret.LimitError("time limit")
+
+
+def run_test(test):
+    result = {"name": test["name"], "suite": test["suite"], "expected_exit_code": test["exit_code"]}
+    start = time.perf_counter()
+    try:
+        result.update(run_suite(test))
+    except subprocess.TimeoutExpired:
+        result.update(status="failed", reason="timeout")
+    except FileNotFoundError as error:
+        result.update(status="skipped", reason="{} not found".format(error.filename))
+    except Exception as error:
+        result.update(status="failed", reason="{}: {}".format(type(error).__name__, error))
+    result["time"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def run_suite(test):
+    if test["suite"] == "parse":
+        exit_code, xml = run_parser(test["source"])
+        return check_result(test, exit_code, lambda: same_xml(xml, test["output"]))
+
+    if test["suite"] == "int":
+        with open(test["source"], "rb") as source_file:
+            program = source_file.read()
+    else:
+        exit_code, program = run_parser(test["source"])
+        if exit_code != 0:
+            return check_result(test, exit_code, None, "parser failed")
+
+    exit_code, output = run_interpret(program, test["input"], test["name"])
+    return check_result(test, exit_code, lambda: output == test["output"])
+
+
+def check_result(test, exit_code, same_output, reason=None):
+    result = {"status": "failed", "exit_code": exit_code, "output_matches": None, "reason": reason}
+    if exit_code != test["exit_code"]:
+        result["reason"] = reason or "exit code"
+    elif exit_code != 0:
+        result["status"] = "passed"
+    else:
+        result["output_matches"] = same_output()
+        result["status"] = "passed" if result["output_matches"] else "failed"
+        result["reason"] = None if result["output_matches"] else "output"
+    return result
+
+
+def run_parser(source_path):
+    with open(source_path, "rb") as source_file:
+        process = subprocess.run([options["php"], options["parse_script"]], stdin=source_file,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=options["timeout"])
+    return process.returncode, process.stdout
+
+
+def run_interpret(program, program_input, name):
+    if options["subprocess"]:
+        with tempfile.NamedTemporaryFile(suffix=".in") as input_file:
+            input_file.write(program_input)
+            input_file.flush()
+            arguments = ["--input=" + input_file.name, "--engine=" + options["engine"],
+                         "-O{}".format(options["optimization_level"])]
+            if options["peephole"]:
+                arguments.append("--peephole")
+            if options["coverage"]:
+                arguments.append("--coverage=" + options["coverage"])
+            process = subprocess.run([sys.executable, options["int_script"]] + arguments,
+                                     input=program, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     timeout=options["timeout"])
+        return process.returncode, process.stdout
+
+    interpreter = interpret.Interpreter(program, error=open(os.devnull, "w"), engine=options["engine"],
+                                        optimization_level=options["optimization_level"],
+                                        peephole=options["peephole"], coverage=options["coverage"], name=name)
+    signal.setitimer(signal.ITIMER_REAL, options["timeout"])
+    try:
+        result = interpreter.run(program_input.decode("utf-8", "replace"))
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        interpreter.error.close()
+    if isinstance(result.error, interpret.LimitError):
+        raise subprocess.TimeoutExpired(options["int_script"], options["timeout"])
+    return result.exit_code, result.output.encode("utf-8", "surrogateescape")
+
+
+def same_xml(xml, expected):
+    if options["java"] and os.path.isfile(options["jexamxml"]):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ("your.out", "test.out", "diffs.xml")]
+            for path, content in zip(paths, (xml, expected)):
+                with open(path, "wb") as xml_file:
+                    xml_file.write(content)
+            process = subprocess.run([options["java"], "-jar", options["jexamxml"]] + paths
+                                     + ["/D", options["jexamcfg"]], stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, timeout=options["timeout"])
+            return process.returncode == 0
+    return canonical_xml(xml) == canonical_xml(expected)
+
+
+def canonical_xml(xml):
+    parser = etree.XMLParser(remove_blank_text=True)
+    try:
+        return etree.tostring(etree.fromstring(xml, parser), method="c14n")
+    except etree.XMLSyntaxError:
+        return None
+
+
+##########
+# report #
+##########
+
+
+def run_tests(tests, worker_options, jobs):
+    start = time.perf_counter()
+    with multiprocessing.Pool(jobs, init_worker, (worker_options,), TASKS_PER_WORKER) as pool:
+        results = sorted(pool.imap_unordered(run_test, tests), key=lambda result: result["name"])
+
+    summary = {"tests": len(results), "time": round(time.perf_counter() - start, 4)}
+    for status in ("passed", "failed", "skipped"):
+        summary[status] = sum(result["status"] == status for result in results)
+    return {"summary": summary, "tests": results}
+
+
+##################
+# script methods #
+##################
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Parallel tests of parse.php and interpret.py, "
+                                                 "the report is printed as JSON")
+    parser.add_argument("--directory=", dest="directory", default=os.path.join(ROOT, "wisfiles", "wistests"))
+    parser.add_argument("--recursive", dest="recursive", action="store_true")
+    parser.add_argument("--parse-script=", dest="parse_script", default=os.path.join(ROOT, "parse.php"))
+    parser.add_argument("--int-script=", dest="int_script", default=os.path.join(ROOT, "interpret.py"))
+    parser.add_argument("--parse-only", dest="suite", action="store_const", const="parse")
+    parser.add_argument("--int-only", dest="suite", action="store_const", const="int")
+    parser.add_argument("--jexamxml=", dest="jexamxml", default=os.path.join(ROOT, "wisfiles", "jexam", "jexamxml.jar"))
+    parser.add_argument("--jexamcfg=", dest="jexamcfg", default=os.path.join(ROOT, "wisfiles", "jexam", "options"))
+    parser.add_argument("--jobs=", dest="jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--timeout=", dest="timeout", type=float, default=10.0)
+    parser.add_argument("--engine=", dest="engine", choices=["threaded", "switch", "transpile"], default="threaded")
+    parser.add_argument("-O", dest="optimization_level", type=int, choices=[0, 1, 2], default=0)
+    parser.add_argument("--peephole", dest="peephole", action="store_true")
+    parser.add_argument("--subprocess", dest="subprocess", action="store_true")
+    parser.add_argument("--report=", dest="report")
+    parser.add_argument("--coverage=", dest="coverage")
+    return parser.parse_args(sys.argv[1:])
+
+
+def main():
+    args = parse_arguments()
+    if not os.path.isdir(args.directory) or not os.path.isfile(args.int_script):
+        return 41
+
+    worker_options = {
+        "php": shutil.which("php7.4") or shutil.which("php") or "php",
+        "java": shutil.which("java"),
+        "parse_script": args.parse_script,
+        "int_script": args.int_script,
+        "jexamxml": args.jexamxml,
+        "jexamcfg": args.jexamcfg,
+        "timeout": args.timeout,
+        "engine": args.engine,
+        "optimization_level": args.optimization_level,
+        "peephole": args.peephole,
+        "subprocess": args.subprocess,
+        "coverage": os.path.abspath(args.coverage) if args.coverage else None
+    }
+    report = run_tests(find_tests(args.directory, args.recursive, args.suite), worker_options, args.jobs)
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    summary = report["summary"]
+    return 0 if summary["tests"] > 0 and summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# Helpers shared by the tests of interpret.py
+
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from xml.sax.saxutils import escape
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTERPRET = os.path.join(ROOT, "interpret.py")
+BENCH = os.path.join(ROOT, "bench.py")
+WISTESTS = os.path.join(ROOT, "wisfiles", "wistests")
+ENGINES = ("switch", "threaded", "transpile")
+
+
+def load_script(name, path):
+    """
+    Imports a script as a module, the scripts aren't a package
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_interpret():
+    return load_script("interpret", INTERPRET)
+
+
+def program_xml(*instructions):
+    """
+    Instructions are (opcode, (type, value), ...) tuples, orders follow their position
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<program language="IPPcode21">']
+    for order, (opcode, *arguments) in enumerate(instructions, 1):
+        lines.append('<instruction order="{}" opcode="{}">'.format(order, opcode))
+        for index, (arg_type, value) in enumerate(arguments, 1):
+            lines.append('<arg{0} type="{1}">{2}</arg{0}>'.format(index, arg_type, escape(value)))
+        lines.append('</instruction>')
+    lines.append('</program>')
+    return "\n".join(lines).encode("utf-8")
+
+
+def run_script(*arguments, stdin=b"", script=None):
+    return subprocess.run([sys.executable, script or INTERPRET] + list(arguments), input=stdin,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120)
+
+
+def run_program(program, *arguments, program_input=None):
+    """
+    Runs interpret.py on the program given as XML bytes, input is passed by --input
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "program.xml")
+        with open(source, "wb") as source_file:
+            source_file.write(program)
+        if program_input != None:
+            input_path = os.path.join(directory, "program.in")
+            with open(input_path, "wb") as input_file:
+                input_file.write(program_input)
+            arguments = ("--input=" + input_path,) + arguments
+        return run_script("--source=" + source, *arguments)
+
+
+def read_wistest(name):
+    """
+    Returns the source path, input, output and exit code of the int-only wistest
+    """
+    path = os.path.join(WISTESTS, "int-only", name)
+    expected = []
+    for extension, default in ((".in", b""), (".out", b""), (".rc", b"0")):
+        try:
+            with open(path + extension, "rb") as test_file:
+                expected.append(test_file.read())
+        except FileNotFoundError:
+            expected.append(default)
+    program_input, output, exit_code = expected
+    return path + ".src", program_input, output, int(exit_code.strip() or 0)
+
+
+class WistestCase(unittest.TestCase):
+
+    def check_wistests(self, names):
+        for name in names:
+            source, program_input, output, exit_code = read_wistest(name)
+            for engine in ENGINES:
+                for level in ("0", "1", "2"):
+                    process = run_script("--source=" + source, "--engine=" + engine, "-O", level,
+                                         stdin=program_input)
+                    self.assertEqual(process.returncode, exit_code, (name, engine, level))
+                    if exit_code == 0:
+                        self.assertEqual(process.stdout, output, (name, engine, level))
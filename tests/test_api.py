@@ -0,0 +1,100 @@
+# Tests of interpret.py used as a library through Interpreter
+
+import gc
+import os
+import tempfile
+import unittest
+from io import StringIO
+
+from support import ENGINES, load_interpret, program_xml
+
+interpret = load_interpret()
+
+
+COUNTER = program_xml(
+    ("DEFVAR", ("var", "GF@line")), ("DEFVAR", ("var", "GF@count")), ("MOVE", ("var", "GF@count"), ("int", "0")),
+    ("LABEL", ("label", "loop")),
+    ("READ", ("var", "GF@line"), ("type", "string")),
+    ("JUMPIFEQ", ("label", "end"), ("var", "GF@line"), ("nil", "nil")),
+    ("ADD", ("var", "GF@count"), ("var", "GF@count"), ("int", "1")),
+    ("JUMP", ("label", "loop")),
+    ("LABEL", ("label", "end")),
+    ("WRITE", ("var", "GF@count")), ("DPRINT", ("string", "done")))
+
+
+class InterpreterTest(unittest.TestCase):
+
+    def test_program_forms(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.xml")
+            with open(path, "wb") as source_file:
+                source_file.write(COUNTER)
+            instructions = interpret.load_source(path)
+            for program in (COUNTER, path, instructions):
+                result = interpret.Interpreter(program).run("a\nb\n")
+                self.assertEqual(result, interpret.Result(0, "2", "done", None))
+
+    def test_runs_are_independent(self):
+        for engine in ENGINES:
+            interpreter = interpret.Interpreter(COUNTER, engine=engine)
+            self.assertEqual(interpreter.run("a\nb\nc\n").output, "3", engine)
+            self.assertEqual(interpreter.run().output, "0", engine)
+            self.assertEqual(interpreter.run(StringIO("a")).output, "1", engine)
+
+    def test_given_streams(self):
+        output = StringIO()
+        error = StringIO()
+        result = interpret.Interpreter(COUNTER, output=output, error=error).run("a\n")
+        self.assertEqual(result, interpret.Result(0, None, None, None))
+        self.assertEqual((output.getvalue(), error.getvalue()), ("1", "done"))
+
+    def test_errors(self):
+        program = program_xml(("WRITE", ("string", "ok")), ("WRITE", ("var", "GF@x")))
+        result = interpret.Interpreter(program).run()
+        self.assertEqual((result.exit_code, result.output), (54, "ok"))
+        self.assertIsInstance(result.error, interpret.VariableError)
+        self.assertIsInstance(result.error, interpret.InterpretError)
+        self.assertTrue(result.error_output.startswith("ERROR:"))
+
+        result = interpret.Interpreter(b"<program").run()
+        self.assertEqual(result.exit_code, 31)
+        self.assertIsInstance(result.error, interpret.XMLFormatError)
+
+    def test_raise_errors(self):
+        program = program_xml(("WRITE", ("string", "ok")), ("WRITE", ("var", "GF@x")))
+        output = StringIO()
+        with self.assertRaises(interpret.VariableError):
+            interpret.Interpreter(program, output=output, raise_errors=True).run()
+        self.assertEqual(output.getvalue(), "ok")
+        with self.assertRaises(interpret.XMLFormatError):
+            interpret.Interpreter(b"<program", raise_errors=True).run()
+
+        program = program_xml(("EXIT", ("int", "7")))
+        result = interpret.Interpreter(program, raise_errors=True).run()
+        self.assertEqual(result, interpret.Result(7, "", "", None))
+
+    def test_exit(self):
+        program = program_xml(("WRITE", ("string", "ok")), ("EXIT", ("int", "7")), ("WRITE", ("string", "after")))
+        for engine in ENGINES:
+            result = interpret.Interpreter(program, engine=engine).run()
+            self.assertEqual(result, interpret.Result(7, "ok", "", None), engine)
+
+    def test_collector_is_not_frozen(self):
+        frozen = gc.get_freeze_count()
+        for level in (0, 2):
+            for engine in ENGINES:
+                result = interpret.Interpreter(COUNTER, engine=engine, optimization_level=level).run("a\n")
+                self.assertEqual(result.output, "1")
+                self.assertTrue(gc.isenabled())
+                self.assertEqual(gc.get_freeze_count(), frozen)
+
+        gc.disable()
+        try:
+            interpret.Interpreter(COUNTER).run()
+            self.assertFalse(gc.isenabled())
+        finally:
+            gc.enable()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# Tests that bench.py runs its workloads and reports them as JSON
+
+import json
+import os
+import tempfile
+import unittest
+
+from support import BENCH, ENGINES, load_script, run_program, run_script
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_import_runs_nothing(self):
+        bench = load_script("bench", BENCH)
+        self.assertIn("large_program", bench.SUITE)
+        self.assertTrue(callable(bench.main))
+
+    def test_deep_recursion_workload(self):
+        workload = load_script("bench", BENCH).deep_recursion_workload(3000)
+        for engine in ENGINES:
+            with tempfile.TemporaryDirectory() as directory:
+                profile_path = os.path.join(directory, "profile.json")
+                process = run_program(workload.source.encode("utf-8"), "--engine=" + engine,
+                                      "--profile=" + profile_path)
+                with open(profile_path) as profile_file:
+                    profile = json.load(profile_file)
+            self.assertEqual((process.returncode, process.stdout), (0, b"4501500"), engine)
+            self.assertEqual(profile["instructions"], workload.instructions, engine)
+
+    def test_memory_benchmark(self):
+        process = run_script("--benchmark=memory", "--depth=1000", script=BENCH)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        result = json.loads(process.stdout)
+        self.assertEqual(result["benchmark"], "memory")
+        self.assertEqual([run["exit_code"] for run in result["runs"].values()], [0, 0])
+        self.assertIsNotNone(result["bytes_per_stack_item"])
+
+    def test_recursion_benchmark(self):
+        process = run_script("--benchmark=recursion", "--fib=8", script=BENCH)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        result = json.loads(process.stdout)
+        self.assertEqual((result["run"]["exit_code"], result["calls"]), (0, 67))
+        self.assertLess(result["allocations_per_call"], result["allocations_per_call_without_pool"])
+
+    def test_suite_and_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline_path = os.path.join(directory, "baseline.json")
+            arguments = ("--scale=0.01", "--repeat=1", "--baseline=" + baseline_path)
+            process = run_script(*arguments, "--save-baseline", script=BENCH)
+            self.assertEqual(process.returncode, 0, process.stderr)
+            with open(baseline_path) as baseline_file:
+                baseline = json.load(baseline_file)
+            self.assertEqual(json.loads(process.stdout), baseline)
+            for name, workload in baseline["workloads"].items():
+                self.assertEqual(workload["exit_code"], 0, name)
+                self.assertGreater(workload["instructions"], 0, name)
+
+            for workload in baseline["workloads"].values():
+                workload["wall_time"] /= 1000
+            with open(baseline_path, "w") as baseline_file:
+                json.dump(baseline, baseline_file)
+            process = run_script(*arguments, script=BENCH)
+            self.assertEqual(process.returncode, 1)
+            comparison = json.loads(process.stdout)["baseline"]
+            self.assertEqual(set(comparison), set(baseline["workloads"]))
+            self.assertTrue(all(workload["regression"] for workload in comparison.values()))
+
+            process = run_script(*arguments, "--tolerance=10000", script=BENCH)
+            self.assertEqual(process.returncode, 0)
+
+            baseline["workloads"]["arithmetic"]["exit_code"] = 1
+            with open(baseline_path, "w") as baseline_file:
+                json.dump(baseline, baseline_file)
+            process = run_script(*arguments, "--tolerance=10000", script=BENCH)
+            self.assertEqual(process.returncode, 1)
+            comparison = json.loads(process.stdout)["baseline"]
+            self.assertEqual([name for name, workload in comparison.items() if workload["regression"]],
+                             ["arithmetic"])
+            self.assertTrue(comparison["arithmetic"]["exit_code_changed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
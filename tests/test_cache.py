@@ -0,0 +1,92 @@
+# Tests of the --cache-dir cache of decoded programs
+
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import program_xml, run_script
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, "cache")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_source(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as source_file:
+            source_file.write(program_xml(("WRITE", ("string", text))))
+        return path
+
+    def run_cached(self, source, *args):
+        process = run_script("--source=" + source, "--cache-dir=" + self.cache_dir, *args)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process.stdout
+
+    def cache_file(self, source):
+        """
+        Runs the source into an empty cache directory and returns the only cache file
+        """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.run_cached(source)
+        names = os.listdir(self.cache_dir)
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith(".ippc"))
+        return os.path.join(self.cache_dir, names[0])
+
+    def test_round_trip(self):
+        source = self.write_source("program.xml", "hello")
+        cache_path = self.cache_file(source)
+        self.assertEqual(self.run_cached(source), b"hello")
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(cache_path)])
+
+    def test_cached_program_is_run(self):
+        other_cache = self.cache_file(self.write_source("other.xml", "cached"))
+        with open(other_cache, "rb") as cache_file:
+            cached = cache_file.read()
+
+        source = self.write_source("program.xml", "hello")
+        cache_path = self.cache_file(source)
+        with open(cache_path, "wb") as cache_file:
+            cache_file.write(cached)
+        self.assertEqual(self.run_cached(source), b"cached")
+
+    def test_strict_has_own_cache(self):
+        source = self.write_source("program.xml", "hello")
+        cache_path = self.cache_file(source)
+        self.assertEqual(self.run_cached(source, "--strict"), b"hello")
+        names = os.listdir(self.cache_dir)
+        self.assertEqual(len(names), 2)
+        with open(cache_path, "wb") as cache_file:
+            cache_file.write(b"corrupt")
+        self.assertEqual(self.run_cached(source, "--strict"), b"hello")
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted(names))
+
+    def test_corrupt_and_stale_cache(self):
+        source = self.write_source("program.xml", "hello")
+        cache_path = self.cache_file(source)
+        with open(cache_path, "rb") as cache_file:
+            header, instructions = marshal.load(cache_file)
+
+        for content in (b"", b"corrupt", marshal.dumps((b"IPPcode21 decoded program 0", instructions)),
+                        marshal.dumps((header, ((1, "NOSUCHOPCODE", ()),)))):
+            with open(cache_path, "wb") as cache_file:
+                cache_file.write(content)
+            self.assertEqual(self.run_cached(source), b"hello", content)
+            with open(cache_path, "rb") as cache_file:
+                self.assertEqual(marshal.load(cache_file), (header, instructions))
+
+    def test_unwritable_cache_dir(self):
+        source = self.write_source("program.xml", "hello")
+        self.cache_dir = source
+        self.assertEqual(self.run_cached(source), b"hello")
+
+
+if __name__ == "__main__":
+    unittest.main()
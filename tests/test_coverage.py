@@ -0,0 +1,110 @@
+# Tests of --coverage and --merge-coverage
+
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+
+from support import ENGINES, load_interpret, program_xml, run_program, run_script
+
+interpret = load_interpret()
+
+
+BRANCH = program_xml(
+    ("DEFVAR", ("var", "GF@x")), ("READ", ("var", "GF@x"), ("type", "int")),
+    ("JUMPIFEQ", ("label", "zero"), ("var", "GF@x"), ("int", "0")),
+    ("WRITE", ("string", "nonzero")), ("EXIT", ("int", "0")),
+    ("LABEL", ("label", "zero")), ("WRITE", ("string", "zero")))
+
+ZERO_REPORT = ["program: instructions 5/7 (71.4 %), branch edges 1/2 (50.0 %)",
+               "  not executed: 4-5",
+               "  branches missing an edge: 3 (fallthrough)",
+               "total: instructions 5/7 (71.4 %), branch edges 1/2 (50.0 %)"]
+FULL_REPORT = ["program: instructions 7/7 (100.0 %), branch edges 2/2 (100.0 %)",
+               "total: instructions 7/7 (100.0 %), branch edges 2/2 (100.0 %)"]
+
+
+class CoverageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "coverage.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def report(self):
+        with open(self.path) as coverage_file:
+            programs = interpret.read_coverage(coverage_file)
+        stream = StringIO()
+        interpret.print_coverage_report(programs, stream)
+        return stream.getvalue().splitlines()
+
+    def test_runs_are_merged(self):
+        for engine in ENGINES:
+            for arguments in ({}, {"optimization_level": 2, "peephole": True}):
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                interpreter = interpret.Interpreter(BRANCH, engine=engine, coverage=self.path, name="program",
+                                                    **arguments)
+                self.assertEqual(interpreter.run("0\n").output, "zero", engine)
+                self.assertEqual(self.report(), ZERO_REPORT, (engine, arguments))
+                self.assertEqual(interpreter.run("0\n").output, "zero", engine)
+                self.assertEqual(self.report(), ZERO_REPORT, (engine, arguments))
+                self.assertEqual(interpreter.run("1\n").output, "nonzero", engine)
+                self.assertEqual(self.report(), FULL_REPORT, (engine, arguments))
+
+    def test_merge_files(self):
+        paths = []
+        for line in (b"0\n", b"1\n"):
+            paths.append(os.path.join(self.directory.name, "coverage{}.json".format(len(paths))))
+            process = run_program(BRANCH, "--coverage=" + paths[-1], program_input=line)
+            self.assertEqual(process.returncode, 0)
+
+        process = run_script("--merge-coverage=" + self.path, *paths)
+        self.assertEqual(process.returncode, 0)
+        lines = process.stdout.decode("utf-8").splitlines()
+        self.assertEqual([line.partition(":")[2] for line in lines], [line.partition(":")[2] for line in FULL_REPORT])
+        with open(self.path) as coverage_file:
+            self.assertEqual(len(json.load(coverage_file)["programs"]), 1)
+
+    def test_other_tools_are_exclusive(self):
+        with self.assertRaises(interpret.ArgumentError):
+            interpret.Interpreter(BRANCH, coverage=self.path, hooks=[interpret.Tracer()]).run("0\n")
+        process = run_program(BRANCH, "--coverage=" + self.path, "--profile=" + os.devnull, program_input=b"0\n")
+        self.assertEqual((process.returncode, process.stdout), (10, b""))
+
+    def test_missing_file_is_created(self):
+        program = program_xml(("WRITE", ("string", "hello")))
+        result = interpret.Interpreter(program, coverage=self.path).run()
+        self.assertEqual((result.exit_code, result.output), (0, "hello"))
+        with open(self.path) as coverage_file:
+            self.assertEqual(len(interpret.read_coverage(coverage_file)), 1)
+
+    def test_corrupt_file(self):
+        program = program_xml(("WRITE", ("string", "hello")))
+        for content in ("not coverage", "{}", "[]"):
+            with open(self.path, "w") as coverage_file:
+                coverage_file.write(content)
+            result = interpret.Interpreter(program, coverage=self.path).run()
+            self.assertEqual((result.exit_code, result.output), (11, "hello"), content)
+            self.assertIsInstance(result.error, interpret.FileError)
+
+            process = run_program(program, "--coverage=" + self.path)
+            self.assertEqual((process.returncode, process.stdout), (11, b"hello"), content)
+            self.assertNotIn(b"Traceback", process.stderr)
+
+    def test_merge_missing_and_corrupt_files(self):
+        output = os.path.join(self.directory.name, "merged.json")
+        missing = os.path.join(self.directory.name, "missing.json")
+        self.assertEqual(run_script("--merge-coverage=" + output, missing).returncode, 11)
+        with open(self.path, "w") as coverage_file:
+            coverage_file.write("[]")
+        process = run_script("--merge-coverage=" + output, self.path)
+        self.assertEqual(process.returncode, 11)
+        self.assertNotIn(b"Traceback", process.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
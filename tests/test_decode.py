@@ -0,0 +1,43 @@
+# Tests of decoding the program once at load time
+
+import unittest
+
+from support import program_xml, run_program
+
+
+class DecodeTest(unittest.TestCase):
+
+    def test_instructions_run_by_order(self):
+        program = b"""<?xml version="1.0" encoding="UTF-8"?>
+<program language="IPPcode21">
+<instruction order="3" opcode="WRITE"><arg1 type="var">GF@x</arg1></instruction>
+<instruction order="1" opcode="DEFVAR"><arg1 type="var">GF@x</arg1></instruction>
+<instruction order="2" opcode="MOVE"><arg2 type="string">b</arg2><arg1 type="var">GF@x</arg1></instruction>
+</program>"""
+        process = run_program(program)
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(process.stdout, b"b")
+
+    def test_literals(self):
+        program = program_xml(("WRITE", ("string", "a\\032b\\092")), ("WRITE", ("int", "-42")),
+                              ("WRITE", ("bool", "true")), ("WRITE", ("nil", "nil")), ("WRITE", ("string", "")))
+        process = run_program(program)
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(process.stdout, b"a b\\-42true")
+
+    def test_invalid_instruction_is_rejected_before_running(self):
+        for invalid in (("NOSUCHOPCODE",), ("WRITE", ("int", "forty")), ("WRITE", ("bool", "yes")),
+                        ("WRITE", ("var", "XF@x")), ("WRITE", ("nil", "null"))):
+            program = program_xml(("WRITE", ("string", "started")), invalid)
+            process = run_program(program)
+            self.assertEqual(process.returncode, 32, invalid)
+            self.assertEqual(process.stdout, b"", invalid)
+
+    def test_lowercase_opcode(self):
+        process = run_program(program_xml(("write", ("string", "ok"))))
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(process.stdout, b"ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# Tests that every engine runs programs the same way as the switch engine
+
+import os
+import tempfile
+import unittest
+
+from support import ENGINES, program_xml, run_program
+
+
+ARITHMETIC = program_xml(
+    ("DEFVAR", ("var", "GF@x")), ("DEFVAR", ("var", "GF@y")),
+    ("ADD", ("var", "GF@x"), ("int", "7"), ("int", "5")), ("WRITE", ("var", "GF@x")),
+    ("SUB", ("var", "GF@x"), ("var", "GF@x"), ("int", "20")), ("WRITE", ("var", "GF@x")),
+    ("MUL", ("var", "GF@x"), ("var", "GF@x"), ("int", "-3")), ("WRITE", ("var", "GF@x")),
+    ("IDIV", ("var", "GF@x"), ("int", "-7"), ("int", "2")), ("WRITE", ("var", "GF@x")),
+    ("LT", ("var", "GF@y"), ("int", "1"), ("int", "2")), ("WRITE", ("var", "GF@y")),
+    ("GT", ("var", "GF@y"), ("string", "a"), ("string", "b")), ("WRITE", ("var", "GF@y")),
+    ("EQ", ("var", "GF@y"), ("nil", "nil"), ("nil", "nil")), ("WRITE", ("var", "GF@y")),
+    ("AND", ("var", "GF@y"), ("bool", "true"), ("bool", "false")), ("WRITE", ("var", "GF@y")),
+    ("OR", ("var", "GF@y"), ("bool", "true"), ("bool", "false")), ("WRITE", ("var", "GF@y")),
+    ("NOT", ("var", "GF@y"), ("var", "GF@y")), ("WRITE", ("var", "GF@y")))
+
+STRINGS = program_xml(
+    ("DEFVAR", ("var", "GF@s")), ("DEFVAR", ("var", "GF@n")),
+    ("CONCAT", ("var", "GF@s"), ("string", "ab"), ("string", "cd")),
+    ("SETCHAR", ("var", "GF@s"), ("int", "1"), ("string", "X")), ("WRITE", ("var", "GF@s")),
+    ("STRLEN", ("var", "GF@n"), ("var", "GF@s")), ("WRITE", ("var", "GF@n")),
+    ("GETCHAR", ("var", "GF@s"), ("var", "GF@s"), ("int", "3")), ("WRITE", ("var", "GF@s")),
+    ("STRI2INT", ("var", "GF@n"), ("string", "A"), ("int", "0")), ("WRITE", ("var", "GF@n")),
+    ("INT2CHAR", ("var", "GF@s"), ("int", "66")), ("WRITE", ("var", "GF@s")),
+    ("TYPE", ("var", "GF@s"), ("var", "GF@n")), ("WRITE", ("var", "GF@s")),
+    ("DEFVAR", ("var", "GF@u")), ("TYPE", ("var", "GF@s"), ("var", "GF@u")), ("WRITE", ("var", "GF@s")),
+    ("WRITE", ("string", "|")))
+
+CALLS = program_xml(
+    ("DEFVAR", ("var", "GF@n")), ("MOVE", ("var", "GF@n"), ("int", "3")),
+    ("CALL", ("label", "count")), ("EXIT", ("int", "7")),
+    ("LABEL", ("label", "count")),
+    ("CREATEFRAME",), ("PUSHFRAME",), ("DEFVAR", ("var", "LF@i")), ("MOVE", ("var", "LF@i"), ("var", "GF@n")),
+    ("WRITE", ("var", "LF@i")), ("SUB", ("var", "GF@n"), ("var", "GF@n"), ("int", "1")),
+    ("PUSHS", ("var", "GF@n")), ("POPS", ("var", "LF@i")),
+    ("JUMPIFEQ", ("label", "done"), ("var", "LF@i"), ("int", "0")),
+    ("CALL", ("label", "count")),
+    ("LABEL", ("label", "done")), ("POPFRAME",), ("RETURN",))
+
+READ = program_xml(
+    ("DEFVAR", ("var", "GF@x")),
+    ("READ", ("var", "GF@x"), ("type", "int")), ("WRITE", ("var", "GF@x")),
+    ("READ", ("var", "GF@x"), ("type", "bool")), ("WRITE", ("var", "GF@x")),
+    ("READ", ("var", "GF@x"), ("type", "string")), ("WRITE", ("var", "GF@x")),
+    ("READ", ("var", "GF@x"), ("type", "int")), ("TYPE", ("var", "GF@x"), ("var", "GF@x")), ("WRITE", ("var", "GF@x")),
+    ("READ", ("var", "GF@x"), ("type", "string")), ("TYPE", ("var", "GF@x"), ("var", "GF@x")), ("WRITE", ("var", "GF@x")))
+
+PROGRAMS = [
+    ("arithmetic", ARITHMETIC, None, b"12-824-4truefalsetruefalsetruefalse", 0),
+    ("strings", STRINGS, None, b"aXcd4d65Bint|", 0),
+    ("calls", CALLS, None, b"321", 7),
+    ("read", READ, b"42\nTRUE\nline\nnot a number\n", b"42truelinenilnil", 0),
+]
+
+ERRORS = [
+    ("zero division", (("IDIV", ("var", "GF@x"), ("int", "1"), ("int", "0")),), 57),
+    ("wrong type", (("ADD", ("var", "GF@x"), ("int", "1"), ("string", "1")),), 53),
+    ("nil comparison", (("LT", ("var", "GF@x"), ("nil", "nil"), ("int", "1")),), 53),
+    ("undefined variable", (("MOVE", ("var", "GF@y"), ("int", "1")),), 54),
+    ("missing frame", (("DEFVAR", ("var", "LF@x")),), 55),
+    ("missing value", (("DEFVAR", ("var", "GF@y")), ("WRITE", ("var", "GF@y"))), 56),
+    ("empty call stack", (("RETURN",),), 56),
+    ("empty data stack", (("POPS", ("var", "GF@x")),), 56),
+    ("exit code", (("EXIT", ("int", "50")),), 57),
+    ("string index", (("GETCHAR", ("var", "GF@x"), ("string", "ab"), ("int", "2")),), 58),
+    ("character", (("INT2CHAR", ("var", "GF@x"), ("int", "-1")),), 58),
+    ("defined twice", (("DEFVAR", ("var", "GF@x")),), 52),
+]
+
+
+class EngineTest(unittest.TestCase):
+
+    def test_programs(self):
+        for name, program, program_input, output, exit_code in PROGRAMS:
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine, program_input=program_input or b"")
+                self.assertEqual((process.returncode, process.stdout), (exit_code, output), (name, engine))
+
+    def test_errors(self):
+        for name, instructions, exit_code in ERRORS:
+            program = program_xml(("DEFVAR", ("var", "GF@x")), ("WRITE", ("string", "ok")), *instructions)
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine)
+                self.assertEqual((process.returncode, process.stdout), (exit_code, b"ok"), (name, engine))
+
+    def test_operands_are_checked_at_load_time(self):
+        for invalid in (("ADD", ("var", "GF@x"), ("int", "1")), ("WRITE", ("label", "x")),
+                        ("JUMP", ("int", "1")), ("CREATEFRAME", ("int", "1"))):
+            program = program_xml(("WRITE", ("string", "started")), invalid)
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine)
+                self.assertEqual((process.returncode, process.stdout), (32, b""), (invalid, engine))
+
+    def test_dump_code(self):
+        for name, program, program_input, output, exit_code in PROGRAMS:
+            with tempfile.TemporaryDirectory() as directory:
+                dump_path = os.path.join(directory, "program.py")
+                process = run_program(program, "--engine=transpile", "--dump-code=" + dump_path,
+                                      program_input=program_input or b"")
+                self.assertEqual((process.returncode, process.stdout), (exit_code, output), name)
+                with open(dump_path) as dump_file:
+                    code = dump_file.read()
+            compile(code, dump_path, "exec")
+            self.assertIn("BLOCKS = [", code, name)
+
+    def test_cold_blocks_of_large_programs(self):
+        """
+        Straight-line code longer than TRANSPILED_COLD_LIMIT runs as threaded code
+        and has to pass control to transpiled loops and functions and back
+        """
+        program = program_xml(("DEFVAR", ("var", "GF@x")), ("MOVE", ("var", "GF@x"), ("int", "0")),
+                              *[("ADD", ("var", "GF@x"), ("var", "GF@x"), ("int", "1"))] * 5000,
+                              ("CALL", ("label", "function")), ("ADD", ("var", "GF@x"), ("var", "GF@x"), ("int", "1")),
+                              ("CALL", ("label", "function")), ("WRITE", ("var", "GF@x")),
+                              ("DEFVAR", ("var", "GF@i")), ("MOVE", ("var", "GF@i"), ("int", "0")),
+                              ("LABEL", ("label", "loop")), ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+                              ("JUMPIFNEQ", ("label", "loop"), ("var", "GF@i"), ("int", "3")),
+                              ("WRITE", ("var", "GF@i")), ("JUMP", ("label", "end")),
+                              ("LABEL", ("label", "function")),
+                              ("ADD", ("var", "GF@x"), ("var", "GF@x"), ("int", "1000")),
+                              ("RETURN",),
+                              ("LABEL", ("label", "end")), ("EXIT", ("int", "3")))
+        for engine in ENGINES:
+            process = run_program(program, "--engine=" + engine)
+            self.assertEqual((process.returncode, process.stdout), (3, b"70013"), engine)
+        with tempfile.TemporaryDirectory() as directory:
+            dump_path = os.path.join(directory, "program.py")
+            process = run_program(program, "--engine=transpile", "--dump-code=" + dump_path)
+            with open(dump_path) as dump_file:
+                code = dump_file.read()
+        self.assertEqual((process.returncode, process.stdout), (3, b"70013"))
+        self.assertIn("block_0 = threaded_block(0, ", code)
+        self.assertIn("x.value + 1000", code)
+
+    def test_constants_in_comments(self):
+        for text in ("a\\013raise SystemExit(42)", "a\\011\\012\\000b", "\\092\\013x"):
+            program = program_xml(("DEFVAR", ("var", "GF@x")), ("MOVE", ("var", "GF@x"), ("string", text)),
+                                  ("WRITE", ("var", "GF@x")), ("WRITE", ("string", text)))
+            outputs = set()
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine)
+                self.assertEqual(process.returncode, 0, (text, engine))
+                outputs.add(process.stdout)
+            self.assertEqual(len(outputs), 1, text)
+
+
+if __name__ == "__main__":
+    unittest.main()
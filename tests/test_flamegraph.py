@@ -0,0 +1,92 @@
+# Tests of --flamegraph, call chains sampled on SIGPROF
+
+import os
+import tempfile
+import threading
+import unittest
+
+from support import ENGINES, load_interpret, program_xml, run_program
+
+interpret = load_interpret()
+
+
+BUSY = program_xml(
+    ("DEFVAR", ("var", "GF@i")), ("MOVE", ("var", "GF@i"), ("int", "0")),
+    ("CALL", ("label", "outer")), ("WRITE", ("var", "GF@i")), ("EXIT", ("int", "0")),
+    ("LABEL", ("label", "outer")), ("CALL", ("label", "busy")), ("RETURN",),
+    ("LABEL", ("label", "busy")),
+    ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFNEQ", ("label", "busy"), ("var", "GF@i"), ("int", "200000")),
+    ("RETURN",))
+
+
+class FlamegraphTest(unittest.TestCase):
+
+    def test_collapsed_stacks(self):
+        sampler = interpret.Sampler()
+        sampler.targets = {2: "outer", 6: "busy"}
+        sampler.samples.update({(0, ()): 1, (1, (2,)): 2, (2, (6, 2)): 3, (1000, (6, 2)): 5})
+        sampler.samples[2, (6, 2)] += 1
+        self.assertEqual(sampler.collapsed(), {"<program>": 1, "<program>;outer": 2, "<program>;outer;busy": 4,
+                                               "<program>;...;outer;busy": 5})
+
+    def test_deep_stack_samples_are_bounded(self):
+        sampler = interpret.Sampler()
+        sampler.stack = [2] + [6] * 10000
+        sampler.sample(None, None)
+        (depth, calls), = sampler.samples
+        self.assertEqual((depth, len(calls)), (10001, interpret.SAMPLE_STACK_LIMIT))
+        chain = ["<program>", "..."] + ["?"] * interpret.SAMPLE_STACK_LIMIT
+        self.assertEqual(list(sampler.collapsed()), [";".join(chain)])
+
+    def test_sampling_outside_main_thread(self):
+        results = []
+        interpreter = interpret.Interpreter(BUSY, flamegraph=os.devnull)
+        thread = threading.Thread(target=lambda: results.append(interpreter.run()))
+        thread.start()
+        thread.join()
+        self.assertEqual(results[0].exit_code, 10)
+        self.assertIsInstance(results[0].error, interpret.ArgumentError)
+
+    def test_samples(self):
+        for engine in ENGINES:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "samples.txt")
+                process = run_program(BUSY, "--engine=" + engine, "--flamegraph=" + path, "--sample-rate=2000")
+                self.assertEqual((process.returncode, process.stdout), (0, b"200000"), engine)
+                with open(path) as samples_file:
+                    lines = samples_file.read().splitlines()
+            self.assertTrue(lines, engine)
+            counts = {}
+            for line in lines:
+                self.assertRegex(line, r"^<program>(;(outer|busy))* [1-9][0-9]*$", engine)
+                chain, _, count = line.rpartition(" ")
+                counts[chain] = int(count)
+            self.assertEqual(max(counts, key=counts.get), "<program>;outer;busy", engine)
+
+    def test_unwritable_samples(self):
+        with tempfile.TemporaryDirectory() as directory:
+            process = run_program(BUSY, "--flamegraph=" + directory)
+        self.assertEqual((process.returncode, process.stdout), (11, b"200000"))
+
+    def test_invalid_rate(self):
+        for rate in (0, -1.0, float("nan"), float("inf")):
+            with self.assertRaises(interpret.ArgumentError):
+                interpret.Interpreter(BUSY, flamegraph=os.devnull, sample_rate=rate)
+            with self.assertRaises(interpret.ArgumentError):
+                interpret.Sampler(rate)
+        for rate in ("0", "-10", "nan"):
+            process = run_program(BUSY, "--flamegraph=" + os.devnull, "--sample-rate=" + rate)
+            self.assertEqual((process.returncode, process.stdout), (10, b""), rate)
+            self.assertNotIn(b"Traceback", process.stderr)
+
+    def test_no_samples_when_loading_fails(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "samples.txt")
+            result = interpret.Interpreter(b"<program", flamegraph=path).run()
+            self.assertEqual(result.exit_code, 31)
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+# Tests of frames and variables resolved to slots at load time
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from support import ENGINES, INTERPRET, load_interpret, program_xml, run_program
+
+interpret = load_interpret()
+
+
+def frame_program(*instructions):
+    return program_xml(("WRITE", ("string", "ok")), *instructions)
+
+
+class FrameTest(unittest.TestCase):
+
+    def run_engines(self, program, exit_code, output=b"ok"):
+        for engine in ENGINES:
+            process = run_program(program, "--engine=" + engine)
+            self.assertEqual((process.returncode, process.stdout), (exit_code, output), engine)
+        return process
+
+    def test_same_name_in_every_frame(self):
+        program = frame_program(("DEFVAR", ("var", "GF@x")), ("MOVE", ("var", "GF@x"), ("string", "g")),
+                                ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("MOVE", ("var", "TF@x"), ("string", "l")),
+                                ("PUSHFRAME",),
+                                ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("MOVE", ("var", "TF@x"), ("string", "t")),
+                                ("WRITE", ("var", "GF@x")), ("WRITE", ("var", "LF@x")), ("WRITE", ("var", "TF@x")),
+                                ("POPFRAME",), ("WRITE", ("var", "TF@x")))
+        self.run_engines(program, 0, b"okgltl")
+
+    def test_new_frame_has_no_variables(self):
+        program = frame_program(("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("MOVE", ("var", "TF@x"), ("int", "1")),
+                                ("CREATEFRAME",), ("WRITE", ("var", "TF@x")))
+        self.run_engines(program, 54)
+        program = frame_program(("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("PUSHFRAME",), ("POPFRAME",),
+                                ("POPFRAME",))
+        self.run_engines(program, 55)
+
+    def test_frame_errors(self):
+        self.run_engines(frame_program(("WRITE", ("var", "LF@x"))), 55)
+        self.run_engines(frame_program(("DEFVAR", ("var", "TF@x"))), 55)
+        self.run_engines(frame_program(("CREATEFRAME",), ("PUSHFRAME",), ("DEFVAR", ("var", "TF@x"))), 55)
+        self.run_engines(frame_program(("CREATEFRAME",), ("WRITE", ("var", "TF@x"))), 54)
+        self.run_engines(frame_program(("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("DEFVAR", ("var", "TF@x"))), 52)
+        self.run_engines(frame_program(("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("WRITE", ("var", "TF@x"))), 56)
+
+    def test_break_prints_names(self):
+        program = frame_program(("DEFVAR", ("var", "GF@counter")), ("MOVE", ("var", "GF@counter"), ("int", "5")),
+                                ("CREATEFRAME",), ("DEFVAR", ("var", "TF@local")), ("BREAK",))
+        process = self.run_engines(program, 0)
+        self.assertIn(b"counter", process.stderr)
+        self.assertIn(b"local", process.stderr)
+
+    def test_global_frame_is_indexed_by_slot(self):
+        frames = interpret.Frames()
+        global_frame = frames.global_frame
+        frames.set_layout(["a", "b", "c"], [])
+        self.assertIs(frames.global_frame, global_frame)
+        self.assertEqual(global_frame, [None, None, None])
+        frames.def_var(interpret.Variable(interpret.GLOBAL_FRAME, 1, "b"))
+        frames.update_var(interpret.Variable(interpret.GLOBAL_FRAME, 1, "b"), "int", 1)
+        self.assertEqual(list(frames.frame_content(global_frame, frames.global_names)), ["b"])
+        program = frame_program(("WRITE", ("var", "GF@x")), ("DEFVAR", ("var", "GF@x")))
+        self.run_engines(program, 54)
+        program = frame_program(("DEFVAR", ("var", "GF@x")), ("DEFVAR", ("var", "GF@x")))
+        self.run_engines(program, 52)
+
+    def test_recycled_frames_are_reset(self):
+        program = frame_program(("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("MOVE", ("var", "TF@x"), ("int", "1")),
+                                ("PUSHFRAME",), ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")),
+                                ("MOVE", ("var", "TF@x"), ("int", "2")), ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")),
+                                ("WRITE", ("var", "LF@x")), ("POPFRAME",), ("WRITE", ("var", "TF@x")),
+                                ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("WRITE", ("var", "TF@x")))
+        self.run_engines(program, 56, b"ok11")
+
+    def test_recycled_frames_keep_no_names(self):
+        names = ["v{}".format(index) for index in range(50)]
+        instructions = [("WRITE", ("string", "ok"))]
+        for name in names:
+            instructions += [("CREATEFRAME",), ("DEFVAR", ("var", "TF@" + name)),
+                             ("MOVE", ("var", "TF@" + name), ("string", name)), ("PUSHFRAME",),
+                             ("WRITE", ("var", "LF@" + name)), ("POPFRAME",)]
+        for name in (names[0], names[-2]):
+            program = program_xml(*instructions, ("CREATEFRAME",), ("DEFVAR", ("var", "TF@" + names[-1])),
+                                  ("WRITE", ("var", "TF@" + name)))
+            self.run_engines(program, 54, b"ok" + "".join(names).encode("ascii"))
+
+    def test_frame_statistics(self):
+        program = program_xml(("DEFVAR", ("var", "GF@i")), ("MOVE", ("var", "GF@i"), ("int", "0")),
+                              ("LABEL", ("label", "loop")),
+                              ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("MOVE", ("var", "TF@x"), ("var", "GF@i")),
+                              ("PUSHFRAME",), ("CALL", ("label", "function")), ("POPFRAME",),
+                              ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+                              ("JUMPIFNEQ", ("label", "loop"), ("var", "GF@i"), ("int", "100")),
+                              ("CREATEFRAME",), ("EXIT", ("int", "0")),
+                              ("LABEL", ("label", "function")), ("WRITE", ("var", "LF@x")), ("RETURN",))
+        output = "".join(map(str, range(100))).encode("ascii")
+        for engine in ENGINES:
+            process = run_program(program, "--engine=" + engine, "--frame-stats")
+            self.assertEqual((process.returncode, process.stdout), (0, output), engine)
+            statistics = dict(line.strip().split(": ") for line in process.stderr.decode("utf-8").splitlines()[1:])
+            self.assertLessEqual(int(statistics["frames allocated"]), 2, engine)
+            self.assertGreaterEqual(int(statistics["frames reused"]), 99, engine)
+            self.assertLessEqual(int(statistics["variables allocated"]), 2, engine)
+
+    def test_variable_pool_limit(self):
+        frames = interpret.Frames()
+        frames.data_pool.extend(interpret.ProgramData() for _ in range(interpret.VARIABLE_POOL_LIMIT - 3))
+        frame = interpret.Frame((slot, interpret.ProgramData()) for slot in range(10))
+        frames.release_frame(frame)
+        self.assertEqual(len(frames.data_pool), interpret.VARIABLE_POOL_LIMIT)
+        self.assertEqual(frame, {})
+        frames.release_frame(interpret.Frame({0: interpret.ProgramData()}))
+        self.assertEqual(len(frames.data_pool), interpret.VARIABLE_POOL_LIMIT)
+
+    def test_variables_beyond_frame_pool(self):
+        program = program_xml(("DEFVAR", ("var", "GF@depth")), ("DEFVAR", ("var", "GF@round")),
+                              ("MOVE", ("var", "GF@round"), ("int", "0")),
+                              ("LABEL", ("label", "round")),
+                              ("MOVE", ("var", "GF@depth"), ("int", "1000")), ("CALL", ("label", "deep")),
+                              ("ADD", ("var", "GF@round"), ("var", "GF@round"), ("int", "1")),
+                              ("JUMPIFNEQ", ("label", "round"), ("var", "GF@round"), ("int", "3")),
+                              ("EXIT", ("int", "0")),
+                              ("LABEL", ("label", "deep")),
+                              ("JUMPIFEQ", ("label", "bottom"), ("var", "GF@depth"), ("int", "0")),
+                              ("SUB", ("var", "GF@depth"), ("var", "GF@depth"), ("int", "1")),
+                              ("CREATEFRAME",), ("DEFVAR", ("var", "TF@x")), ("PUSHFRAME",),
+                              ("CALL", ("label", "deep")),
+                              ("POPFRAME",),
+                              ("LABEL", ("label", "bottom")),
+                              ("RETURN",))
+        for engine in ENGINES:
+            process = run_program(program, "--engine=" + engine, "--frame-stats")
+            self.assertEqual(process.returncode, 0, engine)
+            statistics = dict(line.strip().split(": ") for line in process.stderr.decode("utf-8").splitlines()[1:])
+            self.assertLessEqual(int(statistics["variables allocated"]), 1002, engine)
+            self.assertGreaterEqual(int(statistics["variables reused"]), 1999, engine)
+
+    def test_frames_hold_only_defined_variables(self):
+        """
+        A function never called defines 3000 local names, a recursion 20000
+        calls deep defines one, its frames must not be as wide as all names
+        """
+        program = program_xml(("JUMP", ("label", "main")),
+                              ("LABEL", ("label", "wide")),
+                              *[("DEFVAR", ("var", "LF@v{}".format(index))) for index in range(3000)],
+                              ("RETURN",),
+                              ("LABEL", ("label", "deep")),
+                              ("JUMPIFEQ", ("label", "bottom"), ("var", "GF@depth"), ("int", "0")),
+                              ("SUB", ("var", "GF@depth"), ("var", "GF@depth"), ("int", "1")),
+                              ("CREATEFRAME",), ("DEFVAR", ("var", "TF@v0")), ("PUSHFRAME",),
+                              ("CALL", ("label", "deep")),
+                              ("POPFRAME",),
+                              ("LABEL", ("label", "bottom")),
+                              ("RETURN",),
+                              ("LABEL", ("label", "main")),
+                              ("DEFVAR", ("var", "GF@depth")), ("MOVE", ("var", "GF@depth"), ("int", "20000")),
+                              ("CALL", ("label", "deep")), ("WRITE", ("var", "GF@depth")))
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "program.xml")
+            with open(source, "wb") as source_file:
+                source_file.write(program)
+            process = subprocess.Popen([sys.executable, INTERPRET, "--source=" + source, "--input=" + os.devnull],
+                                       stdout=subprocess.DEVNULL)
+            _, status, usage = os.wait4(process.pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertLess(usage.ru_maxrss, 150 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# Tests of the Hooks API and the --trace reference hook
+
+import unittest
+
+from support import ENGINES, load_interpret, program_xml, run_program
+
+interpret = load_interpret()
+
+
+PROGRAM = program_xml(
+    ("DEFVAR", ("var", "GF@x")), ("CREATEFRAME",), ("DEFVAR", ("var", "TF@y")),
+    ("MOVE", ("var", "TF@y"), ("int", "2")), ("PUSHFRAME",), ("CALL", ("label", "function")), ("POPFRAME",),
+    ("WRITE", ("var", "GF@x")), ("EXIT", ("int", "0")),
+    ("LABEL", ("label", "function")), ("MOVE", ("var", "GF@x"), ("var", "LF@y")), ("RETURN",))
+
+
+class Recorder(interpret.Hooks):
+
+    def __init__(self):
+        self.events = []
+
+    def instruction_start(self, system, ip, instruction):
+        self.events.append(("start", ip, instruction.opcode))
+
+    def instruction_end(self, system, ip, instruction, next_ip):
+        self.events.append(("end", ip, next_ip))
+
+    def frame_push(self, system, frame):
+        self.events.append(("push",))
+
+    def frame_pop(self, system, frame):
+        self.events.append(("pop",))
+
+    def call(self, system, ip, label, next_ip):
+        self.events.append(("call", ip, label, next_ip))
+
+    def call_return(self, system, ip, next_ip):
+        self.events.append(("return", ip, next_ip))
+
+    def variable_write(self, system, variable, data):
+        self.events.append(("write", variable.name, data.type, data.value))
+
+
+class StartCounter(interpret.Hooks):
+
+    def __init__(self):
+        self.count = 0
+
+    def instruction_start(self, system, ip, instruction):
+        self.count += 1
+
+
+class FrameChanger(interpret.Hooks):
+
+    def __init__(self):
+        self.events = []
+
+    def frame_push(self, system, frame):
+        self.events.append(("push", {name: (data.type, data.value) for name, data in frame.items()}))
+        frame.clear()
+
+    def frame_pop(self, system, frame):
+        self.events.append(("pop", {name: (data.type, data.value) for name, data in frame.items()}))
+        frame["y"].value = 0
+
+
+class WriteKeeper(interpret.Hooks):
+
+    def __init__(self):
+        self.written = []
+
+    def variable_write(self, system, variable, data):
+        self.written.append(data)
+        data.value = "changed"
+
+
+class HooksTest(unittest.TestCase):
+
+    def test_events(self):
+        expected = [("start", 0, "DEFVAR"), ("end", 0, 1), ("start", 1, "CREATEFRAME"), ("end", 1, 2),
+                    ("start", 2, "DEFVAR"), ("end", 2, 3),
+                    ("start", 3, "MOVE"), ("write", "y", "int", 2), ("end", 3, 4),
+                    ("start", 4, "PUSHFRAME"), ("push",), ("end", 4, 5),
+                    ("start", 5, "CALL"), ("call", 5, "function", 10), ("end", 5, 10),
+                    ("start", 10, "MOVE"), ("write", "x", "int", 2), ("end", 10, 11),
+                    ("start", 11, "RETURN"), ("return", 11, 6), ("end", 11, 6),
+                    ("start", 6, "POPFRAME"), ("pop",), ("end", 6, 7),
+                    ("start", 7, "WRITE"), ("end", 7, 8), ("start", 8, "EXIT")]
+        for engine in ENGINES:
+            recorder = Recorder()
+            counter = StartCounter()
+            result = interpret.Interpreter(PROGRAM, engine=engine, hooks=[recorder, counter]).run()
+            self.assertEqual((result.exit_code, result.output), (0, "2"), engine)
+            self.assertEqual(recorder.events, expected, engine)
+            self.assertEqual(counter.count, 11, engine)
+
+    def test_frame_events_get_a_copy(self):
+        for engine in ENGINES:
+            hooks = FrameChanger()
+            result = interpret.Interpreter(PROGRAM, engine=engine, hooks=[hooks]).run()
+            self.assertEqual((result.exit_code, result.output), (0, "2"), engine)
+            self.assertEqual(hooks.events, [("push", {"y": ("int", 2)}), ("pop", {"y": ("int", 2)})], engine)
+
+        program = program_xml(("CREATEFRAME",), ("DEFVAR", ("var", "TF@y")), ("MOVE", ("var", "TF@y"), ("int", "1")),
+                              ("PUSHFRAME",), ("WRITE", ("var", "LF@y")), ("POPFRAME",), ("WRITE", ("var", "TF@y")))
+        for engine in ENGINES:
+            result = interpret.Interpreter(program, engine=engine, hooks=[FrameChanger()]).run()
+            self.assertEqual((result.exit_code, result.output), (0, "11"), engine)
+
+    def test_variable_write_gets_a_copy(self):
+        program = program_xml(("DEFVAR", ("var", "GF@s")), ("MOVE", ("var", "GF@s"), ("string", "ab")),
+                              ("CONCAT", ("var", "GF@s"), ("var", "GF@s"), ("string", "c")),
+                              ("SETCHAR", ("var", "GF@s"), ("int", "0"), ("string", "x")), ("WRITE", ("var", "GF@s")))
+        for engine in ENGINES:
+            hooks = WriteKeeper()
+            result = interpret.Interpreter(program, engine=engine, hooks=[hooks]).run()
+            self.assertEqual((result.exit_code, result.output), (0, "xbc"), engine)
+            self.assertEqual(len(set(map(id, hooks.written))), 3, engine)
+
+    def test_error_ends_events(self):
+        program = program_xml(("WRITE", ("string", "ok")), ("WRITE", ("var", "GF@x")), ("WRITE", ("string", "no")))
+        for engine in ENGINES:
+            recorder = Recorder()
+            result = interpret.Interpreter(program, engine=engine, hooks=[recorder]).run()
+            self.assertEqual((result.exit_code, result.output), (54, "ok"), engine)
+            self.assertEqual(recorder.events, [("start", 0, "WRITE"), ("end", 0, 1), ("start", 1, "WRITE")], engine)
+
+    def test_trace(self):
+        for engine in ENGINES:
+            process = run_program(PROGRAM, "--engine=" + engine, "--trace")
+            self.assertEqual((process.returncode, process.stdout), (0, b"2"), engine)
+            lines = process.stderr.decode("utf-8").splitlines()
+            self.assertEqual(len(lines), 11, engine)
+            self.assertEqual([line.split(":")[0] for line in lines],
+                             ["1", "2", "3", "4", "5", "6", "  11", "  12", "7", "8", "9"], engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Tests of program input read one line per READ
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from io import BytesIO, StringIO
+
+from support import ENGINES, INTERPRET, load_interpret, program_xml, run_program, run_script
+
+interpret = load_interpret()
+
+
+READ_ALL = program_xml(("DEFVAR", ("var", "GF@line")), ("DEFVAR", ("var", "GF@type")),
+                       ("LABEL", ("label", "loop")),
+                       ("READ", ("var", "GF@line"), ("type", "string")),
+                       ("TYPE", ("var", "GF@type"), ("var", "GF@line")),
+                       ("JUMPIFEQ", ("label", "end"), ("var", "GF@type"), ("string", "nil")),
+                       ("WRITE", ("string", "[")), ("WRITE", ("var", "GF@line")), ("WRITE", ("string", "]")),
+                       ("JUMP", ("label", "loop")),
+                       ("LABEL", ("label", "end")))
+
+
+class InputTest(unittest.TestCase):
+
+    def test_lines_until_end_of_file(self):
+        for program_input, output in ((b"a\nb\n", b"[a][b]"), (b"a\n\nlast", b"[a][][last]"),
+                                      (b"a\r\nb\r\n", b"[a][b]"), (b"", b"")):
+            for engine in ENGINES:
+                process = run_program(READ_ALL, "--engine=" + engine, program_input=program_input)
+                self.assertEqual((process.returncode, process.stdout), (0, output), (program_input, engine))
+
+    def test_input_from_stdin(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "program.xml")
+            with open(source, "wb") as source_file:
+                source_file.write(READ_ALL)
+            for engine in ENGINES:
+                for stdin in (b"x\ny", b"x\r\ny\r\n"):
+                    process = run_script("--source=" + source, "--engine=" + engine, stdin=stdin)
+                    self.assertEqual((process.returncode, process.stdout), (0, b"[x][y]"), (stdin, engine))
+
+    def test_text_input(self):
+        interpreter = interpret.Interpreter(READ_ALL)
+        for program_input in ("x\r\ny\r\n", "x\ry", StringIO("x\r\ny"), StringIO("x\ny\n")):
+            self.assertEqual(interpreter.run(program_input).output, "[x][y]", program_input)
+
+    def test_binary_input(self):
+        interpreter = interpret.Interpreter(READ_ALL)
+        for program_input in (b"\xc4\x8dau\r\nsvet\n", BytesIO(b"\xc4\x8dau\r\nsvet"), "\u010dau\r\nsvet"):
+            self.assertEqual(interpreter.run(program_input).output, "[\u010dau][svet]", program_input)
+
+    def test_input_file_is_closed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "program.xml")
+            input_path = os.path.join(directory, "program.in")
+            with open(source, "wb") as source_file:
+                source_file.write(READ_ALL)
+            with open(input_path, "wb") as input_file:
+                input_file.write(b"a\n")
+            process = subprocess.run([sys.executable, "-X", "dev", INTERPRET, "--source=" + source,
+                                      "--input=" + input_path], stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120)
+        self.assertEqual((process.returncode, process.stdout), (0, b"[a]"))
+        self.assertNotIn(b"ResourceWarning", process.stderr)
+
+    def test_missing_input_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            process = run_program(READ_ALL, "--input=" + os.path.join(directory, "missing.in"))
+        self.assertEqual(process.returncode, 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+# Tests of the label table built when the program is loaded
+
+import unittest
+
+from support import program_xml, run_program
+
+
+class LabelTest(unittest.TestCase):
+
+    def test_jumps_and_calls(self):
+        program = program_xml(("JUMP", ("label", "main")),
+                              ("LABEL", ("label", "print")), ("WRITE", ("string", "b")), ("RETURN",),
+                              ("LABEL", ("label", "main")), ("WRITE", ("string", "a")), ("CALL", ("label", "print")),
+                              ("JUMPIFEQ", ("label", "end"), ("int", "1"), ("int", "1")),
+                              ("WRITE", ("string", "skipped")),
+                              ("LABEL", ("label", "end")),
+                              ("JUMPIFNEQ", ("label", "print"), ("int", "1"), ("int", "1")),
+                              ("WRITE", ("string", "c")))
+        process = run_program(program)
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(process.stdout, b"abc")
+
+    def test_label_errors_before_running(self):
+        for instructions in ((("LABEL", ("label", "twice")), ("LABEL", ("label", "twice"))),
+                             (("JUMP", ("label", "missing")),),
+                             (("CALL", ("label", "missing")),),
+                             (("JUMPIFEQ", ("label", "missing"), ("int", "1"), ("int", "2")),),
+                             (("JUMPIFNEQ", ("label", "missing"), ("int", "1"), ("int", "1")),)):
+            process = run_program(program_xml(("WRITE", ("string", "started")), *instructions))
+            self.assertEqual(process.returncode, 52, instructions)
+            self.assertEqual(process.stdout, b"", instructions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+# Tests of the -O optimization levels
+
+import unittest
+
+from support import ENGINES, WistestCase, program_xml, read_wistest, run_program, run_script
+
+
+WISTESTS = ("opt_jump_into_block", "opt_loop_constant", "opt_read_after_call", "error_opt_unreachable_division")
+TYPE_WISTESTS = ("error_inferred_type_after_call", "error_inferred_type_loop", "error_inferred_type_read")
+
+TYPED_LOOP = program_xml(
+    ("DEFVAR", ("var", "GF@i")), ("DEFVAR", ("var", "GF@s")), ("DEFVAR", ("var", "GF@b")),
+    ("MOVE", ("var", "GF@i"), ("int", "0")), ("MOVE", ("var", "GF@s"), ("string", "")),
+    ("LABEL", ("label", "loop")),
+    ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("CONCAT", ("var", "GF@s"), ("var", "GF@s"), ("string", "x")),
+    ("LT", ("var", "GF@b"), ("var", "GF@i"), ("int", "5")),
+    ("JUMPIFEQ", ("label", "loop"), ("var", "GF@b"), ("bool", "true")),
+    ("STRLEN", ("var", "GF@i"), ("var", "GF@s")),
+    ("WRITE", ("var", "GF@i")), ("WRITE", ("var", "GF@s")))
+
+
+class OptimizerTest(WistestCase):
+
+    def test_wistests(self):
+        self.check_wistests(WISTESTS)
+
+    def test_inferred_types(self):
+        self.check_wistests(TYPE_WISTESTS)
+        for engine in ENGINES:
+            process = run_program(TYPED_LOOP, "--engine=" + engine, "-O", "2")
+            self.assertEqual((process.returncode, process.stdout), (0, b"5xxxxx"), engine)
+
+    def test_report(self):
+        source = read_wistest("opt_loop_constant")[0]
+        process = run_script("--source=" + source, "-O", "2", "--opt-report")
+        self.assertEqual(process.stderr.decode("utf-8").splitlines(),
+                         ["Optimization report:", "  constant operations folded: 2",
+                          "  instructions with proven types: 4", "  operands propagated: 3"])
+        process = run_script("--source=" + source, "-O", "0", "--opt-report")
+        self.assertEqual(process.stderr.decode("utf-8").splitlines(), ["Optimization report:", "  nothing applied"])
+
+
+if __name__ == "__main__":
+    unittest.main()
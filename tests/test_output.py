@@ -0,0 +1,64 @@
+# Tests of buffered program output
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import support
+from support import ENGINES, program_xml, run_program
+
+
+LOOP = program_xml(("DEFVAR", ("var", "GF@i")), ("MOVE", ("var", "GF@i"), ("int", "0")),
+                   ("LABEL", ("label", "loop")),
+                   ("WRITE", ("string", "0123456789")),
+                   ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+                   ("JUMPIFNEQ", ("label", "loop"), ("var", "GF@i"), ("int", "20000")))
+
+
+class OutputTest(unittest.TestCase):
+
+    def test_output_larger_than_buffer(self):
+        for engine in ENGINES:
+            process = run_program(LOOP, "--engine=" + engine)
+            self.assertEqual(process.returncode, 0)
+            self.assertEqual(process.stdout, b"0123456789" * 20000)
+
+    def test_flush_on_every_exit_path(self):
+        for end, exit_code in (((), 0), ((("EXIT", ("int", "3")),), 3), ((("POPFRAME",),), 55),
+                               ((("IDIV", ("var", "GF@x"), ("int", "1"), ("int", "0")),), 57)):
+            program = program_xml(("DEFVAR", ("var", "GF@x")), ("WRITE", ("string", "written")), *end)
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine)
+                self.assertEqual((process.returncode, process.stdout), (exit_code, b"written"), (end, engine))
+
+    def test_integer_too_long_to_write(self):
+        program = program_xml(("DEFVAR", ("var", "GF@x")), ("MOVE", ("var", "GF@x"), ("int", "10")),
+                              ("DEFVAR", ("var", "GF@i")), ("MOVE", ("var", "GF@i"), ("int", "0")),
+                              ("LABEL", ("label", "square")), ("MUL", ("var", "GF@x"), ("var", "GF@x"), ("var", "GF@x")),
+                              ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+                              ("JUMPIFNEQ", ("label", "square"), ("var", "GF@i"), ("int", "13")),
+                              ("WRITE", ("string", "ok")), ("DPRINT", ("var", "GF@x")), ("WRITE", ("var", "GF@x")))
+        for engine in ENGINES:
+            process = run_program(program, "--engine=" + engine)
+            self.assertEqual((process.returncode, process.stdout), (57, b"ok"), engine)
+            self.assertNotIn(b"Traceback", process.stderr, engine)
+
+    def test_interleave(self):
+        program = program_xml(("WRITE", ("string", "a")), ("DPRINT", ("string", "b")), ("WRITE", ("string", "c")),
+                              ("DPRINT", ("string", "d")))
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "program.xml")
+            with open(source, "wb") as source_file:
+                source_file.write(program)
+            for engine in ENGINES:
+                process = subprocess.run([sys.executable, support.INTERPRET, "--source=" + source, "--interleave",
+                                          "--engine=" + engine], stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+                self.assertEqual(process.returncode, 0)
+                self.assertEqual(process.stdout, b"abcd", engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+# Tests of the --peephole superinstructions
+
+import unittest
+
+from support import ENGINES, program_xml, run_program
+
+
+LOOP = program_xml(
+    ("DEFVAR", ("var", "GF@i")), ("DEFVAR", ("var", "GF@s")), ("DEFVAR", ("var", "GF@x")),
+    ("MOVE", ("var", "GF@i"), ("int", "0")), ("MOVE", ("var", "GF@s"), ("string", "")),
+    ("LABEL", ("label", "loop")),
+    ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFEQ", ("label", "end"), ("var", "GF@i"), ("int", "4")),
+    ("PUSHS", ("var", "GF@i")), ("POPS", ("var", "GF@x")),
+    ("CONCAT", ("var", "GF@s"), ("var", "GF@s"), ("string", "a")),
+    ("JUMP", ("label", "loop")),
+    ("LABEL", ("label", "end")),
+    ("SUB", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFNEQ", ("label", "end"), ("var", "GF@i"), ("int", "0")),
+    ("WRITE", ("var", "GF@s")), ("WRITE", ("var", "GF@x")))
+
+ERROR = program_xml(
+    ("DEFVAR", ("var", "GF@i")), ("WRITE", ("string", "ok")),
+    ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFEQ", ("label", "end"), ("var", "GF@i"), ("int", "4")),
+    ("LABEL", ("label", "end")))
+
+
+class PeepholeTest(unittest.TestCase):
+
+    def test_same_output(self):
+        for engine in ENGINES:
+            for arguments in ((), ("--peephole",)):
+                process = run_program(LOOP, "--engine=" + engine, *arguments)
+                self.assertEqual((process.returncode, process.stdout), (0, b"aaa3"), (engine, arguments))
+
+    def test_fused_error(self):
+        for engine in ENGINES:
+            process = run_program(ERROR, "--engine=" + engine, "--peephole")
+            self.assertEqual((process.returncode, process.stdout), (56, b"ok"), engine)
+
+    def test_report(self):
+        process = run_program(LOOP, "--peephole", "--opt-report")
+        self.assertEqual(process.returncode, 0)
+        report = process.stderr.decode("utf-8").splitlines()
+        self.assertEqual(report, ["Optimization report:", "  ADD+JUMPIFEQ: 1", "  CONCAT+JUMP: 1",
+                                  "  PUSHS+POPS: 1", "  SUB+JUMPIFNEQ: 1"])
+
+        process = run_program(LOOP, "--opt-report")
+        self.assertEqual(process.stderr.decode("utf-8").splitlines(), ["Optimization report:", "  nothing applied"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# Tests of --profile, counts and times per opcode, order and label region
+
+import json
+import os
+import tempfile
+import unittest
+
+from support import ENGINES, load_interpret, program_xml, run_program
+
+interpret = load_interpret()
+
+
+LOOP = program_xml(
+    ("DEFVAR", ("var", "GF@i")), ("MOVE", ("var", "GF@i"), ("int", "0")),
+    ("LABEL", ("label", "loop")),
+    ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFNEQ", ("label", "loop"), ("var", "GF@i"), ("int", "10")),
+    ("WRITE", ("var", "GF@i")), ("EXIT", ("int", "3")))
+
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "profile.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_profile(self):
+        with open(self.path) as profile_file:
+            return json.load(profile_file)
+
+    def test_counts(self):
+        for engine in ENGINES:
+            result = interpret.Interpreter(LOOP, engine=engine, profile=self.path).run()
+            self.assertEqual((result.exit_code, result.output), (3, "10"), engine)
+            self.assertTrue(result.error_output.startswith("Profile: 25 instructions"), engine)
+
+            profile = self.read_profile()
+            self.assertEqual(profile["instructions"], 25, engine)
+            self.assertEqual({entry["opcode"]: entry["count"] for entry in profile["opcodes"]},
+                             {"DEFVAR": 1, "MOVE": 1, "LABEL": 1, "ADD": 10, "JUMPIFNEQ": 10, "WRITE": 1, "EXIT": 1},
+                             engine)
+            self.assertEqual({entry["order"]: (entry["label"], entry["count"]) for entry in profile["orders"]},
+                             {1: (None, 1), 2: (None, 1), 3: ("loop", 1), 4: ("loop", 10), 5: ("loop", 10),
+                              6: ("loop", 1), 7: ("loop", 1)}, engine)
+            self.assertEqual({entry["label"]: entry["count"] for entry in profile["labels"]},
+                             {None: 2, "loop": 23}, engine)
+            self.assertTrue(all(entry["time"] >= 0 for entry in profile["orders"]), engine)
+
+    def test_error_is_profiled(self):
+        program = program_xml(("WRITE", ("string", "ok")), ("WRITE", ("var", "GF@x")))
+        process = run_program(program, "--profile=" + self.path)
+        self.assertEqual((process.returncode, process.stdout), (54, b"ok"))
+        self.assertEqual(self.read_profile()["instructions"], 2)
+
+    def test_unwritable_profile(self):
+        process = run_program(LOOP, "--profile=" + self.directory.name)
+        self.assertEqual((process.returncode, process.stdout), (3, b"10"))
+        program = program_xml(("WRITE", ("string", "ok")))
+        process = run_program(program, "--profile=" + self.directory.name)
+        self.assertEqual((process.returncode, process.stdout), (11, b"ok"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+# Tests of test.py, the conformance runner, on a generated wistests tree
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import ROOT, program_xml, run_script
+
+TEST_SCRIPT = os.path.join(ROOT, "test.py")
+
+
+TESTS = {
+    "int-only/write.src": program_xml(("WRITE", ("string", "hello"))),
+    "int-only/write.out": b"hello",
+    "int-only/read.src": program_xml(("DEFVAR", ("var", "GF@x")), ("READ", ("var", "GF@x"), ("type", "int")),
+                                     ("ADD", ("var", "GF@x"), ("var", "GF@x"), ("int", "1")),
+                                     ("WRITE", ("var", "GF@x"))),
+    "int-only/read.in": b"41\n",
+    "int-only/read.out": b"42",
+    "int-only/error.src": program_xml(("WRITE", ("var", "GF@x"))),
+    "int-only/error.rc": b"54\n",
+    "int-only/wrong_output.src": program_xml(("WRITE", ("string", "a"))),
+    "int-only/wrong_output.out": b"b",
+    "int-only/wrong_code.src": program_xml(("EXIT", ("int", "3"))),
+    "int-only/loop.src": program_xml(("LABEL", ("label", "loop")), ("JUMP", ("label", "loop"))),
+    "parse-only/header.src": b".IPPcode21\n",
+}
+
+# Stands in for interpret.py, run as a script it prints the engine it got,
+# imported by a worker it crashes in the middle of a test
+FAKE_INTERPRET = """
+import sys
+
+
+class LimitError(Exception):
+    pass
+
+
+class Interpreter:
+
+    def __init__(self, program, error, **options):
+        self.error = error
+
+    def run(self, program_input):
+        raise RuntimeError("crashed")
+
+
+if __name__ == "__main__":
+    print([argument for argument in sys.argv if argument.startswith("--engine=")][0], end="")
+"""
+
+
+class RunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, content in TESTS.items():
+            path = os.path.join(self.directory.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as test_file:
+                test_file.write(content)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_tests(self, *arguments):
+        report_path = os.path.join(self.directory.name, "report.json")
+        process = run_script("--directory=" + self.directory.name, "--report=" + report_path, "--jobs=2",
+                             "--timeout=1", *arguments, script=TEST_SCRIPT)
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        os.remove(report_path)
+        results = {os.path.basename(result["name"]): (result["status"], result["reason"])
+                   for result in report["tests"]}
+        return process.returncode, report["summary"], results
+
+    def test_int_only(self):
+        for arguments in ((), ("--subprocess",), ("-O2", "--peephole"), ("--subprocess", "-O1", "--engine=switch")):
+            exit_code, summary, results = self.run_tests("--int-only", *arguments)
+            self.assertEqual(exit_code, 1, arguments)
+            self.assertEqual((summary["tests"], summary["passed"], summary["failed"]), (6, 3, 3), arguments)
+            self.assertEqual(results, {"write": ("passed", None), "read": ("passed", None),
+                                       "error": ("passed", None), "wrong_output": ("failed", "output"),
+                                       "wrong_code": ("failed", "exit code"), "loop": ("failed", "timeout")},
+                             arguments)
+
+    def test_coverage(self):
+        shutil.rmtree(os.path.join(self.directory.name, "parse-only"))
+        os.remove(os.path.join(self.directory.name, "int-only", "loop.src"))
+        coverage_path = os.path.join(self.directory.name, "coverage.json")
+        for arguments in ((), ("--subprocess",)):
+            self.run_tests("--coverage=" + coverage_path, *arguments)
+            with open(coverage_path) as coverage_file:
+                programs = json.load(coverage_file)["programs"]
+            self.assertEqual(len(programs), 5, arguments)
+            os.remove(coverage_path)
+
+    def test_fake_interpret(self):
+        shutil.rmtree(os.path.join(self.directory.name, "parse-only"))
+        int_script = os.path.join(self.directory.name, "fake_interpret.py")
+        with open(int_script, "w") as script_file:
+            script_file.write(FAKE_INTERPRET)
+        with open(os.path.join(self.directory.name, "int-only", "write.out"), "w") as output_file:
+            output_file.write("--engine=switch")
+
+        exit_code, summary, results = self.run_tests("--int-script=" + int_script, "--subprocess", "--engine=switch")
+        self.assertEqual(results["write"], ("passed", None))
+
+        exit_code, summary, results = self.run_tests("--int-script=" + int_script)
+        self.assertEqual((exit_code, summary["failed"]), (1, 6))
+        self.assertEqual(results["write"], ("failed", "RuntimeError: crashed"))
+
+    def test_suites(self):
+        exit_code, summary, results = self.run_tests()
+        self.assertEqual((exit_code, summary["tests"]), (1, 7))
+        if shutil.which("php") == None and shutil.which("php7.4") == None:
+            self.assertEqual(results["header"][0], "skipped")
+
+        exit_code, summary, results = self.run_tests("--parse-only")
+        self.assertEqual(list(results), ["header"])
+
+        with open(os.path.join(self.directory.name, "top.src"), "wb") as source_file:
+            source_file.write(TESTS["int-only/write.src"])
+        exit_code, summary, results = self.run_tests("--int-only")
+        self.assertEqual(results["top"], ("failed", "output"))
+        self.assertNotIn("header", results)
+
+        shutil.rmtree(os.path.join(self.directory.name, "int-only"))
+        os.remove(os.path.join(self.directory.name, "top.src"))
+        exit_code, summary, results = self.run_tests("--int-only")
+        self.assertEqual((exit_code, summary["tests"]), (1, 0))
+
+    def test_missing_directory(self):
+        process = run_script("--directory=" + os.path.join(self.directory.name, "missing"), script=TEST_SCRIPT)
+        self.assertEqual(process.returncode, 41)
+
+
+if __name__ == "__main__":
+    unittest.main()
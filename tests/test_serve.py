@@ -0,0 +1,130 @@
+# Tests of --serve, jobs are read from stdin or a Unix domain socket
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from support import INTERPRET, program_xml, run_script
+
+
+WRITE_PROGRAM = program_xml(("WRITE", ("string", "hello"))).decode("utf-8")
+READ_PROGRAM = program_xml(("DEFVAR", ("var", "GF@line")), ("READ", ("var", "GF@line"), ("type", "string")),
+                           ("WRITE", ("var", "GF@line")), ("READ", ("var", "GF@line"), ("type", "string")),
+                           ("WRITE", ("var", "GF@line"))).decode("utf-8")
+LOOP_PROGRAM = program_xml(("WRITE", ("string", "x")), ("LABEL", ("label", "loop")),
+                           ("JUMP", ("label", "loop"))).decode("utf-8")
+OUTPUT_PROGRAM = program_xml(("LABEL", ("label", "loop")), ("WRITE", ("string", "abc")),
+                             ("JUMP", ("label", "loop"))).decode("utf-8")
+
+
+def serve(*jobs):
+    process = run_script("--serve", stdin="".join(json.dumps(job) + "\n" for job in jobs).encode("utf-8"))
+    responses = [json.loads(line) for line in process.stdout.decode("utf-8").splitlines()]
+    return process.returncode, [(response["id"], response["exit_code"], response["stdout"], response["error"])
+                                for response in responses]
+
+
+class ServeTest(unittest.TestCase):
+
+    def test_jobs_from_stdin(self):
+        self.assertEqual(serve({"id": 1, "program": WRITE_PROGRAM},
+                               {"id": 2, "program": READ_PROGRAM, "input": "a\nb\n", "engine": "transpile"},
+                               {"id": 3, "program": "<program"},
+                               {"id": 4, "program": WRITE_PROGRAM, "engine": "unknown"},
+                               {"id": 5, "program": WRITE_PROGRAM, "optimization_level": 2},
+                               {"id": 6}),
+                         (0, [(1, 0, "hello", None), (2, 0, "ab", None), (3, 31, "", "XMLFormatError"),
+                              (4, 10, "", "ArgumentError"), (5, 0, "hello", None), (6, 10, "", "ArgumentError")]))
+
+    def test_source_path(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "program.xml")
+            with open(path, "w") as source_file:
+                source_file.write(WRITE_PROGRAM)
+            first = {"id": 1, "source": path}
+            missing = {"id": 2, "source": os.path.join(directory, "missing.xml")}
+            self.assertEqual(serve(first, missing, first),
+                             (0, [(1, 0, "hello", None), (2, 11, "", "FileError"), (1, 0, "hello", None)]))
+
+    def test_limits(self):
+        exit_code, responses = serve({"id": 1, "program": LOOP_PROGRAM, "limits": {"time": 0.2}},
+                                     {"id": 2, "program": OUTPUT_PROGRAM, "limits": {"output": 10}},
+                                     {"id": 3, "program": WRITE_PROGRAM, "limits": {"time": -1}},
+                                     {"id": 4, "program": WRITE_PROGRAM, "limits": {"time": 5, "output": 5}})
+        self.assertEqual(exit_code, 0)
+        self.assertEqual([response[0] for response in responses], [1, 2, 3, 4])
+        self.assertEqual(responses[0][1:], (60, "x", "LimitError"))
+        self.assertEqual(responses[1][1:], (60, "abcabcabca", "LimitError"))
+        self.assertEqual(responses[2][1:], (10, "", "ArgumentError"))
+        self.assertEqual(responses[3][1:], (0, "hello", None))
+
+    def test_invalid_limits(self):
+        exit_code, responses = serve({"id": 1, "program": WRITE_PROGRAM, "limits": {"time": 1e300}},
+                                     {"id": 2, "program": WRITE_PROGRAM, "limits": {"time": float("inf")}},
+                                     {"id": 3, "program": WRITE_PROGRAM, "limits": {"output": 2.5}},
+                                     {"id": 4, "program": WRITE_PROGRAM, "limits": {"time": True}},
+                                     {"id": 5, "program": "\ud800"},
+                                     {"id": 6, "program": WRITE_PROGRAM})
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(responses, [(1, 10, "", "ArgumentError"), (2, 10, "", "ArgumentError"),
+                                     (3, 10, "", "ArgumentError"), (4, 10, "", "ArgumentError"),
+                                     (5, 99, "", "InternalError"), (6, 0, "hello", None)])
+
+    def start_server(self, path, workers):
+        server = subprocess.Popen([sys.executable, INTERPRET, "--serve", "--socket=" + path,
+                                   "--workers={}".format(workers)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(200):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        return server
+
+    def test_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "serve.socket")
+            server = self.start_server(path, 2)
+            try:
+                for job_id in range(3):
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                        client.connect(path)
+                        job = {"id": job_id, "program": READ_PROGRAM, "input": "{}\n".format(job_id)}
+                        client.sendall(json.dumps(job).encode("utf-8") + b"\n")
+                        client.shutdown(socket.SHUT_WR)
+                        with client.makefile("r", encoding="utf-8") as reader:
+                            response = json.loads(reader.readline())
+                    self.assertEqual((response["id"], response["exit_code"], response["stdout"]),
+                                     (job_id, 0, str(job_id)))
+            finally:
+                server.terminate()
+                server.wait(10)
+
+    def test_worker_is_replaced_after_time_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "serve.socket")
+            server = self.start_server(path, 1)
+            try:
+                jobs = [{"id": 1, "program": LOOP_PROGRAM, "limits": {"time": 0.2}},
+                        {"id": 2, "program": WRITE_PROGRAM}]
+                for expected in ([(1, 60, "x", "LimitError")], [(2, 0, "hello", None)]):
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                        client.connect(path)
+                        client.sendall("".join(json.dumps(job) + "\n" for job in jobs).encode("utf-8"))
+                        client.shutdown(socket.SHUT_WR)
+                        with client.makefile("r", encoding="utf-8") as reader:
+                            responses = [json.loads(line) for line in reader]
+                    self.assertEqual([(response["id"], response["exit_code"], response["stdout"], response["error"])
+                                      for response in responses], expected)
+                    jobs = jobs[1:]
+            finally:
+                server.terminate()
+                server.wait(10)
+
+
+if __name__ == "__main__":
+    unittest.main()
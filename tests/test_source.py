@@ -0,0 +1,110 @@
+# Tests of loading the XML source
+
+import os
+import tempfile
+import unittest
+
+from support import program_xml, run_program, run_script
+
+
+def source(*instructions):
+    """
+    Instructions are (order, XML of arguments) pairs of WRITE, given in document order
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<program language="IPPcode21">']
+    for order, arguments in instructions:
+        lines.append('<instruction order="{}" opcode="WRITE">{}</instruction>'.format(order, arguments))
+    lines.append('</program>')
+    return "\n".join(lines).encode("utf-8")
+
+
+def write(text):
+    return '<arg1 type="string">{}</arg1>'.format(text)
+
+
+class SourceTest(unittest.TestCase):
+
+    def test_orders_with_gaps_in_any_order(self):
+        for orders in ((1, 5, 30), (30, 1, 5), (5, 30, 1)):
+            program = source(*((order, write(str(order) + ";")) for order in orders))
+            process = run_program(program)
+            self.assertEqual((process.returncode, process.stdout), (0, b"1;5;30;"), orders)
+
+    def test_invalid_orders(self):
+        for orders in ((1, 1), (2, 1, 2), (0,), (-1,), ("x",), ("",)):
+            process = run_program(source(*((order, write("a")) for order in orders)))
+            self.assertEqual((process.returncode, process.stdout), (32, b""), orders)
+
+    def test_malformed_xml(self):
+        valid = source((1, write("a")))
+        for program in (b"", b"<program", b"<program language='IPPcode21'><instruction",
+                        valid.replace(b"</program>", b""), valid + b"<trailing/>",
+                        valid.replace(b"</instruction>", b"</instruction></wrong>"),
+                        source((1, write("a")), (2, "<arg1 type='string'>b</arg2>")),
+                        source((1, write("a")), (2, "<arg1 type='int'>x</arg1>"), (3, "<arg1>")),
+                        source((1, write("a")), (1, write("a")), (2, "<arg1>")),
+                        valid.replace(b'opcode="WRITE"', b'opcode="NOSUCH"').replace(b"</program>", b"<x></program>")):
+            for arguments in ((), ("--strict",)):
+                process = run_program(program, *arguments)
+                self.assertEqual((process.returncode, process.stdout), (31, b""), (program, arguments))
+
+    def test_validator_matches_schema(self):
+        valid = source((1, write("a")))
+        for program in (valid,
+                        valid.replace(b'language="IPPcode21"', b'language="IPPcode21" version="1"'),
+                        valid.replace(b'language="IPPcode21"', b''),
+                        valid.replace(b'opcode="WRITE"', b'opcode="WRITE" extra="1"'),
+                        valid.replace(b'<program language="IPPcode21">', b'<code language="IPPcode21">')
+                             .replace(b"</program>", b"</code>"),
+                        valid.replace(b"</instruction>", b"<note/></instruction>"),
+                        valid.replace(b"</instruction>", b"</instruction>text"),
+                        source((1, '<arg1 type="string">a</arg1><arg1 type="string">b</arg1>')),
+                        source((1, '<arg4 type="string">a</arg4>')),
+                        source((1, '<arg1 type="string" extra="1">a</arg1>')),
+                        source((1, '<arg1 type="string"><b/></arg1>'))):
+            default = run_program(program)
+            strict = run_program(program, "--strict")
+            self.assertEqual((default.returncode, default.stdout), (strict.returncode, strict.stdout), program)
+
+    def test_arguments_in_any_order(self):
+        arguments = {"arg1": '<arg1 type="var">GF@x</arg1>', "arg2": '<arg2 type="string">a</arg2>',
+                     "arg3": '<arg3 type="string">b</arg3>'}
+        for tags in (("arg1", "arg2", "arg3"), ("arg3", "arg1", "arg2"), ("arg2", "arg3", "arg1")):
+            program = ('<?xml version="1.0" encoding="UTF-8"?>\n<program language="IPPcode21">'
+                       '<instruction order="1" opcode="DEFVAR"><arg1 type="var">GF@x</arg1></instruction>'
+                       '<instruction order="2" opcode="CONCAT">{}<!-- note --></instruction>'
+                       '<instruction order="3" opcode="WRITE"><arg1 type="var">GF@x</arg1></instruction>'
+                       '</program>').format("\n".join(arguments[tag] for tag in tags)).encode("utf-8")
+            for options in ((), ("--strict",)):
+                process = run_program(program, *options)
+                self.assertEqual((process.returncode, process.stdout), (0, b"ab"), (tags, options))
+        for tags in (("arg2", "arg3"), ("arg1", "arg1", "arg2"), ("arg1", "arg2", "arg4")):
+            program = source((1, "".join('<{0} type="string">a</{0}>'.format(tag) for tag in tags)))
+            for options in ((), ("--strict",)):
+                process = run_program(program, *options)
+                self.assertEqual((process.returncode, process.stdout), (32, b""), (tags, options))
+
+    def test_large_program(self):
+        program = program_xml(*[("WRITE", ("int", str(order))) for order in range(20000)])
+        process = run_program(program)
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(process.stdout, "".join(map(str, range(20000))).encode("ascii"))
+
+    def test_source_from_stdin(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "program.in")
+            with open(input_path, "wb") as input_file:
+                input_file.write(b"line\n")
+            program = program_xml(("DEFVAR", ("var", "GF@x")), ("READ", ("var", "GF@x"), ("type", "string")),
+                                  ("WRITE", ("var", "GF@x")))
+            process = run_script("--input=" + input_path, stdin=program)
+        self.assertEqual((process.returncode, process.stdout), (0, b"line"))
+
+    def test_missing_source_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            process = run_script("--source=" + os.path.join(directory, "missing.xml"))
+        self.assertEqual(process.returncode, 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
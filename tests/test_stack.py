@@ -0,0 +1,64 @@
+# Tests of the data stack
+
+import unittest
+
+from support import ENGINES, WistestCase, program_xml, run_program
+
+
+DEEP = program_xml(
+    ("DEFVAR", ("var", "GF@i")), ("DEFVAR", ("var", "GF@x")), ("DEFVAR", ("var", "GF@sum")),
+    ("MOVE", ("var", "GF@i"), ("int", "0")), ("MOVE", ("var", "GF@sum"), ("int", "0")),
+    ("LABEL", ("label", "push")),
+    ("PUSHS", ("var", "GF@i")),
+    ("ADD", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFNEQ", ("label", "push"), ("var", "GF@i"), ("int", "100000")),
+    ("LABEL", ("label", "pop")),
+    ("POPS", ("var", "GF@x")),
+    ("ADD", ("var", "GF@sum"), ("var", "GF@sum"), ("var", "GF@x")),
+    ("SUB", ("var", "GF@i"), ("var", "GF@i"), ("int", "1")),
+    ("JUMPIFNEQ", ("label", "pop"), ("var", "GF@i"), ("int", "0")),
+    ("WRITE", ("var", "GF@sum")), ("WRITE", ("var", "GF@x")))
+
+TYPES = program_xml(
+    ("DEFVAR", ("var", "GF@x")), ("DEFVAR", ("var", "GF@t")),
+    ("PUSHS", ("int", "-7")), ("PUSHS", ("bool", "true")), ("PUSHS", ("nil", "nil")),
+    ("PUSHS", ("string", "a\\032b")),
+    *[instruction for _ in range(4) for instruction in (
+        ("POPS", ("var", "GF@x")), ("TYPE", ("var", "GF@t"), ("var", "GF@x")),
+        ("WRITE", ("var", "GF@t")), ("WRITE", ("string", ":")), ("WRITE", ("var", "GF@x")),
+        ("WRITE", ("string", ";")))])
+
+WISTESTS = ("stack_test", "stack_arithmetic", "stack_conversions", "stack_jumps", "stack_logic",
+            "opt_stack_jump_label", "error_stack_empty", "error_stack_int2chars", "error_stack_jump_type",
+            "error_stack_pops_after_clears", "error_stack_stri2ints", "error_stack_type",
+            "error_stack_undefined_label", "error_stack_zero_division")
+
+
+class StackTest(WistestCase):
+
+    def test_deep_stack(self):
+        for engine in ENGINES:
+            process = run_program(DEEP, "--engine=" + engine)
+            self.assertEqual((process.returncode, process.stdout), (0, b"49999500000"), engine)
+
+    def test_types_are_kept(self):
+        for engine in ENGINES:
+            process = run_program(TYPES, "--engine=" + engine)
+            self.assertEqual(process.returncode, 0, engine)
+            self.assertEqual(process.stdout, b"string:a b;nil:;bool:true;int:-7;", engine)
+
+    def test_pops_on_empty_stack(self):
+        for instructions in ((), (("PUSHS", ("int", "1")), ("POPS", ("var", "GF@x"))),
+                             (("PUSHS", ("int", "1")), ("CLEARS",))):
+            program = program_xml(("DEFVAR", ("var", "GF@x")), *instructions, ("WRITE", ("string", "ok")),
+                                  ("POPS", ("var", "GF@x")))
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine)
+                self.assertEqual((process.returncode, process.stdout), (56, b"ok"), (instructions, engine))
+
+    def test_wistests(self):
+        self.check_wistests(WISTESTS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Tests of strings edited in place by CONCAT and SETCHAR
+
+import unittest
+
+from support import ENGINES, program_xml, run_program
+
+
+def var(name):
+    return ("var", "GF@" + name)
+
+
+def string(value):
+    return ("string", value)
+
+
+EDITS = program_xml(
+    ("DEFVAR", var("s")), ("DEFVAR", var("copy")), ("DEFVAR", var("pushed")), ("DEFVAR", var("x")),
+    ("MOVE", var("s"), string("ab")),
+    ("CONCAT", var("s"), var("s"), string("cd")),
+    ("MOVE", var("copy"), var("s")),
+    ("PUSHS", var("s")),
+    ("CONCAT", var("s"), var("s"), string("e")),
+    ("SETCHAR", var("s"), ("int", "0"), string("X")),
+    ("POPS", var("pushed")),
+    ("WRITE", var("s")), ("WRITE", string(";")),
+    ("WRITE", var("copy")), ("WRITE", string(";")),
+    ("WRITE", var("pushed")), ("WRITE", string(";")),
+    ("STRLEN", var("x"), var("s")), ("WRITE", var("x")), ("WRITE", string(";")),
+    ("GETCHAR", var("x"), var("s"), ("int", "4")), ("WRITE", var("x")), ("WRITE", string(";")),
+    ("EQ", var("x"), var("s"), string("Xbcde")), ("WRITE", var("x")), ("WRITE", string(";")),
+    ("CONCAT", var("s"), var("copy"), var("s")), ("WRITE", var("s")), ("WRITE", string(";")),
+    ("CONCAT", var("s"), var("s"), var("s")), ("WRITE", var("s")))
+
+LOOP = program_xml(
+    ("DEFVAR", var("s")), ("DEFVAR", var("i")), ("DEFVAR", var("n")),
+    ("MOVE", var("s"), string("")), ("MOVE", var("i"), ("int", "0")),
+    ("LABEL", ("label", "append")),
+    ("CONCAT", var("s"), var("s"), string("a")),
+    ("ADD", var("i"), var("i"), ("int", "1")),
+    ("JUMPIFNEQ", ("label", "append"), var("i"), ("int", "100000")),
+    ("LABEL", ("label", "edit")),
+    ("SUB", var("i"), var("i"), ("int", "1")),
+    ("SETCHAR", var("s"), var("i"), string("b")),
+    ("JUMPIFNEQ", ("label", "edit"), var("i"), ("int", "0")),
+    ("STRLEN", var("n"), var("s")), ("WRITE", var("n")),
+    ("GETCHAR", var("s"), var("s"), ("int", "99999")), ("WRITE", var("s")))
+
+
+class StringTest(unittest.TestCase):
+
+    def test_edits_do_not_leak(self):
+        for engine in ENGINES:
+            process = run_program(EDITS, "--engine=" + engine)
+            self.assertEqual(process.returncode, 0, engine)
+            self.assertEqual(process.stdout, b"Xbcde;abcd;abcd;5;e;true;abcdXbcde;abcdXbcdeabcdXbcde", engine)
+
+    def test_long_loop(self):
+        for engine in ENGINES:
+            process = run_program(LOOP, "--engine=" + engine)
+            self.assertEqual((process.returncode, process.stdout), (0, b"100000b"), engine)
+
+    def test_errors(self):
+        for instruction, exit_code in ((("SETCHAR", var("s"), ("int", "3"), string("x")), 58),
+                                       (("SETCHAR", var("s"), ("int", "0"), string("")), 58),
+                                       (("GETCHAR", var("s"), var("s"), ("int", "3")), 58),
+                                       (("CONCAT", var("s"), var("s"), ("int", "1")), 53)):
+            program = program_xml(("DEFVAR", var("s")), ("MOVE", var("s"), string("a")),
+                                  ("CONCAT", var("s"), var("s"), string("bc")), ("WRITE", string("ok")), instruction)
+            for engine in ENGINES:
+                process = run_program(program, "--engine=" + engine)
+                self.assertEqual((process.returncode, process.stdout), (exit_code, b"ok"), (instruction, engine))
+
+
+if __name__ == "__main__":
+    unittest.main()